@@ -1,3 +1,11 @@
 # Using local JSON-based database instead of MongoDB Atlas
 # This is a temporary solution to bypass DNS/connection issues
-from .local_database import users_collection, measurements_collection, meal_plans_collection, chat_history_collection, get_database
+# Set DB_BACKEND=sqlite to share one SQLite (WAL) database between several workers
+import os
+
+if os.getenv("DB_BACKEND", "local").lower() == "sqlite":
+    from .sqlite_database import users_collection, measurements_collection, meal_plans_collection, chat_history_collection, jobs_collection, plan_pool_collection, get_database
+else:
+    from .local_database import users_collection, measurements_collection, meal_plans_collection, chat_history_collection, jobs_collection, plan_pool_collection, get_database
+
+from .local_database import InsertOne, UpdateOne, UpdateMany, DeleteOne, BulkWriteError
@@ -1,153 +1,924 @@
+import asyncio
+import bisect
+import copy
+import heapq
+import itertools
 import json
 import os
-from typing import Optional, Dict, Any
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Union
 
-# Simple JSON file-based database
+from . import local_db_format
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Simple JSON file-based database.
+# The snapshot (local_db.json) is loaded once and kept in memory. Every write is
+# appended to an operation log (local_db.log) instead of rewriting the snapshot,
+# and the log is folded back into the snapshot in the background once it grows.
+# Several worker processes can share the files: writes hold an advisory lock on
+# local_db.lock, and each process replays only the log records it has not seen.
 DB_FILE = os.path.join(os.path.dirname(__file__), "../local_db.json")
+BINARY_DB_FILE = os.path.join(os.path.dirname(__file__), "../local_db.bin")
+LOG_FILE = os.path.join(os.path.dirname(__file__), "../local_db.log")
+LOCK_FILE = os.path.join(os.path.dirname(__file__), "../local_db.lock")
+
+# Number of logged operations after which the log is compacted into the snapshot
+COMPACT_THRESHOLD = int(os.getenv("LOCAL_DB_COMPACT_THRESHOLD", "1000"))
+
+# Writes are committed by a single writer thread in batches. The writer waits
+# FLUSH_INTERVAL_MS after the first queued write to collect concurrent ones.
+# FSYNC_POLICY "batch" fsyncs every batch before acknowledging it, "off" only
+# hands the batch to the OS.
+FLUSH_INTERVAL_MS = float(os.getenv("LOCAL_DB_FLUSH_INTERVAL_MS", "2"))
+FSYNC_POLICY = os.getenv("LOCAL_DB_FSYNC", "batch").lower()
+
+# Snapshot format: "json" keeps the readable local_db.json, "binary" uses the
+# compact record format in local_db_format (see scripts/migrate_local_db.py)
+DB_FORMAT = os.getenv("LOCAL_DB_FORMAT", "json").lower()
+
+
+def _read_log(path, offset: int = 0):
+    """Read the complete log records after offset; returns (records, offset of the end)"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+
+    records = []
+    # The piece after the last newline is a torn write from a crash (or empty)
+    for line in data.split(b"\n")[:-1]:
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        offset += len(line) + 1
+    return records, offset
+
+
+def _read_snapshot(path: str):
+    """Load a JSON or binary snapshot; returns (collections, meta)"""
+    if not os.path.exists(path):
+        return {"users": [], "measurements": []}, {}
+    if local_db_format.is_binary_snapshot(path):
+        reader = local_db_format.SnapshotReader(path)
+        return reader.read_all(), reader.meta
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    meta = snapshot.pop("_meta", {})
+    return snapshot, meta
+
+
+def _write_snapshot(f, collections: Dict[str, List[Dict[str, Any]]], meta: Dict[str, Any], binary: bool):
+    if binary:
+        local_db_format.write_snapshot(f, collections, meta)
+    else:
+        f.write(json.dumps({**collections, "_meta": meta}, indent=2).encode('utf-8'))
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+def _fsync_dir(path: str):
+    """Persist a rename by syncing the parent directory (not supported on Windows)"""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_temp(path: str, write) -> str:
+    """Write a sibling temp file through write(f) and fsync it; returns the temp path"""
+    # Unique per thread, so concurrent writers of one process never share a temp file
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return tmp_file
+
+
+class _FileLock:
+    """Advisory inter-process lock: shared for readers, exclusive for writers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def _fileno(self) -> int:
+        # A forked child must not share the parent's lock
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def hold(self, exclusive: bool = True, blocking: bool = True):
+        """Hold the lock; without blocking, raise BlockingIOError if another process has it"""
+        fd = self._fileno()
+        if fcntl:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            fcntl.flock(fd, flags if blocking else flags | fcntl.LOCK_NB)
+        else:
+            # msvcrt only has exclusive locks; LK_LOCK gives up after ~10s, so retry
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        raise BlockingIOError("local database lock is held")
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _sort_key(value):
+    """Order values of mixed types consistently: None < numbers < strings < anything else"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (bool, int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+
+def _matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, value in query.items():
+        if doc.get(key) != value:
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Copy a document, keeping only the fields selected by a MongoDB-style projection
+    on top-level fields, e.g. {"plan_data": 0} or {"goal": 1, "_id": 0}.
+    Fields that are left out are never copied.
+    """
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    inclusive = any(fields.values())
+    result = {}
+    for key, value in doc.items():
+        if key == "_id":
+            keep = include_id
+        elif inclusive:
+            keep = fields.get(key)
+        else:
+            keep = key not in fields
+        if keep:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+_MISSING = object()
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the top-level fields a MongoDB-style update ($set, $inc, $push) changes"""
+    changes = {}
+    for operator, fields in update.items():
+        for key, value in fields.items():
+            current = changes.get(key, doc.get(key))
+            if operator == "$set":
+                changes[key] = value
+            elif operator == "$inc":
+                changes[key] = (current or 0) + value
+            elif operator == "$push":
+                if current is not None and not isinstance(current, list):
+                    raise ValueError(f"Cannot $push to non-list field '{key}'")
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                changes[key] = list(current or []) + list(items)
+            else:
+                raise ValueError(f"Unsupported update operator: {operator}")
+    return {k: v for k, v in changes.items() if doc.get(k, _MISSING) != v}
+
+
+class BulkWriteError(Exception):
+    """Raised when some operations of a bulk write failed; details holds the partial result"""
+
+    def __init__(self, details: Dict[str, Any]):
+        super().__init__(f"{len(details['errors'])} bulk write operation(s) failed: {details['errors']}")
+        self.details = details
+
+
+class InsertOne:
+    def __init__(self, document: Dict[str, Any]):
+        self.document = document
+
+    def _op(self):
+        return ("insert", (self.document,))
+
+
+class UpdateOne:
+    def __init__(self, query: Dict[str, Any], update: Dict[str, Any]):
+        self.query, self.update = query, update
+
+    def _op(self):
+        return ("update_one", (self.query, self.update))
+
+
+class UpdateMany(UpdateOne):
+    def _op(self):
+        return ("update_many", (self.query, self.update))
+
+
+class DeleteOne:
+    def __init__(self, query: Dict[str, Any]):
+        self.query = query
+
+    def _op(self):
+        return ("delete_one", (self.query,))
+
+
+def _run_bulk(execute, ops: List[tuple], ordered: bool = True) -> Dict[str, Any]:
+    """
+    Run (op, args) pairs through execute(op, args) and merge their results.
+    Ordered writes stop at the first error; unordered ones carry on and report all errors.
+    """
+    result = {"inserted_ids": {}, "matched_count": 0, "modified_count": 0, "deleted_count": 0, "errors": []}
+    for i, (op, args) in enumerate(ops):
+        try:
+            outcome = execute(op, args)
+        except Exception as e:
+            result["errors"].append({"index": i, "op": op, "error": str(e)})
+            if ordered:
+                break
+            continue
+        if op == "insert":
+            result["inserted_ids"][i] = outcome
+        elif op == "delete_one":
+            result["deleted_count"] += outcome
+        else:
+            result["matched_count"] += outcome["matched_count"]
+            result["modified_count"] += outcome["modified_count"]
+    return result
+
+
+class _Index:
+    """Hash index on equality fields whose buckets are kept ordered by sort_field"""
+
+    def __init__(self, fields, sort_field: Optional[str] = None):
+        self.fields = tuple(fields)
+        self.sort_field = sort_field
+        # bucket key -> sorted list of (sort key, insertion ordinal, _id)
+        self.buckets: Dict[tuple, list] = {}
+        self.entries: Dict[Any, tuple] = {}
+
+    def clear(self):
+        self.buckets = {}
+        self.entries = {}
+
+    def covers(self, changed: Dict[str, Any]) -> bool:
+        return any(f in changed for f in self.fields) or self.sort_field in changed
+
+    def add(self, doc: Dict[str, Any], ordinal: int):
+        key = tuple(doc.get(f) for f in self.fields)
+        sort_key = _sort_key(doc.get(self.sort_field, '')) if self.sort_field else 0
+        entry = (sort_key, ordinal, doc["_id"])
+        try:
+            bucket = self.buckets.setdefault(key, [])
+        except TypeError:
+            return  # Unhashable values can never equal a hashable query value
+        bisect.insort(bucket, entry)
+        self.entries[doc["_id"]] = (key, entry)
+
+    def remove(self, doc_id):
+        found = self.entries.pop(doc_id, None)
+        if found is None:
+            return
+        key, entry = found
+        bucket = self.buckets[key]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        if not bucket:
+            del self.buckets[key]
+
+    def scan(self, key: tuple, direction: int = 1):
+        """Yield _ids in the bucket in index order, keeping insertion order among ties"""
+        bucket = self.buckets.get(key, [])
+        if direction != -1:
+            for entry in bucket:
+                yield entry[2]
+            return
+        # Walk backwards one group of equal sort keys at a time, like a stable reverse sort
+        i = len(bucket) - 1
+        while i >= 0:
+            lo = bisect.bisect_left(bucket, (bucket[i][0],))
+            for entry in bucket[lo:i + 1]:
+                yield entry[2]
+            i = lo - 1
+
+
+class LocalStore:
+    """In-memory copy of the database backed by a snapshot and an append-only log"""
+
+    def __init__(self, db_file: str, log_file: str, lock_file: Optional[str] = None,
+                 binary: Optional[bool] = None):
+        self.db_file = db_file
+        self.binary = db_file.endswith(".bin") if binary is None else binary
+        self.log_file = log_file
+        self._file_lock = _FileLock(lock_file or os.path.splitext(log_file)[0] + ".lock")
+        # Lock order: _log_lock, then _file_lock, then lock
+        self.lock = threading.RLock()
+        self.collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.seq = 0
+        self._next_id: Dict[str, int] = {}
+        # Insertion ordinal per document, so index scans can keep collection order
+        self._ordinals: Dict[str, Dict[Any, int]] = {}
+        self._next_ordinal = 0
+        self.indexes: Dict[str, List[_Index]] = {}
+        # Append handle, inode and consumed length of the log file
+        self._log = None
+        self._log_ino = None
+        self._log_offset = 0
+        # Length of the log the in-memory state reflects, including a commit of
+        # this process still being synced
+        self._log_applied = 0
+        # Serializes threads of this process around the log file and the file lock
+        self._log_lock = threading.Lock()
+        self._queue: List[tuple] = []
+        self._queue_ready = threading.Condition()
+        self._writer = None
+        self._pending_ops = 0
+        self._compacting = False
+        # Compactions of this process run one at a time; a second one would redo the same work
+        self._compact_lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._log_lock, self._file_lock.hold(exclusive=False), self.lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self):
+        """Rebuild the in-memory state from the snapshot and the log"""
+        self.collections, self._next_id, self._ordinals = {}, {}, {}
+        self._next_ordinal = 0
+        self._pending_ops = 0
+        if not os.path.exists(self.db_file):
+            # Starting empty would drop every document of the other format's snapshot
+            other = os.path.splitext(self.db_file)[0] + (".json" if self.binary else ".bin")
+            if os.path.exists(other):
+                raise RuntimeError(f"{self.db_file} not found but {other} exists; convert it with "
+                                   f"scripts/migrate_local_db.py{'' if self.binary else ' --to-json'} first")
+        snapshot, meta = _read_snapshot(self.db_file)
+        self.seq = meta.get("seq", 0)
+        for name, docs in snapshot.items():
+            self._collection(name)
+            for doc in docs:
+                if "_id" not in doc:
+                    doc["_id"] = self._new_id(name)
+                self._put(name, doc)
+
+        for name, indexes in self.indexes.items():
+            for index in indexes:
+                index.clear()
+                self._build_index(name, index)
+
+        # Replay operations that are not part of the snapshot yet
+        self._close_log()
+        self._catch_up(reload=False)
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+        self._log, self._log_ino, self._log_offset, self._log_applied = None, None, 0, 0
 
-def _load_db():
-    """Load database from JSON file"""
-    if not os.path.exists(DB_FILE):
-        return {"users": [], "measurements": []}
-    with open(DB_FILE, 'r') as f:
-        return json.load(f)
+    def _catch_up(self, reload: bool = True):
+        """Apply log records written since we last read the log (by any process)"""
+        try:
+            ino = os.stat(self.log_file).st_ino
+        except FileNotFoundError:
+            ino = None
+        if ino != self._log_ino:
+            # The log was created, or replaced by a compaction
+            self._close_log()
+            self._log_ino = ino
+
+        records, self._log_offset = _read_log(self.log_file, self._log_offset)
+        self._log_applied = self._log_offset
+        for record in records:
+            if record["seq"] <= self.seq:
+                continue
+            if record["op"] == "snapshot" or record["seq"] != self.seq + 1:
+                if not reload:
+                    # The log continues from a later snapshot than the one we loaded
+                    start = record["seq"] if record["op"] == "snapshot" else record["seq"] - 1
+                    raise RuntimeError(f"{self.log_file} continues from seq {start} but "
+                                       f"{self.db_file} is at seq {self.seq}; refusing to load a partial database")
+                # Another process compacted past our state; start over from its snapshot
+                self._load()
+                return
+            if record["op"] != "snapshot":
+                self._apply(record)
+                self._pending_ops += 1
+            self.seq = record["seq"]
+
+    def refresh(self):
+        """Pick up writes committed by other processes; cheap when nothing changed"""
+        self._ensure_loaded()
+        try:
+            st = os.stat(self.log_file)
+            current = (st.st_ino, st.st_size)
+        except FileNotFoundError:
+            current = (None, 0)
+        if current == (self._log_ino, self._log_applied):
+            return
+        # Never wait for a commit in progress: while our writer thread holds the log
+        # lock, or another process holds the file lock, the log is being synced, and
+        # reads are served from memory until the next refresh
+        if not self._log_lock.acquire(blocking=False):
+            return
+        try:
+            with self._file_lock.hold(exclusive=False, blocking=False), self.lock:
+                self._catch_up()
+        except BlockingIOError:
+            pass
+        finally:
+            self._log_lock.release()
+
+    def _collection(self, name: str) -> Dict[str, Dict[str, Any]]:
+        if name not in self.collections:
+            self.collections[name] = {}
+            self._next_id.setdefault(name, 1)
+        return self.collections[name]
+
+    def _track_id(self, name: str, doc_id):
+        try:
+            self._next_id[name] = max(self._next_id.get(name, 1), int(doc_id) + 1)
+        except (TypeError, ValueError):
+            pass
+
+    def _new_id(self, name: str) -> str:
+        self._collection(name)
+        doc_id = str(self._next_id[name])
+        self._next_id[name] += 1
+        return doc_id
+
+    def _put(self, name: str, doc: Dict[str, Any]):
+        coll = self._collection(name)
+        coll[doc["_id"]] = doc
+        self._track_id(name, doc["_id"])
+        self._ordinals.setdefault(name, {})[doc["_id"]] = self._next_ordinal
+        self._next_ordinal += 1
+
+    def _build_index(self, name: str, index: _Index):
+        ordinals = self._ordinals.get(name, {})
+        for doc_id, doc in self._collection(name).items():
+            index.add(doc, ordinals[doc_id])
+
+    def _apply(self, record: Dict[str, Any]):
+        """Apply a logged operation to the in-memory collections and their indexes"""
+        name = record["c"]
+        coll = self._collection(name)
+        indexes = self.indexes.get(name, [])
+        op = record["op"]
+        if op == "insert":
+            doc = record["doc"]
+            self._put(name, doc)
+            for index in indexes:
+                index.add(doc, self._ordinals[name][doc["_id"]])
+        elif op == "update":
+            doc = coll.get(record["id"])
+            if doc is not None:
+                # Copy-on-write so snapshots taken for compaction stay consistent
+                doc = coll[record["id"]] = {**doc, **record["set"]}
+                for index in indexes:
+                    if index.covers(record["set"]):
+                        index.remove(doc["_id"])
+                        index.add(doc, self._ordinals[name][doc["_id"]])
+        elif op == "delete":
+            if coll.pop(record["id"], None) is not None:
+                self._ordinals[name].pop(record["id"], None)
+                for index in indexes:
+                    index.remove(record["id"])
+
+    def _record(self, pending: List[Dict[str, Any]], records: List[bytes]):
+        """Encode operations, then apply them and stage their log lines for the next log write"""
+        # Encoded first, so a document that cannot be stored fails only its own write
+        lines = [_encode({**record, "seq": self.seq + i}) for i, record in enumerate(pending, 1)]
+        for record, line in zip(pending, lines):
+            self.seq += 1
+            record["seq"] = self.seq
+            self._apply(record)
+            records.append(line)
+            self._pending_ops += 1
+
+    def create_index(self, name: str, fields, sort_field: Optional[str] = None):
+        """Declare a hash index on fields, optionally ordered by sort_field within each key"""
+        with self.lock:
+            index = _Index(fields, sort_field)
+            self.indexes.setdefault(name, []).append(index)
+            if self._loaded:
+                self._build_index(name, index)
+
+    def _pick_index(self, name: str, query: Dict[str, Any], sort_field: Optional[str]):
+        best, best_score = None, None
+        for index in self.indexes.get(name, []):
+            if not all(f in query for f in index.fields):
+                continue
+            try:
+                hash(tuple(query[f] for f in index.fields))
+            except TypeError:
+                continue
+            sorted_match = sort_field is not None and index.sort_field == sort_field
+            if not index.fields and not sorted_match:
+                continue
+            score = (sorted_match, len(index.fields))
+            if best_score is None or score > best_score:
+                best, best_score = index, score
+        return best
+
+    def query(self, name: str, query: Dict[str, Any], sort_field: Optional[str] = None,
+              direction: int = 1, skip: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return references to matching documents, using an index for lookup and ordering when one fits"""
+        self._ensure_loaded()
+        with self.lock:
+            coll = self.collections.get(name, {})
+            index = self._pick_index(name, query, sort_field)
+            presorted = index is not None and sort_field is not None and index.sort_field == sort_field
+
+            def matches():
+                if isinstance(query.get("_id"), str):
+                    # Primary key lookup
+                    doc = coll.get(query["_id"])
+                    return iter([doc] if doc is not None and _matches(doc, query) else [])
+                if index is None:
+                    return (doc for doc in coll.values() if _matches(doc, query))
+                key = tuple(query[f] for f in index.fields)
+                residual = {k: v for k, v in query.items() if k not in index.fields}
+                if presorted:
+                    # Index seek: the bucket is already in the requested order
+                    ids = index.scan(key, direction)
+                elif index.sort_field:
+                    # Bucket is ordered by another field; restore collection order
+                    ids = sorted(index.scan(key), key=self._ordinals[name].__getitem__)
+                else:
+                    ids = index.scan(key)
+                return (coll[i] for i in ids if _matches(coll[i], residual))
+
+            stop = skip + limit if limit is not None else None
+            if sort_field and not presorted:
+                results = self._sorted(matches, sort_field, direction, stop)
+            else:
+                results = list(itertools.islice(matches(), stop))
+        return results[skip:]
+
+    def count(self, name: str, query: Dict[str, Any]) -> int:
+        """Count matching documents without copying them"""
+        self._ensure_loaded()
+        with self.lock:
+            index = self._pick_index(name, query, None)
+            if index is not None and len(index.fields) == len(query):
+                # Every condition is answered by the index: the bucket size is the count
+                return len(index.buckets.get(tuple(query[f] for f in index.fields), ()))
+            return len(self.query(name, query))
+
+    @staticmethod
+    def _sorted(matches, sort_field: str, direction: int, count: Optional[int]):
+        """Sort matches; with a count only the top entries are kept, in a bounded heap"""
+        key = lambda x: x.get(sort_field, '')
+        try:
+            if count is None:
+                return sorted(matches(), key=key, reverse=(direction == -1))
+            # Both are stable, equivalent to sorted(...)[:count]
+            if direction == -1:
+                return heapq.nlargest(count, matches(), key=key)
+            return heapq.nsmallest(count, matches(), key=key)
+        except TypeError:
+            return list(itertools.islice(matches(), count))  # If sorting fails, just return unsorted
+
+    def submit(self, op: str, name: str, *args) -> Future:
+        """Queue a write for the writer thread; the future resolves once it is committed"""
+        self._ensure_loaded()
+        future = Future()
+        with self._queue_ready:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+                self._writer.start()
+            self._queue.append((op, name, copy.deepcopy(args), future))
+            self._queue_ready.notify()
+        return future
+
+    async def execute(self, op: str, name: str, *args):
+        """Queue a write and wait for its commit acknowledgement"""
+        return await asyncio.wrap_future(self.submit(op, name, *args))
+
+    def _execute(self, op: str, name: str, args: tuple, records: List[bytes]):
+        """Resolve a queued write against the current state; returns the caller's result"""
+        if op == "insert":
+            document = args[0]
+            if "_id" not in document:
+                document["_id"] = self._new_id(name)
+            elif document["_id"] in self._collection(name):
+                raise ValueError(f"Duplicate _id '{document['_id']}' in {name}")
+            self._record([{"op": "insert", "c": name, "doc": document}], records)
+            return document["_id"]
+        if op in ("update_one", "update_many"):
+            query, update = args
+            docs = self.query(name, query, limit=1 if op == "update_one" else None)
+            pending = []
+            for doc in docs:
+                # Only the resulting field values are logged, so replay is deterministic
+                changes = _apply_update(doc, update)
+                if changes:
+                    pending.append({"op": "update", "c": name, "id": doc["_id"], "set": changes})
+            self._record(pending, records)
+            return {"matched_count": len(docs), "modified_count": len(pending)}
+        if op == "bulk_write":
+            ops, ordered = args
+            return _run_bulk(lambda o, a: self._execute(o, name, a, records), ops, ordered)
+        if op == "delete_one":
+            docs = self.query(name, args[0], limit=1)
+            if docs:
+                self._record([{"op": "delete", "c": name, "id": docs[0]["_id"]}], records)
+            return len(docs)
+        raise ValueError(f"Unknown write operation: {op}")
+
+    def _writer_loop(self):
+        while True:
+            with self._queue_ready:
+                while not self._queue:
+                    self._queue_ready.wait()
+            if FLUSH_INTERVAL_MS > 0:
+                time.sleep(FLUSH_INTERVAL_MS / 1000)
+            with self._queue_ready:
+                batch, self._queue = self._queue, []
+            self._commit(batch)
+
+    def _commit(self, batch: List[tuple]):
+        """Apply a batch of writes and make it durable with a single log write"""
+        # Writes whose caller was cancelled while queued are dropped; the rest
+        # can no longer be cancelled, so their results can always be set
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        records, outcomes, error = [], [], None
+        try:
+            with self._log_lock, self._file_lock.hold(exclusive=True):
+                with self.lock:
+                    # Resolve against the latest state, including other processes' writes
+                    self._catch_up()
+                    for op, name, args, future in batch:
+                        try:
+                            outcomes.append((future, self._execute(op, name, args, records), None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+
+                if records:
+                    try:
+                        self._append(records)
+                    except Exception:
+                        # The batch is already applied in memory; go back to what is on disk
+                        with self.lock:
+                            self._rollback()
+                        raise
+        except Exception as e:
+            print(f"Error writing local database log: {e}")
+            error = e
+
+        for future, result, exc in outcomes:
+            if exc or error:
+                future.set_exception(exc or error)
+            else:
+                future.set_result(result)
+        if error and not outcomes:
+            for _, _, _, future in batch:
+                future.set_exception(error)
+
+        if self._pending_ops >= COMPACT_THRESHOLD and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _append(self, records: List[bytes]):
+        if self._log is None:
+            self._log = open(self.log_file, 'ab')
+            self._log_ino = os.fstat(self._log.fileno()).st_ino
+        # Drop a torn record left behind by a crashed writer
+        if os.fstat(self._log.fileno()).st_size > self._log_offset:
+            self._log.truncate(self._log_offset)
+        self._log.write(b"".join(records))
+        self._log.flush()
+        # The records are applied in memory already; reads need not wait for the sync
+        self._log_applied = self._log.tell()
+        if FSYNC_POLICY != "off":
+            os.fsync(self._log.fileno())
+        self._log_offset = self._log.tell()
+
+    def _rollback(self):
+        """Undo a batch whose log write failed: cut the log back and reload from disk"""
+        try:
+            if self._log is not None:
+                self._log.truncate(self._log_offset)
+        except OSError as e:
+            # A partial record is dropped on the next read anyway
+            print(f"Error truncating local database log: {e}")
+        self._load()
+
+    def dump(self):
+        """Return (seq, {collection: [documents]}) as a consistent, read-only view"""
+        self._ensure_loaded()
+        with self.lock:
+            # Documents are replaced rather than mutated, so a shallow copy is a stable view
+            return self.seq, {name: list(coll.values()) for name, coll in self.collections.items()}
+
+    def compact(self):
+        """Write the in-memory state as a new snapshot and trim the log"""
+        with self._compact_lock:
+            try:
+                seq, view = self.dump()
+
+                # Serialize outside the locks so writers keep going meanwhile
+                tmp_file = _write_temp(self.db_file, lambda f: _write_snapshot(f, view, {"seq": seq}, self.binary))
+
+                with self._log_lock, self._file_lock.hold(exclusive=True):
+                    with self.lock:
+                        self._catch_up()
+                    records, _ = _read_log(self.log_file)
+                    if records and records[0]["op"] == "snapshot" and records[0]["seq"] >= seq:
+                        # Another process already compacted further
+                        os.remove(tmp_file)
+                        return
+                    os.replace(tmp_file, self.db_file)
+                    _fsync_dir(self.db_file)
+
+                    # The log restarts with a marker of the snapshot it continues from
+                    remaining = [{"seq": seq, "op": "snapshot"}] + [r for r in records if r["seq"] > seq]
+                    tmp_log = _write_temp(self.log_file, lambda f: f.write(b"".join(_encode(r) for r in remaining)))
+                    self._close_log()
+                    os.replace(tmp_log, self.log_file)
+                    _fsync_dir(self.log_file)
+                    with self.lock:
+                        self._pending_ops = len(remaining) - 1
+                        self._log_ino = os.stat(self.log_file).st_ino
+                        self._log_offset = self._log_applied = sum(len(_encode(r)) for r in remaining)
+            except Exception as e:
+                print(f"Error compacting local database: {e}")
+            finally:
+                self._compacting = False
+
+
+_store = LocalStore(BINARY_DB_FILE if DB_FORMAT == "binary" else DB_FILE, LOG_FILE, LOCK_FILE)
 
-def _save_db(data):
-    """Save database to JSON file"""
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
 
 class LocalCollection:
     """Simple collection that mimics MongoDB collection interface"""
-    
-    def __init__(self, collection_name: str):
+
+    def __init__(self, collection_name: str, store: LocalStore = _store):
         self.collection_name = collection_name
-    
-    async def find_one(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        self.store = store
+
+    def create_index(self, fields: Union[str, List[str]], sort_field: Optional[str] = None):
+        """Declare an index on one or more equality fields, optionally ordered by sort_field"""
+        if isinstance(fields, str):
+            fields = [fields]
+        self.store.create_index(self.collection_name, fields, sort_field)
+
+    def _stream(self, query: Dict[str, Any], sort_field: Optional[str] = None,
+                direction: int = 1, skip: int = 0, limit: Optional[int] = None,
+                projection: Optional[Dict[str, Any]] = None):
+        """Yield copies of the matching documents, copying each one only when it is consumed"""
+        self.store.refresh()
+        docs = self.store.query(self.collection_name, query, sort_field, direction, skip, limit)
+        return (_project(doc, projection) for doc in docs)
+
+    async def find_one(self, query: Dict[str, Any],
+                       projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Find one document matching the query"""
-        db = _load_db()
-        collection = db.get(self.collection_name, [])
-        
-        for doc in collection:
-            match = True
-            for key, value in query.items():
-                if doc.get(key) != value:
-                    match = False
-                    break
-            if match:
-                return doc
-        return None
-    
-    async def find(self, query: Dict[str, Any]) -> 'SimpleCursor':
+        return next(self._stream(query, limit=1, projection=projection), None)
+
+    async def find(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> 'SimpleCursor':
         """Find all documents matching the query"""
-        db = _load_db()
-        collection = db.get(self.collection_name, [])
-        
-        results = []
-        for doc in collection:
-            match = True
-            for key, value in query.items():
-                if doc.get(key) != value:
-                    match = False
-                    break
-            if match:
-                results.append(doc)
-        
-        # Return a cursor-like object that supports to_list, sort, and limit
-        return SimpleCursor(results)
-    
+        # Return a cursor-like object that supports to_list, sort, skip, limit and
+        # async iteration. The query only runs once results are requested.
+        return SimpleCursor(self, query, projection)
+
+    async def count_documents(self, query: Dict[str, Any]) -> int:
+        """Count the documents matching the query"""
+        self.store.refresh()
+        return self.store.count(self.collection_name, query)
+
+    async def exists(self, query: Dict[str, Any]) -> bool:
+        """Check whether any document matches the query"""
+        self.store.refresh()
+        return bool(self.store.query(self.collection_name, query, limit=1))
+
     async def insert_one(self, document: Dict[str, Any]):
         """Insert a document"""
-        db = _load_db()
-        if self.collection_name not in db:
-            db[self.collection_name] = []
-        
-        # Add a simple ID if not present
-        if "_id" not in document:
-            document["_id"] = str(len(db[self.collection_name]) + 1)
-        
-        db[self.collection_name].append(document)
-        _save_db(db)
+        document["_id"] = await self.store.execute("insert", self.collection_name, document)
         return document
-    
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True):
+        """Insert several documents in a single commit"""
+        await self.bulk_write([InsertOne(doc) for doc in documents], ordered)
+        return documents
+
     async def update_one(self, query: Dict[str, Any], update: Dict[str, Any]):
-        """Update one document"""
-        db = _load_db()
-        collection = db.get(self.collection_name, [])
-        
-        for i, doc in enumerate(collection):
-            match = True
-            for key, value in query.items():
-                if doc.get(key) != value:
-                    match = False
-                    break
-            if match:
-                # Apply update
-                if "$set" in update:
-                    doc.update(update["$set"])
-                collection[i] = doc
-                _save_db(db)
-                return
-    
+        """Update one document ($set, $inc, $push)"""
+        return await self.store.execute("update_one", self.collection_name, query, update)
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any]):
+        """Update every matching document ($set, $inc, $push) in a single commit"""
+        return await self.store.execute("update_many", self.collection_name, query, update)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True) -> Dict[str, Any]:
+        """Apply InsertOne/UpdateOne/UpdateMany/DeleteOne requests in a single commit"""
+        ops = [request._op() for request in requests]
+        result = await self.store.execute("bulk_write", self.collection_name, ops, ordered)
+        for i, doc_id in result["inserted_ids"].items():
+            requests[i].document["_id"] = doc_id
+        if result["errors"]:
+            raise BulkWriteError(result)
+        return result
+
     async def delete_one(self, query: Dict[str, Any]):
         """Delete one document"""
-        db = _load_db()
-        collection = db.get(self.collection_name, [])
-        
-        for i, doc in enumerate(collection):
-            match = True
-            for key, value in query.items():
-                if doc.get(key) != value:
-                    match = False
-                    break
-            if match:
-                collection.pop(i)
-                db[self.collection_name] = collection
-                _save_db(db)
-                return
+        await self.store.execute("delete_one", self.collection_name, query)
 
 
 class SimpleCursor:
-    """Cursor-like object that mimics MongoDB cursor interface"""
-    
-    def __init__(self, data):
-        self.data = data
+    """Lazy cursor-like object that mimics MongoDB cursor interface"""
+
+    def __init__(self, collection, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
         self._sort_field = None
         self._sort_direction = 1
+        self._skip_count = 0
         self._limit_count = None
-    
+        self._results = None
+
     def sort(self, field: str, direction: int = 1):
         """Sort the results by a field. Direction: 1 for ascending, -1 for descending"""
         self._sort_field = field
         self._sort_direction = direction
         return self
-    
+
+    def skip(self, count: int):
+        """Skip the first count results"""
+        self._skip_count = count
+        return self
+
     def limit(self, count: int):
         """Limit the number of results"""
         self._limit_count = count
         return self
-    
+
+    def _stream(self, length=None):
+        limit = self._limit_count if self._limit_count is not None else length
+        return self.collection._stream(
+            self.query, self._sort_field, self._sort_direction, self._skip_count, limit, self.projection
+        )
+
     async def to_list(self, length=None):
-        """Convert cursor to list with applied sort and limit"""
-        results = self.data.copy()
-        
-        # Apply sorting if specified
-        if self._sort_field:
-            try:
-                results.sort(
-                    key=lambda x: x.get(self._sort_field, ''),
-                    reverse=(self._sort_direction == -1)
-                )
-            except:
-                pass  # If sorting fails, just return unsorted
-        
-        # Apply limit
-        if self._limit_count is not None:
-            results = results[:self._limit_count]
-        elif length is not None:
-            results = results[:length]
-        
-        return results
+        """Convert cursor to list with applied sort, skip and limit"""
+        return list(self._stream(length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            self._results = self._stream()
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
 
 
 # Create collections
@@ -155,6 +926,21 @@ users_collection = LocalCollection("users")
 measurements_collection = LocalCollection("measurements")
 meal_plans_collection = LocalCollection("meal_plans")
 chat_history_collection = LocalCollection("chat_history")
+# Progress of background jobs, one document per job name
+jobs_collection = LocalCollection("jobs")
+# Ready-made meal plans waiting to be served, see services/plan_pool.py
+plan_pool_collection = LocalCollection("plan_pool")
+
+# Indexes for the lookups done by main.py and the chatbot
+users_collection.create_index("email")
+measurements_collection.create_index("user_email", sort_field="date")
+meal_plans_collection.create_index(["user_email", "active"], sort_field="created_at")
+chat_history_collection.create_index("user_email", sort_field="timestamp")
+jobs_collection.create_index("name")
+plan_pool_collection.create_index("segment", sort_field="created_at")
+# Whole collections in time order, for the archiver
+meal_plans_collection.create_index([], sort_field="created_at")
+chat_history_collection.create_index([], sort_field="timestamp")
 
 def get_database():
     """Return a mock database object"""
@@ -162,5 +948,7 @@ def get_database():
         "users": users_collection,
         "measurements": measurements_collection,
         "meal_plans": meal_plans_collection,
-        "chat_history": chat_history_collection
+        "chat_history": chat_history_collection,
+        "jobs": jobs_collection,
+        "plan_pool": plan_pool_collection
     }
@@ -0,0 +1,117 @@
+import json
+import struct
+from typing import Optional, Dict, Any, List, BinaryIO
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Compact binary snapshot format for the local database.
+#
+#   MAGIC | codec byte (b"m" msgpack, b"j" compact JSON)
+#   records: 4-byte big-endian length + encoded document, collection by collection
+#   footer:  JSON {"meta": {...}, "collections": {name: [[_id, offset, length], ...]}}
+#   trailer: 8-byte big-endian footer offset + MAGIC
+#
+# The footer lets a single document be read without parsing the rest of the file.
+MAGIC = b"BTLDB\x00\x01\n"
+_LENGTH = struct.Struct(">I")
+_TRAILER = struct.Struct(">Q")
+
+
+def _codec(codec: Optional[bytes]) -> bytes:
+    if codec is None:
+        return b"m" if msgpack else b"j"
+    if codec == b"m":
+        _require_msgpack()
+    return codec
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed; it is needed for msgpack snapshots (pip install msgpack)")
+
+
+def _encode(doc: Dict[str, Any], codec: bytes) -> bytes:
+    if codec == b"m":
+        return msgpack.packb(doc, use_bin_type=True)
+    return json.dumps(doc, separators=(',', ':')).encode('utf-8')
+
+
+def _decode(data: bytes, codec: bytes) -> Dict[str, Any]:
+    if codec == b"m":
+        _require_msgpack()
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def write_snapshot(f: BinaryIO, collections: Dict[str, List[Dict[str, Any]]],
+                   meta: Optional[Dict[str, Any]] = None, codec: Optional[bytes] = None):
+    """Write all collections to a binary file object"""
+    codec = _codec(codec)
+    f.write(MAGIC + codec)
+    offset = len(MAGIC) + 1
+    index = {}
+    for name, docs in collections.items():
+        entries = index[name] = []
+        for doc in docs:
+            data = _encode(doc, codec)
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+            entries.append([doc.get("_id"), offset + _LENGTH.size, len(data)])
+            offset += _LENGTH.size + len(data)
+
+    footer = json.dumps({"meta": meta or {}, "collections": index}, separators=(',', ':')).encode('utf-8')
+    f.write(footer)
+    f.write(_TRAILER.pack(offset) + MAGIC)
+
+
+def is_binary_snapshot(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class SnapshotReader:
+    """Random access to the documents of a binary snapshot"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(len(MAGIC) + 1)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a binary local database snapshot")
+            self.codec = header[len(MAGIC):]
+            if self.codec == b"m" and msgpack is None:
+                raise RuntimeError(f"{path} was written with msgpack, which is not installed (pip install msgpack)")
+            f.seek(-(_TRAILER.size + len(MAGIC)), 2)
+            footer_offset = _TRAILER.unpack(f.read(_TRAILER.size))[0]
+            footer_end = f.tell()
+            f.seek(footer_offset)
+            footer = json.loads(f.read(footer_end - _TRAILER.size - footer_offset))
+        self.meta = footer["meta"]
+        self.entries = footer["collections"]
+        self._offsets = None
+
+    def get(self, name: str, doc_id) -> Optional[Dict[str, Any]]:
+        """Read one document by _id"""
+        if self._offsets is None:
+            self._offsets = {
+                coll: {entry[0]: (entry[1], entry[2]) for entry in entries}
+                for coll, entries in self.entries.items()
+            }
+        location = self._offsets.get(name, {}).get(doc_id)
+        if location is None:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(location[0])
+            return _decode(f.read(location[1]), self.codec)
+
+    def read_all(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Decode every collection"""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        return {
+            name: [_decode(data[offset:offset + length], self.codec) for _, offset, length in entries]
+            for name, entries in self.entries.items()
+        }
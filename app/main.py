@@ -1,26 +1,66 @@
+import asyncio
+import json
+import os
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, List, Optional
 from .services import model
 from .services import rag
 from .services import chatbot
 from .services import vector_store
+from .services import retention
+from .services import model_registry
+from .services import rescoring
+from .services import plan_pool
+from .services import single_flight
 from .auth import (
     create_access_token,
     get_current_user,
+    get_current_admin,
     verify_password,
     get_password_hash,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     users_collection
 )
-from .database import meal_plans_collection, measurements_collection
+from .database import meal_plans_collection, measurements_collection, InsertOne, UpdateMany
 from .models import UserCreate, UserInDB, Token, UserBase, MealPlan
 
 app = FastAPI(title="Body Type & Meal Plan API")
 
+# Largest /body-type/predict/batch request
+MAX_BATCH_SIZE = 1000
+# Longest meal plan, in days, that can be requested
+MAX_PLAN_DAYS = 14
+# How often each worker checks the model registry for a newly activated version (0 disables)
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "10"))
+
+@app.on_event("startup")
+async def start_archiver():
+    # Moves cold chat turns and superseded meal plans out of the hot collections
+    app.state.archiver = asyncio.create_task(retention.run_archiver())
+
+@app.on_event("startup")
+async def start_model_watcher():
+    # Picks up versions activated by train_model.py or by another worker's /admin/model/reload
+    # Stored measurements are brought up to each version swapped in
+    app.state.model_watcher = asyncio.create_task(
+        model.watch_registry(MODEL_WATCH_INTERVAL_SECONDS, on_swap=rescoring.start))
+    # Scores measurements for the version loaded at startup, and finishes jobs whose worker stopped
+    app.state.rescore_watcher = asyncio.create_task(rescoring.watch_interrupted())
+
+@app.on_event("startup")
+async def start_plan_pool():
+    # Ready-made plans for the KB segments, generated in the background
+    await plan_pool.prewarm()
+
+@app.on_event("shutdown")
+async def close_openai_client():
+    await rag.close_client()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -40,9 +80,17 @@ class BodyMeasurements(BaseModel):
     shoulder_breadth_cm: float
     wrist_cm: float
     
+class BatchPredictionRequest(BaseModel):
+    # Rows are validated one by one so a bad row does not reject the batch
+    measurements: List[Any]
+
+class ModelReloadRequest(BaseModel):
+    # Registered version to activate; the registry's active version when omitted
+    version: Optional[str] = None
+
 class MealPlanRequest(BaseModel):
     profile: dict
-    plan_days: int = 1
+    plan_days: int = Field(1, ge=1, le=MAX_PLAN_DAYS)
 
 class ChatRequest(BaseModel):
     query: str
@@ -117,6 +165,31 @@ async def update_user_profile(profile_data: dict, current_user: UserInDB = Depen
         print(f"Error updating profile: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_measurement_record(email: str, data: BodyMeasurements, result: dict):
+    from datetime import datetime
+    # Calculate BMI: weight (kg) / (height (m))^2
+    height_m = data.height_cm / 100
+    bmi = round(data.weight_kg / (height_m ** 2), 1)
+    return {
+        "user_email": email,
+        "date": datetime.now().isoformat(),
+        "gender": data.gender,
+        "weight_kg": data.weight_kg,
+        "height_cm": data.height_cm,
+        "waist_cm": data.waist_cm,
+        "hip_cm": data.hip_cm,
+        "chest_cm": data.chest_cm,
+        "shoulder_breadth_cm": data.shoulder_breadth_cm,
+        "wrist_cm": data.wrist_cm,
+        "bmi": bmi,
+        "body_type": result.get("body_type", ""),
+        "somatotype": result.get("somatotype", {}),
+        # Kept so borderline results can be found without re-running the model
+        "confidence": result.get("confidence"),
+        "margin": result.get("margin"),
+        "model_version": result.get("model_version")
+    }
+
 @app.post("/body-type/predict")
 async def predict_body_type(data: BodyMeasurements, current_user: UserInDB = Depends(get_current_user)):
     # Convert gender to 0/1 for model
@@ -128,27 +201,8 @@ async def predict_body_type(data: BodyMeasurements, current_user: UserInDB = Dep
     try:
         result = model.predict_somatotype(model_input)
         
-        # Calculate BMI: weight (kg) / (height (m))^2
-        height_m = data.height_cm / 100
-        bmi = round(data.weight_kg / (height_m ** 2), 1)
-        
         # Store measurement in database for history tracking
-        from datetime import datetime
-        measurement_record = {
-            "user_email": current_user.email,
-            "date": datetime.now().isoformat(),
-            "gender": data.gender,
-            "weight_kg": data.weight_kg,
-            "height_cm": data.height_cm,
-            "waist_cm": data.waist_cm,
-            "hip_cm": data.hip_cm,
-            "chest_cm": data.chest_cm,
-            "shoulder_breadth_cm": data.shoulder_breadth_cm,
-            "wrist_cm": data.wrist_cm,
-            "bmi": bmi,
-            "body_type": result.get("body_type", ""),
-            "somatotype": result.get("somatotype", {})
-        }
+        measurement_record = build_measurement_record(current_user.email, data, result)
         
         # Save to measurements collection
         from .database import measurements_collection
@@ -158,6 +212,90 @@ async def predict_body_type(data: BodyMeasurements, current_user: UserInDB = Dep
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/body-type/predict/batch")
+async def predict_body_type_batch(request: BatchPredictionRequest, current_user: UserInDB = Depends(get_current_user)):
+    if len(request.measurements) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} measurements per batch")
+
+    # Validate each row on its own; failures are reported per row
+    results: List[dict] = [None] * len(request.measurements)
+    valid = []
+    for i, row in enumerate(request.measurements):
+        if not isinstance(row, dict):
+            results[i] = {"index": i, "error": "measurement must be a JSON object"}
+            continue
+        try:
+            valid.append((i, BodyMeasurements(**row)))
+        except ValidationError as e:
+            results[i] = {"index": i, "error": "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )}
+
+    try:
+        model_inputs = []
+        for _, data in valid:
+            model_input = data.dict()
+            model_input['gender'] = 1 if data.gender.lower() == "male" else 0
+            model_inputs.append(model_input)
+        # One scoring pass over the whole batch
+        predictions = model.predict_somatotype_batch(model_inputs)
+
+        records = []
+        for (i, data), result in zip(valid, predictions):
+            results[i] = {"index": i, **result}
+            if "error" in result:
+                continue
+            record = build_measurement_record(current_user.email, data, result)
+            # Lets a clinic tell the people of a batch apart in its history
+            if "subject_id" in request.measurements[i]:
+                record["subject_id"] = request.measurements[i]["subject_id"]
+            records.append(record)
+
+        # Save the whole batch in a single write
+        from .database import measurements_collection
+        if records:
+            await measurements_collection.insert_many(records)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    failed = sum(1 for r in results if "error" in r)
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed}
+
+@app.get("/admin/model")
+async def get_model_versions(current_user: UserInDB = Depends(get_current_admin)):
+    return {
+        "serving": model.serving.metadata if model.serving else None,
+        "active": model_registry.current_version(),
+        "versions": model_registry.list_versions(),
+        "prediction_cache": model.prediction_cache.stats(),
+    }
+
+@app.post("/admin/model/reload")
+async def reload_model(request: ModelReloadRequest, current_user: UserInDB = Depends(get_current_admin)):
+    version = request.version or model_registry.current_version()
+    try:
+        # Load and check the new version off the event loop; requests keep using the old one meanwhile
+        await asyncio.to_thread(model.swap_model, version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model version {version} not loaded: {e}")
+    if request.version:
+        # Other workers follow through their registry watcher
+        model_registry.activate(version)
+    # Stored measurements are brought up to the new version in the background
+    rescoring.start()
+    return {"message": f"Serving model version {version}", "model": model.serving.metadata}
+
+@app.get("/admin/measurements/rescore")
+async def get_rescore_status(current_user: UserInDB = Depends(get_current_admin)):
+    return {"running": rescoring.is_running(), "job": await rescoring.get_status()}
+
+@app.post("/admin/measurements/rescore")
+async def start_rescore(current_user: UserInDB = Depends(get_current_admin)):
+    started = rescoring.start()
+    return {"started": started, "job": await rescoring.get_status()}
+
 @app.get("/measurements/history")
 async def get_measurement_history(current_user: UserInDB = Depends(get_current_user)):
     from .database import measurements_collection
@@ -179,58 +317,112 @@ async def get_measurement_history(current_user: UserInDB = Depends(get_current_u
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/meal-plan/generate")
-async def generate_meal_plan(request: MealPlanRequest, current_user: UserInDB = Depends(get_current_user)):
-    # Check if a recent plan exists (optional, but good for "one time generated")
-    # For now, we will always generate a new one if requested, and mark it as active.
-    # We could mark old ones as inactive if we wanted, but simple sorting by date works.
-
+def ensure_gender_str(profile: dict):
     # Ensure gender_str is present in profile for RAG retrieval
-    if "gender_str" not in request.profile:
-        g = request.profile.get("gender")
+    if "gender_str" not in profile:
+        g = profile.get("gender")
         if isinstance(g, str):
-            request.profile["gender_str"] = g
+            profile["gender_str"] = g
         elif g == 1:
-            request.profile["gender_str"] = "male"
+            profile["gender_str"] = "male"
         else:
-            request.profile["gender_str"] = "female"
-            
-    plan_data = rag.generate_meal_plan(request.profile, request.plan_days)
-    
-    # Save to database
+            profile["gender_str"] = "female"
+
+async def save_meal_plan(email: str, profile: dict, plan_data: dict):
+    # Save to database; older plans are marked inactive in the same write
     from datetime import datetime
     new_plan = {
-        "user_email": current_user.email,
+        "user_email": email,
         "created_at": datetime.now().isoformat(),
         "plan_data": plan_data,
-        "goal": request.profile.get("goal", "Healthy Living"),
+        "goal": profile.get("goal", "Healthy Living"),
         "active": True
     }
     
-    await meal_plans_collection.insert_one(new_plan)
+    await meal_plans_collection.bulk_write([
+        UpdateMany({"user_email": email, "active": True}, {"$set": {"active": False}}),
+        InsertOne(new_plan),
+    ])
+    await retention.set_current_plan(email, new_plan["_id"])
+
+@app.post("/meal-plan/generate")
+async def generate_meal_plan(request: MealPlanRequest, current_user: UserInDB = Depends(get_current_user)):
+    # Check if a recent plan exists (optional, but good for "one time generated")
+    # For now, we will always generate a new one if requested, and mark it as active.
+    ensure_gender_str(request.profile)
+            
+    # A ready-made plan for the user's segment when there is one; the pool refills itself
+    plan_data = await plan_pool.take(request.profile, request.plan_days)
+    if plan_data is None:
+        # Identical requests in flight (retries, double taps) share one generation
+        profile, plan_days = request.profile, request.plan_days
+        plan_data = await single_flight.meal_plans.do(
+            plan_pool.segment_key(profile, plan_days),
+            lambda: rag.generate_meal_plan(profile, plan_days),
+        )
     
+    await save_meal_plan(current_user.email, request.profile, plan_data)
     return plan_data
 
+# Streams still being generated, kept referenced until they finish
+_plan_streams = set()
+
+@app.post("/meal-plan/generate/stream")
+async def stream_meal_plan(request: MealPlanRequest, current_user: UserInDB = Depends(get_current_user)):
+    """
+    Same as /meal-plan/generate, as NDJSON: one {"event": "meal", ...} line per
+    meal as soon as it is generated, {"event": "day", ...} when a day is
+    complete, then {"event": "done", "plan": ...} once the plan is saved.
+    """
+    ensure_gender_str(request.profile)
+    profile, plan_days, email = request.profile, request.plan_days, current_user.email
+    queue = asyncio.Queue()
+
+    async def produce():
+        # Runs apart from the response, so the plan is saved even if the client leaves
+        try:
+            plan_data = await plan_pool.take(profile, plan_days)
+            if plan_data is not None:
+                for event in rag.plan_events(plan_data):
+                    queue.put_nowait(event)
+            else:
+                async for event in rag.stream_meal_plan(profile, plan_days):
+                    if event["event"] == "done":
+                        plan_data = event["plan"]
+                    else:
+                        queue.put_nowait(event)
+            await save_meal_plan(email, profile, plan_data)
+            queue.put_nowait({"event": "done", "plan": plan_data})
+        except Exception as e:
+            print(f"Error streaming meal plan: {e}")
+            queue.put_nowait({"event": "error", "detail": str(e)})
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(produce())
+    _plan_streams.add(task)
+    task.add_done_callback(_plan_streams.discard)
+
+    async def body():
+        while (event := await queue.get()) is not None:
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 @app.get("/meal-plan/current")
 async def get_current_meal_plan(current_user: UserInDB = Depends(get_current_user)):
     try:
         # Check if user has measurements first
-        history = await measurements_collection.find({"user_email": current_user.email})
-        # Use to_list to check if empty
-        measurements = await history.to_list(length=1)
-        if not measurements:
+        if not await measurements_collection.exists({"user_email": current_user.email}):
             return {"message": "No body analysis found. Please complete analysis first.", "plan": None}
 
-        # Find plans for user
-        cursor = await meal_plans_collection.find({"user_email": current_user.email, "active": True})
-        # Sort by creation date descending
-        cursor.sort("created_at", -1)
-        plans = await cursor.to_list(length=1)
+        # Follow the user's current plan pointer, loading only the plan itself
+        plan = await retention.get_current_plan(current_user.email, {"plan_data": 1})
         
-        if not plans:
+        if not plan:
             return {"message": "No active meal plan found", "plan": None}
             
-        return plans[0]["plan_data"]
+        return plan["plan_data"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -259,10 +451,14 @@ def ingest_documents_endpoint(current_user: UserInDB = Depends(get_current_user)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/tips/daily")
-def get_daily_tips_endpoint(current_user: UserInDB = Depends(get_current_user)):
+async def get_daily_tips_endpoint(current_user: UserInDB = Depends(get_current_user)):
     try:
         from .services import tips
-        daily_tips = tips.get_daily_tips()
+        from datetime import date
+        # Requests made while today's tips are being generated share that call
+        daily_tips = await single_flight.daily_tips.do(
+            date.today().isoformat(), lambda: asyncio.to_thread(tips.get_daily_tips)
+        )
         return {"tips": daily_tips}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
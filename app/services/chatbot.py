@@ -3,7 +3,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from .vector_store import get_retriever
-from ..database import measurements_collection, meal_plans_collection, chat_history_collection
+from .retention import get_current_plan
+from ..database import measurements_collection, chat_history_collection
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -30,7 +31,9 @@ async def save_chat_message(email: str, text: str, is_user: bool):
 
 async def get_user_history_context(email: str):
     """Fetches the last 5 relevant measurements for the user."""
-    cursor = await measurements_collection.find({"user_email": email})
+    cursor = await measurements_collection.find(
+        {"user_email": email}, {"date": 1, "weight_kg": 1, "waist_cm": 1, "bmi": 1}
+    )
     cursor = cursor.sort("date", -1).limit(5)
     measurements = await cursor.to_list(length=5)
     
@@ -52,15 +55,13 @@ async def get_user_history_context(email: str):
 
 async def get_active_meal_plan(email: str):
     """Fetches the current active meal plan for the user."""
-    cursor = await meal_plans_collection.find({"user_email": email, "active": True})
-    cursor = cursor.sort("created_at", -1)
-    plans = await cursor.to_list(length=1)
+    plan = await get_current_plan(email, {"plan_data": 1, "goal": 1})
     
-    if not plans:
+    if not plan:
         return "No active meal plan found."
         
-    plan_data = plans[0].get("plan_data", {})
-    goal = plans[0].get("goal", "Unknown Goal")
+    plan_data = plan.get("plan_data", {})
+    goal = plan.get("goal", "Unknown Goal")
     
     meal_plan_str = f"Active Meal Plan (Goal: {goal}):\n"
     
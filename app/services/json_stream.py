@@ -0,0 +1,71 @@
+import json
+from typing import List, Optional, Tuple
+
+
+class PlanStreamParser:
+    """
+    Incremental parser for a streamed meal plan completion
+    ({"meal_plan": {"day_1": {"breakfast": {...}, ...}, ...}, "advice": [...]}).
+    feed() takes the text as it arrives and returns what got complete:
+    (day, meal, value) for each finished meal and (day, None, None) for
+    each finished day. Text outside the JSON (such as ``` fences) is ignored.
+    Text that is not valid JSON, such as an invalid escape in a string, sets
+    failed; nothing after it is parsed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        # (key, start offset) of each open object or array, outermost first
+        self._stack: List[Tuple[Optional[str], int]] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self.failed = False
+
+    def feed(self, piece: str) -> List[Tuple[str, Optional[str], object]]:
+        if self.failed:
+            return []
+        self.text += piece
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    try:
+                        self._last_string = json.loads(text[self._string_start:i + 1])
+                    except ValueError:
+                        self.failed = True
+                        break
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char == ",":
+                self._pending_key = None
+            elif char in "{[":
+                self._stack.append((self._pending_key, i))
+                self._pending_key = None
+            elif char in "}]" and self._stack:
+                key, start = self._stack.pop()
+                path = [k for k, _ in self._stack]
+                if len(path) >= 2 and path[1] == "meal_plan":
+                    if len(path) == 3 and key is not None:
+                        try:
+                            events.append((path[2], key, json.loads(text[start:i + 1])))
+                        except json.JSONDecodeError:
+                            pass
+                    elif len(path) == 2 and key is not None:
+                        events.append((key, None, None))
+        self._pos = len(text)
+        return events
@@ -0,0 +1,133 @@
+import json
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+# kb.json compiled into posting sets, one per entry type and filter value, so
+# retrieval intersects a few sets instead of scanning every entry.
+#
+# Each table is keyed by its own dimensions, in this order:
+TABLE_DIMENSIONS = {
+    "meal_options": ("gender", "bmi_category", "meal_time"),
+    "bodytype_guidance": ("somatotype",),
+    "snack_options": ("bmi_category",),
+}
+# Any other filter an entry has (age_band, goal, dietary_constraint, or one
+# added to kb.json later) narrows it further: the entry applies only to
+# lookups with that value, while an entry without the filter applies to every
+# value. A lookup with a value no entry uses gets the entries without it.
+# Option lists of recent lookups are kept, with their JSON text:
+LOOKUP_CACHE_SIZE = 1024
+
+Key = Tuple[Optional[str], ...]
+
+
+class KBIndex:
+    """Immutable option lists of a KB, looked up by intersecting per-dimension posting sets"""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        # Entries of each table in KB order; postings refer to them by position
+        self.entries: Dict[str, List[Dict[str, Any]]] = {name: [] for name in TABLE_DIMENSIONS}
+        for entry in entries:
+            if entry.get("type") in TABLE_DIMENSIONS:
+                self.entries[entry["type"]].append(entry)
+
+        # table -> dimension -> value -> positions of the entries with that value;
+        # entries without an optional dimension are listed under None
+        self.postings: Dict[str, Dict[str, Dict[Any, Set[int]]]] = {name: {} for name in TABLE_DIMENSIONS}
+        for name, table in self.entries.items():
+            postings = self.postings[name]
+            for dim in TABLE_DIMENSIONS[name]:
+                postings[dim] = {}
+            for entry in table:
+                for dim in entry.get("filters", {}):
+                    postings.setdefault(dim, {})
+            for position, entry in enumerate(table):
+                filters = entry.get("filters", {})
+                for dim, values in postings.items():
+                    values.setdefault(filters.get(dim), set()).add(position)
+
+        # Known values of each optional dimension, across all tables
+        self.values: Dict[str, frozenset] = {}
+        for name, postings in self.postings.items():
+            for dim, values in postings.items():
+                if dim not in TABLE_DIMENSIONS[name]:
+                    known = {value for value in values if value is not None}
+                    self.values[dim] = self.values.get(dim, frozenset()) | known
+
+        # Meal times listed for each (gender, bmi_category)
+        self.meal_times: Dict[Key, Tuple[str, ...]] = {}
+        for entry in self.entries["meal_options"]:
+            filters = entry.get("filters", {})
+            times = self.meal_times.setdefault((filters.get("gender"), filters.get("bmi_category")), ())
+            meal_time = filters.get("meal_time")
+            if meal_time and meal_time not in times:
+                self.meal_times[(filters.get("gender"), filters.get("bmi_category"))] = times + (meal_time,)
+
+        # (table, key) -> [options, their JSON text or None until asked for]
+        self._cache: "OrderedDict[Tuple[str, Key], list]" = OrderedDict()
+
+    def dimensions(self, table: str) -> Tuple[str, ...]:
+        """The optional dimensions some entry of the table uses"""
+        return tuple(dim for dim in self.postings[table] if dim not in TABLE_DIMENSIONS[table])
+
+    def keys(self, table: str) -> Set[Key]:
+        """The table keys the KB has entries for"""
+        return {tuple(entry.get("filters", {}).get(dim) for dim in TABLE_DIMENSIONS[table])
+                for entry in self.entries[table]}
+
+    def key(self, table: str, base: Key, filters: Dict[str, Any]) -> Key:
+        """Full lookup key: values no entry uses become None (entries without that filter)"""
+        key = list(base)
+        for dim in self.dimensions(table):
+            value = filters.get(dim)
+            try:
+                known = value in self.postings[table][dim]
+            except TypeError:
+                known = False
+            key.append(value if known else None)
+        return tuple(key)
+
+    def _lookup(self, table: str, base: Key, filters: Dict[str, Any]):
+        key = self.key(table, base, filters)
+        cached = self._cache.get((table, key))
+        if cached is not None:
+            self._cache.move_to_end((table, key))
+            return cached
+
+        postings = self.postings[table]
+        matching: Optional[Set[int]] = None
+        for dim, value in zip(TABLE_DIMENSIONS[table] + self.dimensions(table), key):
+            found = postings[dim].get(value, set())
+            if dim not in TABLE_DIMENSIONS[table] and value is not None:
+                found = found | postings[dim].get(None, set())
+            matching = found if matching is None else matching & found
+            if not matching:
+                break
+
+        # Options of the matching entries, in KB order, without repeats
+        options: Dict[str, None] = {}
+        for position in sorted(matching or ()):
+            options.update(dict.fromkeys(self.entries[table][position].get("options", [])))
+        cached = [tuple(options), None]
+        self._cache[(table, key)] = cached
+        if len(self._cache) > LOOKUP_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return cached
+
+    def lookup(self, table: str, base: Key, filters: Dict[str, Any]) -> Tuple[str, ...]:
+        return self._lookup(table, base, filters)[0]
+
+    def lookup_json(self, table: str, base: Key, filters: Dict[str, Any]) -> str:
+        cached = self._lookup(table, base, filters)
+        # Serialized on first use only, as most lookups never need the text
+        if cached[1] is None:
+            cached[1] = json.dumps(list(cached[0]), indent=2)
+        return cached[1]
+
+    def stats(self) -> Dict[str, int]:
+        return {name: len(table) for name, table in self.entries.items()}
+
+
+def compile_kb(path: str) -> KBIndex:
+    with open(path, 'r', encoding='utf-8') as f:
+        return KBIndex(json.load(f))
@@ -1,14 +1,207 @@
-import pandas as pd
-import joblib
+import asyncio
+import numpy as np
 import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from . import model_registry
+
+# Model input columns (order matters!)
+FEATURES = [
+    "gender",
+    "BMI",
+    "WaistHipRatio",
+    "ShoulderWaistRatio",
+    "ChestWaistRatio",
+    "HeightWaistRatio",
+    "FrameIndex"
+]
+
+
+class LinearModel:
+    """
+    Logistic regression scored with NumPy only: the class with the highest
+    linear score X @ coef.T + intercept, as LogisticRegression.predict does.
+    """
+
+    def __init__(self, coef, intercept, classes, multi_class: str = "multinomial"):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.classes = np.asarray(classes)
+        self.multi_class = multi_class
+
+    @classmethod
+    def from_estimator(cls, estimator, multi_class: Optional[str] = None):
+        """Copy the fitted parameters out of a scikit-learn estimator"""
+        names = getattr(estimator, "feature_names_in_", None)
+        if names is not None and list(names) != FEATURES:
+            raise ValueError(f"Model was trained on {list(names)}, expected {FEATURES}")
+        if multi_class not in (None, "multinomial", "ovr"):
+            raise ValueError(f"Unsupported multi_class: {multi_class}")
+        return cls(estimator.coef_, estimator.intercept_, estimator.classes_,
+                   multi_class or model_registry.multi_class(estimator))
+
+    def decision_function(self, X):
+        scores = np.asarray(X, dtype=np.float64) @ self.coef.T + self.intercept
+        # Binary models have a single score column for the positive class
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes[(scores > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+    def predict_proba(self, X):
+        """Class probabilities in classes order, as the estimator's predict_proba"""
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            p = 1 / (1 + np.exp(-scores))
+            return np.column_stack([1 - p, p])
+        if self.multi_class == "ovr":
+            # One sigmoid per class, normalized to sum to 1
+            p = 1 / (1 + np.exp(-scores))
+            return p / p.sum(axis=1, keepdims=True)
+        # Softmax, shifted by the row maximum so exp cannot overflow
+        exp = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+class ServingModel:
+    """One loaded model version. A new version replaces the whole object."""
+
+    def __init__(self, estimator, metadata):
+        self.version = metadata["version"]
+        self.metadata = metadata
+        self.estimator = estimator
+        # Requests are scored with the extracted parameters, without pandas or sklearn
+        # Versions registered before multi_class was recorded fall back to the estimator type
+        self.engine = LinearModel.from_estimator(estimator, metadata.get("multi_class"))
+        # Fail here, before serving, if the parameters cannot score a row
+        self.engine.predict_proba(np.zeros((1, len(FEATURES))))
+
+
+# Repeat submissions (e.g. app retries) are answered from an LRU cache keyed on
+# the measurements rounded to instrument precision plus the model version
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+WEIGHT_PRECISION_KG = 0.05
+LENGTH_PRECISION_CM = 0.1
+LENGTH_KEYS = ["height_cm", "waist_cm", "hip_cm", "chest_cm", "shoulder_breadth_cm", "wrist_cm"]
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of prediction results with hit/miss counters"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _copy(result):
+        # Callers may modify what they get; results are flat apart from these two dicts
+        return {**result, "probabilities": dict(result["probabilities"]),
+                "features_used": dict(result["features_used"])}
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._copy(result)
+
+    def put(self, key, result):
+        if self.capacity <= 0:
+            return
+        result = self._copy(result)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE)
+
+
+def _cache_key(data: dict, version: str):
+    """Measurements rounded to instrument precision, or None when they cannot be rounded"""
+    try:
+        return (
+            version,
+            int(data["gender"]),
+            round(data["weight_kg"] / WEIGHT_PRECISION_KG),
+            *(round(data[key] / LENGTH_PRECISION_CM) for key in LENGTH_KEYS),
+        )
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+
+
+def load_model(version=None):
+    """Load a registry version (the active one by default) without serving it"""
+    return ServingModel(*model_registry.load(version))
+
+
+def swap_model(version=None):
+    """
+    Load a version and make it the serving model. The swap is a single
+    reference assignment: each request reads `serving` once, so in-flight
+    requests finish on the version they started with.
+    """
+    global serving, model, engine
+    new = load_model(version)
+    serving, model, engine = new, new.estimator, new.engine
+    # Entries of the previous version can no longer be hit; free them
+    prediction_cache.clear()
+    print(f"Serving model version {new.version}")
+    return new
+
+
+async def watch_registry(interval: float, on_swap: Optional[Callable[[], Any]] = None):
+    """Background loop that swaps in the registry's active version when it changes, then calls on_swap"""
+    failed = None
+    while interval > 0:
+        await asyncio.sleep(interval)
+        version = model_registry.current_version()
+        if version in ((serving.version if serving else None), failed):
+            continue
+        try:
+            await asyncio.to_thread(swap_model, version)
+        except Exception as e:
+            failed = version
+            print(f"Warning: Could not load model version {version}: {e}")
+            continue
+        if on_swap:
+            on_swap()
+
 
 # Load the model
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "../data/mlr_somatotype_model.pkl")
+MODEL_PATH = model_registry.LEGACY_MODEL_PATH
+serving = model = engine = None
 try:
-    model = joblib.load(MODEL_PATH)
-except FileNotFoundError:
-    print(f"Warning: Model file not found at {MODEL_PATH}")
-    model = None
+    swap_model()
+except (FileNotFoundError, ValueError) as e:
+    print(f"Warning: Model not loaded: {e}")
 
 def calculate_bmi(weight_kg, height_cm):
     height_m = height_cm / 100
@@ -22,6 +215,28 @@ def get_bmi_category(bmi):
     else:
         return "overweight"
 
+def get_bmi_categories(bmi):
+    """get_bmi_category over an array of BMI values"""
+    bmi = np.asarray(bmi, dtype=np.float64)
+    return np.select([bmi < 18.5, bmi <= 22.9], ["underweight", "normal"], "overweight")
+
+def _confidence(probabilities, current):
+    """
+    Label, per-class probabilities, confidence (top probability) and margin
+    (top minus runner-up probability) for one row of predict_proba.
+    A low margin means the measurements sit near a class boundary.
+    """
+    ranked = sorted(range(len(probabilities)), key=probabilities.__getitem__, reverse=True)
+    top = probabilities[ranked[0]]
+    runner_up = probabilities[ranked[1]] if len(ranked) > 1 else 0.0
+    return {
+        "somatotype": str(current.engine.classes[ranked[0]]),
+        "probabilities": {str(c): round(p, 4) for c, p in zip(current.engine.classes, probabilities)},
+        "confidence": round(top, 4),
+        "margin": round(top - runner_up, 4),
+        "model_version": current.version,
+    }
+
 def predict_somatotype(data: dict):
     """
     Predicts somatotype based on input measurements.
@@ -36,9 +251,16 @@ def predict_somatotype(data: dict):
     - shoulder_breadth_cm
     - wrist_cm
     """
-    if model is None:
+    current = serving
+    if current is None:
         raise Exception("Model not loaded")
 
+    key = _cache_key(data, current.version) if PREDICTION_CACHE_SIZE > 0 else None
+    if key is not None:
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            return cached
+
     # Feature Engineering
     # Match the logic from body_type.py
     # features = ["gender", "BMI", "WaistHipRatio", "ShoulderWaistRatio", "ChestWaistRatio", "HeightWaistRatio", "FrameIndex"]
@@ -61,18 +283,8 @@ def predict_somatotype(data: dict):
     height_waist_ratio = height / waist if waist != 0 else 0
     frame_index = height / wrist if wrist != 0 else 0
     
-    # Create DataFrame for prediction (order matters!)
-    features = [
-        "gender",
-        "BMI",
-        "WaistHipRatio",
-        "ShoulderWaistRatio",
-        "ChestWaistRatio",
-        "HeightWaistRatio",
-        "FrameIndex"
-    ]
-    
-    input_df = pd.DataFrame([[
+    # One row in FEATURES order
+    input_row = np.array([[
         gender,
         bmi,
         waist_hip_ratio,
@@ -80,12 +292,13 @@ def predict_somatotype(data: dict):
         chest_waist_ratio,
         height_waist_ratio,
         frame_index
-    ]], columns=features)
+    ]], dtype=np.float64)
     
-    prediction = model.predict(input_df)[0]
+    # The label is the most probable class, from the same scores
+    probabilities = current.engine.predict_proba(input_row)[0].tolist()
     
-    return {
-        "somatotype": prediction,
+    result = {
+        **_confidence(probabilities, current),
         "bmi": round(bmi, 2),
         "bmi_category": get_bmi_category(bmi),
         "features_used": {
@@ -97,3 +310,85 @@ def predict_somatotype(data: dict):
             "FrameIndex": round(frame_index, 4)
         }
     }
+    if key is not None:
+        prediction_cache.put(key, result)
+    return result
+
+# Measurement keys of a prediction request, in the order of the batch input matrix
+MEASUREMENT_KEYS = ["gender", "weight_kg", "height_cm", "waist_cm", "hip_cm", "chest_cm", "shoulder_breadth_cm", "wrist_cm"]
+
+
+def _ratio(a, b):
+    # Column-wise a / b, with 0 where b is 0 as in predict_somatotype
+    return np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+
+
+def compute_features(measurements):
+    """
+    Computes the model features for a matrix of measurements (one row per
+    person, columns in MEASUREMENT_KEYS order). Returns an (n, 7) matrix
+    in FEATURES order.
+    """
+    m = np.asarray(measurements, dtype=np.float64)
+    gender, weight, height, waist, hip, chest, shoulder, wrist = m.T
+    return np.column_stack([
+        gender,
+        calculate_bmi(weight, height),
+        _ratio(waist, hip),
+        _ratio(shoulder, waist),
+        _ratio(chest, waist),
+        _ratio(height, waist),
+        _ratio(height, wrist),
+    ])
+
+
+def _validate(data: dict):
+    """Returns the row of a measurement dict, or raises ValueError"""
+    row = []
+    for key in MEASUREMENT_KEYS:
+        value = data.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{key} must be a number")
+        if key == "gender":
+            if value not in (0, 1):
+                raise ValueError("gender must be 0 or 1")
+        elif not (0 < value < float("inf")):
+            raise ValueError(f"{key} must be positive")
+        row.append(value)
+    return row
+
+
+def predict_somatotype_batch(rows: list):
+    """
+    Predicts somatotypes for many measurement dicts (same keys as
+    predict_somatotype) with one matrix scoring pass. Returns one entry
+    per input row: the prediction, or {"error": message} for a row that
+    failed validation.
+    """
+    current = serving
+    if current is None:
+        raise Exception("Model not loaded")
+
+    results = [None] * len(rows)
+    valid, matrix = [], []
+    for i, data in enumerate(rows):
+        try:
+            matrix.append(_validate(data))
+            valid.append(i)
+        except ValueError as e:
+            results[i] = {"error": str(e)}
+
+    if valid:
+        features = compute_features(matrix)
+        probabilities = current.engine.predict_proba(features).tolist()
+        for i, row, (_, bmi, *ratios) in zip(valid, probabilities, features.tolist()):
+            results[i] = {
+                **_confidence(row, current),
+                "bmi": round(bmi, 2),
+                "bmi_category": get_bmi_category(bmi),
+                "features_used": {
+                    "BMI": round(bmi, 2),
+                    **{name: round(value, 4) for name, value in zip(FEATURES[2:], ratios)}
+                }
+            }
+    return results
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+import joblib
+
+# Versioned model artifacts:
+#   models/<version>.pkl    the fitted estimator
+#   models/<version>.json   metadata (features, classes, accuracy, sha256, ...)
+#   models/current.json     {"version": ...}, the version workers should serve
+# Without a registry the original mlr_somatotype_model.pkl is served as "legacy".
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(__file__), "../data/models"))
+CURRENT_FILE = os.path.join(REGISTRY_DIR, "current.json")
+LEGACY_MODEL_PATH = os.path.join(os.path.dirname(__file__), "../data/mlr_somatotype_model.pkl")
+LEGACY_VERSION = "legacy"
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    """Write a JSON file so readers see the old or the new content, never a partial one"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _paths(version: str) -> Tuple[str, str]:
+    if version == LEGACY_VERSION:
+        return LEGACY_MODEL_PATH, ""
+    if os.path.basename(version) != version or version.startswith("."):
+        raise ValueError(f"Invalid model version: {version}")
+    return os.path.join(REGISTRY_DIR, f"{version}.pkl"), os.path.join(REGISTRY_DIR, f"{version}.json")
+
+
+def multi_class(estimator) -> str:
+    """How the estimator turns class scores into probabilities: "multinomial" (softmax) or "ovr" (one-vs-rest)"""
+    # SGDClassifier fits one binary classifier per class, as does LogisticRegression with liblinear or ovr
+    if type(estimator).__name__ == "SGDClassifier":
+        return "ovr"
+    if getattr(estimator, "multi_class", "auto") == "ovr" or getattr(estimator, "solver", None) == "liblinear":
+        return "ovr"
+    return "multinomial"
+
+
+def register(estimator, metadata: Optional[Dict[str, Any]] = None) -> str:
+    """Store a fitted estimator as a new version and return the version name"""
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+    tmp_path = os.path.join(REGISTRY_DIR, f"new.{os.getpid()}.tmp")
+    joblib.dump(estimator, tmp_path)
+    sha256 = _sha256(tmp_path)
+    version = f"v{datetime.now().strftime('%Y%m%d-%H%M%S')}-{sha256[:8]}"
+    model_path, meta_path = _paths(version)
+
+    names = getattr(estimator, "feature_names_in_", None)
+    _write_json(meta_path, {
+        "version": version,
+        "created_at": datetime.now().isoformat(),
+        "sha256": sha256,
+        "features": list(names) if names is not None else None,
+        "classes": [str(c) for c in getattr(estimator, "classes_", [])],
+        "multi_class": multi_class(estimator),
+        **(metadata or {}),
+    })
+    # The artifact appears last, so a listed version always has its metadata
+    os.replace(tmp_path, model_path)
+    return version
+
+
+def activate(version: str):
+    """Make a registered version the one every worker serves"""
+    model_path, _ = _paths(version)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model version {version} not found")
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+    _write_json(CURRENT_FILE, {"version": version, "activated_at": datetime.now().isoformat()})
+
+
+def current_version() -> str:
+    """The active version, or the legacy model when nothing was activated"""
+    try:
+        with open(CURRENT_FILE, 'r') as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return LEGACY_VERSION
+
+
+def list_versions() -> List[Dict[str, Any]]:
+    """Metadata of every registered version, oldest first"""
+    versions = []
+    if os.path.isdir(REGISTRY_DIR):
+        for name in sorted(os.listdir(REGISTRY_DIR)):
+            if name.endswith(".pkl"):
+                _, meta_path = _paths(name[:-len(".pkl")])
+                with open(meta_path, 'r') as f:
+                    versions.append(json.load(f))
+    return versions
+
+
+def load(version: Optional[str] = None):
+    """Load a version (the active one by default); returns (estimator, metadata)"""
+    version = version or current_version()
+    model_path, meta_path = _paths(version)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model version {version} not found at {model_path}")
+
+    sha256 = _sha256(model_path)
+    if meta_path:
+        with open(meta_path, 'r') as f:
+            metadata = json.load(f)
+        if metadata.get("sha256") != sha256:
+            raise ValueError(f"Model version {version} does not match its recorded hash")
+    else:
+        metadata = {"version": version, "sha256": sha256}
+    return joblib.load(model_path), metadata
@@ -0,0 +1,215 @@
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+from . import rag
+from ..database import plan_pool_collection, jobs_collection, DeleteOne, InsertOne, BulkWriteError
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../../.env"))
+
+# Ready-made meal plans per profile segment, so /meal-plan/generate can answer
+# without waiting on the LLM. A plan is claimed by deleting it from the pool,
+# so each one is served once, to one user, even with several workers.
+# Plans kept per segment (0 disables the pool)
+PLAN_POOL_SIZE = int(os.getenv("PLAN_POOL_SIZE", "3"))
+# Refill a segment in the background once it holds fewer plans than this
+PLAN_POOL_LOW_WATERMARK = int(os.getenv("PLAN_POOL_LOW_WATERMARK", "1"))
+# LLM calls made at once by refills, across all segments
+PLAN_POOL_REFILL_CONCURRENCY = int(os.getenv("PLAN_POOL_REFILL_CONCURRENCY", "2"))
+# Plan lengths kept in the pool; requests for other lengths are always generated
+PLAN_POOL_DAYS = sorted({int(d) for d in os.getenv("PLAN_POOL_DAYS", "1,7").split(",") if d.strip()})
+# Fill the KB's segments for each of PLAN_POOL_GOALS and PLAN_POOL_DAYS at startup, in one worker
+PLAN_POOL_PREWARM = os.getenv("PLAN_POOL_PREWARM", "true").lower() == "true"
+# The goals the app offers. Segments with one of them and the KB's own values are always
+# kept filled; any other segment only once a worker has seen PLAN_POOL_MIN_REQUESTS requests for it
+PLAN_POOL_GOALS = [g.strip().lower() for g in os.getenv(
+    "PLAN_POOL_GOALS", "Healthy Living,Weight Loss,Muscle Gain,Weight Gain,Lean & Toned").split(",") if g.strip()]
+PLAN_POOL_MIN_REQUESTS = int(os.getenv("PLAN_POOL_MIN_REQUESTS", "3"))
+
+SEGMENT_FIELDS = ("gender_str", "bmi_category", "somatotype", "goal", "dietary_constraints", "age_band")
+# Other segments whose requests are counted, least recently requested dropped first
+DEMAND_TRACKED = 1000
+# A worker that started prewarming keeps others from doing it again for this long
+PREWARM_LEASE = timedelta(minutes=10)
+PREWARM_JOB = "plan_pool_prewarm"
+
+_refills: Dict[str, asyncio.Task] = {}
+_refill_slots = asyncio.Semaphore(max(PLAN_POOL_REFILL_CONCURRENCY, 1))
+_demand: "OrderedDict[str, int]" = OrderedDict()
+
+
+def enabled() -> bool:
+    return PLAN_POOL_SIZE > 0 and rag.client is not None
+
+
+def segment_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The profile fields a generated plan depends on, normalized as generate_meal_plan reads them"""
+    return {
+        "gender_str": str(profile.get("gender_str") or "male").strip().lower(),
+        "bmi_category": profile.get("bmi_category") or "normal",
+        "somatotype": profile.get("somatotype") or "Mesomorph",
+        "goal": str(profile.get("goal") or "healthy living").strip().lower(),
+        "dietary_constraints": str(profile.get("dietary_constraints") or "none").strip().lower(),
+        "age_band": profile.get("age_band"),
+        # Filters added to the KB later select options too, so they split segments as well
+        **{field: profile.get(field) for field in _kb_filter_fields() if field not in SEGMENT_FIELDS},
+    }
+
+
+def segment_key(profile: Dict[str, Any], plan_days: int) -> str:
+    fields = segment_profile(profile)
+    return "|".join(str(value or "") for value in fields.values()) + f"|{plan_days}"
+
+
+def _kb_filter_fields() -> Dict[str, str]:
+    """Profile field -> the KB filter it sets, for each filter the KB uses"""
+    return {rag.KB_FILTER_FIELDS.get(dim, dim): dim for dim in sorted(rag.KB_INDEX.values)}
+
+
+def is_valid(plan: Any, plan_days: int) -> bool:
+    """A complete LLM plan: every day has each meal with a main option"""
+    # Fallback and partly fallback plans carry a "source"
+    if not isinstance(plan, dict) or "source" in plan:
+        return False
+    days = plan.get("meal_plan")
+    if not isinstance(days, dict):
+        return False
+    for day in range(1, plan_days + 1):
+        meals = days.get(f"day_{day}")
+        if not isinstance(meals, dict):
+            return False
+        for meal in ("breakfast", "lunch", "dinner"):
+            if not isinstance(meals.get(meal), dict) or not meals[meal].get("main"):
+                return False
+    return True
+
+
+def kb_segments():
+    """(gender, bmi_category, somatotype) combinations the KB has options for"""
+    somatotypes = sorted({key[0] for key in rag.KB_INDEX.keys("bodytype_guidance")})
+    return [(gender, bmi_category, somatotype)
+            for gender, bmi_category in rag.KB_INDEX.meal_times for somatotype in somatotypes]
+
+
+def is_bounded(fields: Dict[str, Any]) -> bool:
+    """Whether a segment profile is one of the fixed set made of the KB's values and PLAN_POOL_GOALS"""
+    if (fields["gender_str"], fields["bmi_category"], fields["somatotype"]) not in kb_segments():
+        return False
+    if fields["goal"] not in PLAN_POOL_GOALS:
+        return False
+    # Every other field is unset or a value the KB has entries for
+    dims = _kb_filter_fields()
+    for field, value in fields.items():
+        if field in ("gender_str", "bmi_category", "somatotype", "goal") or value in (None, "none"):
+            continue
+        known = {str(v).lower() for v in rag.KB_INDEX.values.get(dims.get(field, field), ())}
+        if str(value).lower() not in known:
+            return False
+    return True
+
+
+def _requested(segment: str) -> int:
+    """Counts a request for a segment outside the fixed set; returns its count so far"""
+    count = _demand.pop(segment, 0) + 1
+    _demand[segment] = count
+    if len(_demand) > DEMAND_TRACKED:
+        _demand.popitem(last=False)
+    return count
+
+
+async def refill(segment: str, profile: Dict[str, Any], plan_days: int):
+    """Tops a segment up to PLAN_POOL_SIZE plans"""
+    while await plan_pool_collection.count_documents({"segment": segment}) < PLAN_POOL_SIZE:
+        async with _refill_slots:
+            plan = await rag.generate_meal_plan(dict(profile), plan_days)
+        if not is_valid(plan, plan_days):
+            # Most likely rate limited; the next request for the segment tries again
+            print(f"Warning: Plan pool refill for {segment} stopped: generated plan was incomplete")
+            return
+        # Other workers may have filled the segment while this plan was generated
+        if await plan_pool_collection.count_documents({"segment": segment}) >= PLAN_POOL_SIZE:
+            return
+        doc = await plan_pool_collection.insert_one({
+            "segment": segment,
+            "plan_days": plan_days,
+            "created_at": datetime.now().isoformat(),
+            "plan_data": plan,
+        })
+        # Workers inserting at the same time all passed the check; the plans past PLAN_POOL_SIZE
+        # in pool order remove themselves, so the pool never stays overfilled
+        pooled = await (await plan_pool_collection.find({"segment": segment}, {"_id": 1})) \
+            .sort("created_at", 1).limit(PLAN_POOL_SIZE).to_list()
+        if doc["_id"] not in {p["_id"] for p in pooled}:
+            await plan_pool_collection.delete_one({"_id": doc["_id"]})
+            return
+
+
+async def _run_refill(segment: str, profile: Dict[str, Any], plan_days: int):
+    try:
+        await refill(segment, profile, plan_days)
+    except Exception as e:
+        print(f"Warning: Plan pool refill for {segment} failed: {e}")
+    finally:
+        _refills.pop(segment, None)
+
+
+def schedule_refill(segment: str, profile: Dict[str, Any], plan_days: int):
+    """Starts a background refill of the segment unless one is already running in this worker"""
+    if segment not in _refills:
+        _refills[segment] = asyncio.create_task(_run_refill(segment, segment_profile(profile), plan_days))
+
+
+async def take(profile: Dict[str, Any], plan_days: int) -> Optional[Dict[str, Any]]:
+    """Claims a ready plan for the profile, or returns None when its segment is empty"""
+    if not enabled() or plan_days not in PLAN_POOL_DAYS:
+        return None
+    segment = segment_key(profile, plan_days)
+    candidates = await (await plan_pool_collection.find({"segment": segment}, {"plan_data": 1})) \
+        .sort("created_at", 1).limit(PLAN_POOL_SIZE).to_list()
+
+    claimed = None
+    for doc in candidates:
+        # Another worker may claim the same plan first; only one delete succeeds
+        result = await plan_pool_collection.bulk_write([DeleteOne({"_id": doc["_id"]})])
+        if result["deleted_count"]:
+            claimed = doc
+            break
+
+    left = len(candidates) - (1 if claimed else 0)
+    if left < PLAN_POOL_LOW_WATERMARK or claimed is None:
+        # Free-form goals and constraints make segments unbounded; only fill the ones asked for again
+        if is_bounded(segment_profile(profile)) or _requested(segment) >= PLAN_POOL_MIN_REQUESTS:
+            schedule_refill(segment, profile, plan_days)
+    return claimed["plan_data"] if claimed else None
+
+
+async def _claim_prewarm() -> bool:
+    """Lets one worker prewarm; the others see its fresh lease and skip it"""
+    job = await jobs_collection.find_one({"name": PREWARM_JOB})
+    now = datetime.now().isoformat()
+    if job is None:
+        try:
+            # The fixed _id makes a second insert fail
+            await jobs_collection.bulk_write([InsertOne({"_id": PREWARM_JOB, "name": PREWARM_JOB, "updated_at": now})])
+        except BulkWriteError:
+            return False
+        return True
+    if datetime.now() - datetime.fromisoformat(job["updated_at"]) < PREWARM_LEASE:
+        return False
+    # Whoever claims first changes the updated_at the others match on
+    result = await jobs_collection.update_one(
+        {"name": PREWARM_JOB, "updated_at": job["updated_at"]}, {"$set": {"updated_at": now}})
+    return result["matched_count"] == 1
+
+
+async def prewarm():
+    """Fills the segments the KB has options for, for each of PLAN_POOL_GOALS and PLAN_POOL_DAYS"""
+    if not (enabled() and PLAN_POOL_PREWARM) or not await _claim_prewarm():
+        return
+    for plan_days in PLAN_POOL_DAYS:
+        for goal in PLAN_POOL_GOALS:
+            for gender, bmi_category, somatotype in kb_segments():
+                profile = {"gender_str": gender, "bmi_category": bmi_category, "somatotype": somatotype, "goal": goal}
+                schedule_refill(segment_key(profile, plan_days), profile, plan_days)
@@ -1,95 +1,94 @@
+import asyncio
 import json
 import os
-from openai import OpenAI
+import random
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
+from .kb_index import KBIndex, compile_kb
+from .json_stream import PlanStreamParser
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "../../.env"))
 
-# Configure Gemini
 # Configure OpenAI
 API_KEY = os.getenv("OPENAI_API_KEY")
+# One async client per process: its connection pool is shared by all requests
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
 if API_KEY:
-    client = OpenAI(api_key=API_KEY)
+    client = AsyncOpenAI(
+        api_key=API_KEY,
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        # Rate limits are retried below, with our own backoff and fallback plan
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        )),
+    )
 else:
     print("Warning: OPENAI_API_KEY not found in environment variables.")
     client = None
 
-# Load KB
+# Load KB, compiled into lookup tables once per process
 KB_PATH = os.path.join(os.path.dirname(__file__), "../data/kb.json")
 try:
-    with open(KB_PATH, 'r', encoding='utf-8') as f:
-        KB_DATA = json.load(f)
+    KB_INDEX = compile_kb(KB_PATH)
 except FileNotFoundError:
     print(f"Warning: KB file not found at {KB_PATH}")
-    KB_DATA = []
+    KB_INDEX = KBIndex([])
 
-def retrieve_context(gender, bmi_category, somatotype):
+def retrieve_context(gender, bmi_category, somatotype, **filters):
     """
     Retrieves relevant meal options and guidance from the KB.
+    Extra filters (age_band, goal, dietary_constraint, or any other the KB
+    uses) narrow the options to entries written for them. Option lists are
+    shared tuples.
     """
-    context = {
-        "meal_options": {},
-        "guidance": [],
-        "snacks": []
+    meal_options = {
+        meal_time: KB_INDEX.lookup("meal_options", (gender, bmi_category, meal_time), filters)
+        for meal_time in KB_INDEX.meal_times.get((gender, bmi_category), ())
     }
-    
-    for entry in KB_DATA:
-        filters = entry.get("filters", {})
-        entry_type = entry.get("type")
-        
-        # Meal Options
-        if entry_type == "meal_options":
-            if (filters.get("gender") == gender and 
-                filters.get("bmi_category") == bmi_category):
-                meal_time = filters.get("meal_time")
-                if meal_time:
-                    context["meal_options"][meal_time] = entry.get("options", [])
-        
-        # Guidance
-        elif entry_type == "bodytype_guidance":
-            if filters.get("somatotype") == somatotype:
-                context["guidance"].extend(entry.get("options", []))
-                
-        # Snacks
-        elif entry_type == "snack_options":
-            if filters.get("bmi_category") == bmi_category:
-                context["snacks"].extend(entry.get("options", []))
-                
-    return context
-
-def generate_meal_plan(profile, plan_days=1):
+    return {
+        # Meal times whose entries are all for other filter values are left out
+        "meal_options": {meal_time: options for meal_time, options in meal_options.items() if options},
+        "guidance": KB_INDEX.lookup("bodytype_guidance", (somatotype,), filters),
+        "snacks": KB_INDEX.lookup("snack_options", (bmi_category,), filters),
+    }
+
+async def close_client():
+    """Closes the pooled connections on shutdown."""
+    if client:
+        await client.close()
+
+# Multi-day plans are generated as concurrent requests of at least
+# MEAL_PLAN_DAYS_PER_REQUEST days, with at most MEAL_PLAN_CONCURRENCY requests
+# per plan; longer plans get more days per request, so they all run at once
+# and latency and output length stay those of a short plan
+MEAL_PLAN_DAYS_PER_REQUEST = int(os.getenv("MEAL_PLAN_DAYS_PER_REQUEST", "1"))
+MEAL_PLAN_CONCURRENCY = int(os.getenv("MEAL_PLAN_CONCURRENCY", "8"))
+# Options of each meal shown to each request
+OPTIONS_PER_REQUEST = 8
+MEALS = ("breakfast", "lunch", "dinner", "snacks")
+
+SYSTEM_INSTRUCTION = "You are a professional nutritionist and meal planner specializing in Sri Lankan cuisine."
+
+def meal_options(context, meal):
+    return context['snacks'] if meal == "snacks" else context['meal_options'].get(meal, ())
+
+def build_prompt(profile, context, plan_days, options):
     """
-    Generates a meal plan using OpenAI based on the profile and retrieved context.
+    The user message for a plan of plan_days days, offering options[meal]
+    (already shuffled) for each meal.
     """
-    gender = "female" if profile.get("gender") == 1 else "male"
-    
     gender_str = profile.get("gender_str", "male").lower()
     bmi_category = profile.get("bmi_category", "normal")
     somatotype = profile.get("somatotype", "Mesomorph")
-    
-    context = retrieve_context(gender_str, bmi_category, somatotype)
-    
-    system_instruction = "You are a professional nutritionist and meal planner specializing in Sri Lankan cuisine."
-
-    # Shuffle options to ensure variety
-    import random
     variation_seed = random.randint(1, 10000)
-    
-    # helper to shuffle list efficiently
-    def shuffle_list(lst):
-        l = lst.copy()
-        random.shuffle(l)
-        return l
-
-    # Shuffle the context arrays before putting them in the prompt
-    shuffled_breakfast = shuffle_list(context['meal_options'].get('breakfast', []))
-    shuffled_lunch = shuffle_list(context['meal_options'].get('lunch', []))
-    shuffled_dinner = shuffle_list(context['meal_options'].get('dinner', []))
-    shuffled_snacks = shuffle_list(context['snacks'])
-    
-    # Select a subset to reduce token usage and force rotation (e.g., top 10 after shuffle)
+
+    # Select a subset to reduce token usage and force rotation (e.g., top 8 after shuffle)
     # This ensures different runs see different "top" options
-    user_content = f"""Create a {plan_days}-day meal plan for a user with the following profile:
+    return f"""Create a {plan_days}-day meal plan for a user with the following profile:
     - Gender: {gender_str}
     - BMI Category: {bmi_category}
     - Somatotype: {somatotype}
@@ -106,19 +105,19 @@ def generate_meal_plan(profile, plan_days=1):
     Use the following retrieved options as the base ingredients. 
     
     Breakfast Options (Randomized):
-    {json.dumps(shuffled_breakfast[:8], indent=2)} 
+    {json.dumps(options['breakfast'], indent=2)} 
     
     Lunch Options (Randomized):
-    {json.dumps(shuffled_lunch[:8], indent=2)}
+    {json.dumps(options['lunch'], indent=2)}
     
     Dinner Options (Randomized):
-    {json.dumps(shuffled_dinner[:8], indent=2)}
+    {json.dumps(options['dinner'], indent=2)}
     
     Snack Options (Randomized):
-    {json.dumps(shuffled_snacks[:8], indent=2)}
+    {json.dumps(options['snacks'], indent=2)}
     
     Specific Guidance for {somatotype}:
-    {json.dumps(context['guidance'], indent=2)}
+    {KB_INDEX.lookup_json("bodytype_guidance", (somatotype,), kb_filters(profile))}
     
     OUTPUT FORMAT:
     Return strictly valid JSON with the following structure. 
@@ -150,45 +149,237 @@ def generate_meal_plan(profile, plan_days=1):
     }}
     Do not include markdown formatting like ```json. Just the raw JSON string.
     """
-    
-    if client:
-        import time
-        for attempt in range(3):
-            try:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    temperature=0.7, # Increased temperature for variety
-                    messages=[
-                        {"role": "system", "content": system_instruction},
-                        {"role": "user", "content": user_content}
-                    ]
-                )
-                
-                # Clean up potential markdown code blocks
-                text = response.choices[0].message.content.strip()
-                if text.startswith("```json"):
-                    text = text[7:]
-                if text.endswith("```"):
-                    text = text[:-3]
-                return json.loads(text)
-            except Exception as e:
-                error_str = str(e)
-                print(f"DEBUG: OpenAI API Error: {error_str}") # Added for debugging
-                if "429" in error_str or "rate limit" in error_str.lower():
-                    wait_time = 5 * (2 ** attempt)
-                    print(f"OpenAI quota exceeded. Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"Error calling OpenAI: {e}")
-                    break
-        
-        print("All retries failed. Generating fallback plan locally.")
-        return generate_fallback_plan(context, plan_days, somatotype)
-    else:
-        return {
+
+def parse_completion(text):
+    # Clean up potential markdown code blocks
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return json.loads(text)
+
+async def backoff(error, attempt):
+    """Waits before retrying a rate-limited call; False when the error is not worth a retry."""
+    error_str = str(error)
+    print(f"DEBUG: OpenAI API Error: {error_str}") # Added for debugging
+    if "429" in error_str or "rate limit" in error_str.lower():
+        wait_time = 5 * (2 ** attempt)
+        print(f"OpenAI quota exceeded. Retrying in {wait_time} seconds...")
+        # Only this request waits; the event loop keeps serving others
+        await asyncio.sleep(wait_time)
+        return True
+    print(f"Error calling OpenAI: {error}")
+    return False
+
+async def complete_stream(user_content):
+    """
+    Streams one chat completion as text pieces. Calls are retried with
+    backoff on rate limits until the first piece arrives; a stream cut off
+    later just ends early.
+    """
+    for attempt in range(3):
+        started = False
+        try:
+            stream = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                temperature=0.7, # Increased temperature for variety
+                messages=[
+                    {"role": "system", "content": SYSTEM_INSTRUCTION},
+                    {"role": "user", "content": user_content}
+                ],
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    started = True
+                    yield chunk.choices[0].delta.content
+            return
+        except Exception as e:
+            if started:
+                print(f"Error while streaming from OpenAI: {e}")
+                return
+            if not await backoff(e, attempt):
+                return
+
+# Profile fields named differently from the KB filter they set
+KB_FILTER_FIELDS = {"dietary_constraint": "dietary_constraints"}
+
+def kb_filters(profile):
+    """Optional KB filters taken from the profile, one for each filter the KB uses."""
+    return {dim: profile.get(KB_FILTER_FIELDS.get(dim, dim)) for dim in KB_INDEX.values}
+
+def prepare(profile):
+    """Retrieves the KB context for a profile."""
+    gender_str = profile.get("gender_str", "male").lower()
+    bmi_category = profile.get("bmi_category", "normal")
+    somatotype = profile.get("somatotype", "Mesomorph")
+    return retrieve_context(gender_str, bmi_category, somatotype, **kb_filters(profile))
+
+def split_days(context, plan_days):
+    """
+    Splits a plan into (first_day, days) chunks, each with its own window of
+    the shuffled options, so concurrent requests start from different dishes.
+    """
+    # Shuffle options to ensure variety
+    shuffled = {meal: random.sample(list(meal_options(context, meal)), len(meal_options(context, meal))) for meal in MEALS}
+    concurrency = max(MEAL_PLAN_CONCURRENCY, 1)
+    per_request = max(MEAL_PLAN_DAYS_PER_REQUEST, -(-plan_days // concurrency), 1)
+    chunks = []
+    for index, first_day in enumerate(range(1, plan_days + 1, per_request)):
+        days = min(per_request, plan_days - first_day + 1)
+        options = {}
+        for meal, values in shuffled.items():
+            # Wraps around once the requests have used every option
+            start = (index * OPTIONS_PER_REQUEST) % len(values) if values else 0
+            window = (values[start:] + values[:start])[:OPTIONS_PER_REQUEST]
+            options[meal] = window
+        chunks.append((first_day, days, options))
+    return chunks
+
+def split_option(option):
+    """KB option text to the item/portion form of generated meals."""
+    item, _, portion = option.partition(" (Approx. ")
+    return {"item": item.strip(), "portion": portion.rstrip(")")}
+
+def dish_name(choice):
+    if isinstance(choice, dict):
+        choice = choice.get("item", "")
+    return str(choice).strip().lower()
+
+class DishDeduplicator:
+    """
+    Replaces dishes already used earlier in the plan with KB options not
+    used yet, while there are any left for that meal. Meals are checked in
+    the order they are generated.
+    """
+
+    def __init__(self, context):
+        self.seen = {meal: set() for meal in MEALS}
+        self.unused = {meal: random.sample(list(meal_options(context, meal)), len(meal_options(context, meal))) for meal in MEALS}
+
+    def apply(self, meal, choices):
+        if meal not in self.seen or not isinstance(choices, dict):
+            return
+        seen, unused = self.seen[meal], self.unused[meal]
+        for slot, choice in choices.items():
+            name = dish_name(choice)
+            while name in seen and unused:
+                replacement = split_option(unused.pop())
+                if dish_name(replacement) not in seen:
+                    choices[slot] = replacement
+                    name = dish_name(replacement)
+            seen.add(name)
+
+def plan_events(plan):
+    """The meal and day events of a finished plan, for streaming it."""
+    for day, meals in plan.get("meal_plan", {}).items():
+        for meal, choices in meals.items():
+            yield {"event": "meal", "day": day, "meal": meal, "data": choices}
+        yield {"event": "day", "day": day}
+
+async def stream_meal_plan(profile, plan_days=1):
+    """
+    Generates a meal plan like generate_meal_plan, yielding each meal as soon
+    as the model has written it:
+      {"event": "meal", "day": "day_1", "meal": "breakfast", "data": {...}}
+      {"event": "day", "day": "day_1"} once a day is complete
+      {"event": "done", "plan": {...}} with the whole plan, last
+    """
+    context = prepare(profile)
+    somatotype = profile.get("somatotype", "Mesomorph")
+
+    if not client:
+        yield {"event": "done", "plan": {
             "message": "OpenAI API key not configured. Returning raw context.",
             "context": context
-        }
+        }}
+        return
+
+    chunks = split_days(context, plan_days)
+    queue = asyncio.Queue()
+
+    async def stream_chunk(first_day, days, options):
+        # Puts (day number, meal, value) events, then ("end", advice)
+        parser, pieces, advice = PlanStreamParser(), [], []
+        try:
+            async for piece in complete_stream(build_prompt(profile, context, days, options)):
+                pieces.append(piece)
+                for day, meal, value in parser.feed(piece):
+                    # Renumber the chunk's day_1.. into its place in the plan
+                    suffix = day.rpartition("_")[2]
+                    if suffix.isdigit() and 1 <= int(suffix) <= days:
+                        queue.put_nowait((first_day + int(suffix) - 1, meal, value))
+                if parser.failed:
+                    # Like other malformed output, the rest of these days is filled in from the KB
+                    print(f"Warning: Malformed meal plan for days {first_day}-{first_day + days - 1}; stopped reading it")
+                    break
+            try:
+                advice = parse_completion("".join(pieces)).get("advice", [])
+            except (ValueError, AttributeError):
+                pass
+        finally:
+            queue.put_nowait(("end", advice, None))
+
+    tasks = [asyncio.create_task(stream_chunk(*chunk)) for chunk in chunks]
+    days, closed, advice, running = {}, set(), [], len(tasks)
+    dedup = DishDeduplicator(context)
+    try:
+        while running:
+            number, meal, value = await queue.get()
+            if number == "end":
+                running -= 1
+                advice.extend(tip for tip in meal if isinstance(tip, str) and tip not in advice)
+            elif meal is None:
+                # A day the model closed with every meal; the others are completed below
+                if all(m in days.get(number, {}) for m in MEALS):
+                    closed.add(number)
+                    yield {"event": "day", "day": f"day_{number}"}
+            elif isinstance(value, dict):
+                dedup.apply(meal, value)
+                days.setdefault(number, {})[meal] = value
+                yield {"event": "meal", "day": f"day_{number}", "meal": meal, "data": value}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if not days:
+        print("All retries failed. Generating fallback plan locally.")
+        plan = generate_fallback_plan(context, plan_days, somatotype)
+        for event in plan_events(plan):
+            yield event
+        yield {"event": "done", "plan": plan}
+        return
+
+    # Fill the gaps left by failed or cut off requests so the plan still has every meal
+    filled = False
+    for number in range(1, plan_days + 1):
+        day = days.setdefault(number, {})
+        fallback = generate_fallback_plan(context, 1, somatotype)["meal_plan"]["day_1"]
+        for meal in MEALS:
+            if meal not in day:
+                filled = True
+                # In the item/portion form of the generated meals
+                day[meal] = {slot: split_option(option) for slot, option in fallback[meal].items()}
+                dedup.apply(meal, day[meal])
+                yield {"event": "meal", "day": f"day_{number}", "meal": meal, "data": day[meal]}
+        if number not in closed:
+            yield {"event": "day", "day": f"day_{number}"}
+
+    plan = {"meal_plan": {f"day_{number}": days[number] for number in range(1, plan_days + 1)}, "advice": advice}
+    if filled:
+        plan["source"] = "partial_fallback"
+    yield {"event": "done", "plan": plan}
+
+async def generate_meal_plan(profile, plan_days=1):
+    """
+    Generates a meal plan using OpenAI based on the profile and retrieved context.
+    Days are split into at most MEAL_PLAN_CONCURRENCY requests made at once,
+    then merged into one plan with repeated dishes replaced.
+    """
+    async for event in stream_meal_plan(profile, plan_days):
+        if event["event"] == "done":
+            return event["plan"]
 
 def generate_fallback_plan(context, plan_days, somatotype):
     """
@@ -226,6 +417,6 @@ def generate_fallback_plan(context, plan_days, somatotype):
         
     return {
         "meal_plan": meal_plan,
-        "advice": context['guidance'] + ["(Note: This plan was generated automatically due to high server load.)"],
+        "advice": list(context['guidance']) + ["(Note: This plan was generated automatically due to high server load.)"],
         "source": "fallback_generator"
     }
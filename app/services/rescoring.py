@@ -0,0 +1,216 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+from . import model
+from ..database import measurements_collection, jobs_collection, InsertOne, UpdateOne, BulkWriteError
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../../.env"))
+
+# Re-scores stored measurements with the serving model, batch by batch.
+# Progress is saved in the jobs collection after every batch, so an
+# interrupted job resumes where it stopped instead of starting over.
+#
+# Any worker may start the job, but only the one holding its lease runs it.
+# Saving progress renews the lease. Another worker takes the job over once
+# the lease has not been renewed for LEASE, or at once when the owner was a
+# process on the same host that no longer exists (e.g. after a restart).
+JOB_NAME = "rescore_measurements"
+RESCORE_BATCH_SIZE = int(os.getenv("RESCORE_BATCH_SIZE", "500"))
+# Pause between batches so live requests get the database and the event loop
+RESCORE_BATCH_DELAY_MS = float(os.getenv("RESCORE_BATCH_DELAY_MS", "50"))
+LEASE = timedelta(minutes=2)
+
+PROJECTION = {key: 1 for key in model.MEASUREMENT_KEYS + ["model_version"]}
+
+_task: Optional[asyncio.Task] = None
+# Identifies this process as the owner of the job; reset in forked workers
+_owner = (None, None)
+
+
+async def get_status() -> Optional[Dict[str, Any]]:
+    """The saved progress of the job, if it ever ran."""
+    return await jobs_collection.find_one({"name": JOB_NAME}, {"_id": 0})
+
+
+def _model_input(doc: Dict[str, Any]) -> Dict[str, Any]:
+    data = {key: doc.get(key) for key in model.MEASUREMENT_KEYS}
+    # Records keep the gender as submitted ("male"/"female")
+    if isinstance(data["gender"], str):
+        data["gender"] = 1 if data["gender"].lower() == "male" else 0
+    return data
+
+
+def _owner_id() -> str:
+    global _owner
+    if _owner[0] != os.getpid():
+        _owner = (os.getpid(), uuid.uuid4().hex)
+    return _owner[1]
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill would terminate the process; only the lease applies on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _abandoned(job: Dict[str, Any]) -> bool:
+    """Whether a running job's owner has stopped"""
+    if job.get("owner") == _owner_id():
+        # This worker runs one job at a time, so its earlier run has ended
+        return True
+    if datetime.now() - datetime.fromisoformat(job["updated_at"]) > LEASE:
+        return True
+    if job.get("owner_host") != socket.gethostname() or job.get("owner_pid") is None:
+        return False
+    # The same pid under another owner id is an earlier run of this process (e.g. pid 1 in a container)
+    return job["owner_pid"] == os.getpid() or not _pid_alive(job["owner_pid"])
+
+
+async def _claim(job: Optional[Dict[str, Any]]) -> bool:
+    """Takes the job's lease; when several workers try at once, only one gets it"""
+    owner = {
+        "owner": _owner_id(),
+        "owner_host": socket.gethostname(),
+        "owner_pid": os.getpid(),
+        "updated_at": datetime.now().isoformat(),
+    }
+    if job is None:
+        try:
+            # The fixed _id makes a second insert fail
+            await jobs_collection.bulk_write([InsertOne({"_id": JOB_NAME, "name": JOB_NAME, **owner})])
+        except BulkWriteError:
+            return False
+        return True
+    # Whoever claims first changes the owner and updated_at the others match on
+    result = await jobs_collection.update_one(
+        {"name": JOB_NAME, "owner": job.get("owner"), "updated_at": job.get("updated_at")}, {"$set": owner})
+    return result["matched_count"] == 1
+
+
+async def _save(status: Dict[str, Any]) -> bool:
+    """Saves progress and renews the lease; False once another worker has taken the job over"""
+    status["updated_at"] = datetime.now().isoformat()
+    result = await jobs_collection.update_one({"name": JOB_NAME, "owner": _owner_id()}, {"$set": status})
+    return result["matched_count"] == 1
+
+
+async def run_rescore() -> bool:
+    """
+    Brings every measurement up to the serving model version, unless another
+    worker holds the job. Returns True if a newer model was swapped in meanwhile.
+    """
+    current = model.serving
+    if current is None:
+        return False
+
+    job = await get_status()
+    if job and job.get("status") == "running" and not _abandoned(job):
+        # The owner moves on to newer versions itself
+        return False
+    if job and job.get("model_version") == current.version and job.get("status") == "done":
+        return False
+    if not await _claim(job):
+        return False
+
+    if job and job.get("model_version") == current.version:
+        position = job.get("position", 0)
+        status = {k: job.get(k, 0) for k in ("position", "updated", "failed")}
+    else:
+        position = 0
+        status = {"position": 0, "updated": 0, "failed": 0}
+    status.update({
+        "model_version": current.version,
+        "status": "running",
+        "total": await measurements_collection.count_documents({}),
+        "started_at": datetime.now().isoformat(),
+    })
+    if not await _save(status):
+        return False
+    print(f"Re-scoring measurements with model {current.version} from position {position}")
+
+    async def rescore(batch, last):
+        stale = [doc for doc in batch if doc.get("model_version") != current.version]
+        results = model.predict_somatotype_batch([_model_input(doc) for doc in stale])
+        if model.serving is not current:
+            # A newer model was swapped in; this worker starts over with it
+            await _save({"status": "superseded"})
+            return False
+        requests = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "somatotype": result["somatotype"],
+                "confidence": result["confidence"],
+                "margin": result["margin"],
+                "model_version": result["model_version"],
+            }})
+            for doc, result in zip(stale, results) if "error" not in result
+        ]
+        if requests:
+            await measurements_collection.bulk_write(requests, ordered=False)
+
+        status["position"] += len(batch)
+        status["updated"] += len(requests)
+        status["failed"] += len(stale) - len(requests)
+        if last:
+            status["status"] = "done"
+        if not await _save(status):
+            print("Re-scoring was taken over by another worker")
+            return False
+        if last or status["position"] % (RESCORE_BATCH_SIZE * 20) == 0:
+            print(f"Re-scored {status['position']}/{status['total']} measurements "
+                  f"({status['updated']} updated, {status['failed']} invalid)")
+        await asyncio.sleep(RESCORE_BATCH_DELAY_MS / 1000)
+        return True
+
+    # One cursor for the whole walk; records inserted meanwhile are already scored by the new model
+    batch = []
+    async for doc in (await measurements_collection.find({}, PROJECTION)).skip(position):
+        batch.append(doc)
+        if len(batch) == RESCORE_BATCH_SIZE:
+            if not await rescore(batch, False):
+                return model.serving is not current
+            batch = []
+    await rescore(batch, True)
+    return model.serving is not current
+
+
+async def _run():
+    try:
+        while await run_rescore():
+            pass
+    except Exception as e:
+        print(f"Warning: Re-scoring failed: {e}")
+
+
+def is_running() -> bool:
+    return _task is not None and not _task.done()
+
+
+def start() -> bool:
+    """
+    Starts (or resumes) the job in this worker unless it is already running here.
+    Called on every model swap; it does nothing when the measurements are up to date
+    or another worker holds the job.
+    """
+    global _task
+    if is_running():
+        return False
+    _task = asyncio.create_task(_run())
+    return True
+
+
+async def watch_interrupted(interval: float = LEASE.total_seconds() / 2):
+    """Background loop that resumes a job whose owner stopped, starting with a check right away."""
+    while True:
+        start()
+        await asyncio.sleep(interval)
@@ -0,0 +1,184 @@
+import asyncio
+import glob
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterator, Callable, Awaitable
+from dotenv import load_dotenv
+from ..database import users_collection, meal_plans_collection, chat_history_collection, DeleteOne
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../../.env"))
+
+# Cold documents are moved out of the hot collections into gzip JSON Lines segments:
+#   archive/<collection>/<timestamp>-<pid>.jsonl.gz
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "../../archive"))
+ARCHIVE_INTERVAL_MINUTES = float(os.getenv("ARCHIVE_INTERVAL_MINUTES", "60"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+RETENTION_POLICIES = {
+    # Chat turns older than max_age_days are archived, except each user's newest keep_last turns
+    "chat_history": {
+        "time_field": "timestamp",
+        "max_age_days": float(os.getenv("CHAT_HISTORY_RETENTION_DAYS", "30")),
+        "keep_last": int(os.getenv("CHAT_HISTORY_KEEP_LAST", "20")),
+    },
+    # Superseded plans (anything but the user's current plan) are archived after max_age_days
+    "meal_plans": {
+        "time_field": "created_at",
+        "max_age_days": float(os.getenv("MEAL_PLAN_RETENTION_DAYS", "7")),
+    },
+}
+
+
+async def set_current_plan(email: str, plan_id: str):
+    """Points the user at their current meal plan."""
+    await users_collection.update_one({"email": email}, {"$set": {"current_meal_plan_id": plan_id}})
+
+
+async def get_current_plan(email: str, projection: Optional[Dict[str, Any]] = None):
+    """Fetches the user's current meal plan through the pointer, falling back to the newest active plan."""
+    user = await users_collection.find_one({"email": email}, {"current_meal_plan_id": 1})
+    plan_id = user.get("current_meal_plan_id") if user else None
+    if plan_id:
+        plan = await meal_plans_collection.find_one({"_id": plan_id}, projection)
+        if plan:
+            return plan
+
+    # Users whose plans predate the pointer
+    cursor = await meal_plans_collection.find({"user_email": email, "active": True}, projection)
+    plans = await cursor.sort("created_at", -1).to_list(length=1)
+    return plans[0] if plans else None
+
+
+def _cutoff(policy: Dict[str, Any]) -> str:
+    # Timestamps are stored as ISO strings, which sort chronologically
+    return (datetime.now() - timedelta(days=policy["max_age_days"])).isoformat()
+
+
+def write_segment(name: str, docs: List[Dict[str, Any]]) -> str:
+    """Writes documents to a new compressed archive segment and returns its path."""
+    directory = os.path.join(ARCHIVE_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}.jsonl.gz")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for doc in docs:
+                f.write(json.dumps(doc, separators=(',', ':')).encode('utf-8') + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    # The segment must be complete on disk before the documents are deleted
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_archive(name: str, user_email: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yields archived documents of a collection, oldest segment first."""
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(ARCHIVE_DIR, name, "*.jsonl.gz"))):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                doc = json.loads(line)
+                # A crash between writing a segment and deleting its documents archives them twice
+                if doc.get("_id") in seen:
+                    continue
+                seen.add(doc.get("_id"))
+                if user_email is None or doc.get("user_email") == user_email:
+                    yield doc
+
+
+async def _move(name: str, collection, docs: List[Dict[str, Any]]) -> int:
+    if not docs:
+        return 0
+    # Compressing and fsyncing a segment would block the event loop
+    await asyncio.to_thread(write_segment, name, docs)
+    result = await collection.bulk_write([DeleteOne({"_id": doc["_id"]}) for doc in docs], ordered=False)
+    return result["deleted_count"]
+
+
+async def _archive(name: str, collection, is_kept: Callable[[Dict[str, Any]], Awaitable[bool]]) -> int:
+    """Moves the documents older than the policy's cutoff, except those is_kept holds back, in batches"""
+    policy = RETENTION_POLICIES[name]
+    field = policy["time_field"]
+    cutoff = _cutoff(policy)
+    archived = kept = 0
+    while True:
+        # Oldest first through the time index; moved documents are gone and kept ones are skipped,
+        # so each batch starts where the last one ended and stops at the cutoff
+        cursor = await collection.find({})
+        batch = await cursor.sort(field, 1).skip(kept).limit(ARCHIVE_BATCH_SIZE).to_list()
+        cold = [doc for doc in batch if doc.get(field, '') < cutoff]
+        moved = [doc for doc in cold if not await is_kept(doc)]
+        kept += len(cold) - len(moved)
+        archived += await _move(name, collection, moved)
+        if len(cold) < ARCHIVE_BATCH_SIZE:
+            return archived
+
+
+async def archive_chat_history() -> int:
+    """Archives cold chat turns."""
+    policy = RETENTION_POLICIES["chat_history"]
+    newest: Dict[str, set] = {}
+
+    async def is_kept(doc: Dict[str, Any]) -> bool:
+        email = doc.get("user_email")
+        if email not in newest:
+            cursor = await chat_history_collection.find({"user_email": email}, {"_id": 1})
+            turns = await cursor.sort(policy["time_field"], -1).limit(policy["keep_last"]).to_list()
+            newest[email] = {turn["_id"] for turn in turns}
+        return doc["_id"] in newest[email]
+
+    return await _archive("chat_history", chat_history_collection, is_kept)
+
+
+async def _current_plan_id(email: str) -> Optional[str]:
+    """The user's current plan, backfilling the pointer for users whose plans predate it."""
+    user = await users_collection.find_one({"email": email}, {"current_meal_plan_id": 1})
+    plan_id = user.get("current_meal_plan_id") if user else None
+    if plan_id and await meal_plans_collection.exists({"_id": plan_id}):
+        return plan_id
+    # Their newest active plan, or their newest plan when none is active
+    for active in (True, False):
+        cursor = await meal_plans_collection.find({"user_email": email, "active": active}, {"_id": 1})
+        plans = await cursor.sort(RETENTION_POLICIES["meal_plans"]["time_field"], -1).to_list(length=1)
+        if plans:
+            if user:
+                await set_current_plan(email, plans[0]["_id"])
+            return plans[0]["_id"]
+    return None
+
+
+async def archive_meal_plans() -> int:
+    """Archives superseded meal plans and backfills the current plan pointer."""
+    current: Dict[str, Optional[str]] = {}
+
+    async def is_kept(doc: Dict[str, Any]) -> bool:
+        email = doc.get("user_email")
+        if email not in current:
+            current[email] = await _current_plan_id(email)
+        return doc["_id"] == current[email]
+
+    return await _archive("meal_plans", meal_plans_collection, is_kept)
+
+
+async def archive_once() -> Dict[str, int]:
+    """Runs every retention policy once."""
+    return {
+        "chat_history": await archive_chat_history(),
+        "meal_plans": await archive_meal_plans(),
+    }
+
+
+async def run_archiver():
+    """Background loop applying the retention policies every ARCHIVE_INTERVAL_MINUTES."""
+    if ARCHIVE_INTERVAL_MINUTES <= 0:
+        return
+    while True:
+        try:
+            archived = await archive_once()
+            if any(archived.values()):
+                print(f"Archived {archived}")
+        except Exception as e:
+            print(f"Warning: Archiver failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_MINUTES * 60)
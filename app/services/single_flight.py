@@ -0,0 +1,36 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls: while a call for a key is in flight, callers
+    with the same key wait for it instead of starting their own, and all of
+    them get its result (or its exception). Nothing is kept once it finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        # A caller that goes away (client disconnect) does not cancel the call for the others;
+        # each caller gets its own copy, as they may change it
+        return copy.deepcopy(await asyncio.shield(call))
+
+    def _forget(self, key: Hashable, done: asyncio.Future):
+        if self._calls.get(key) is done:
+            del self._calls[key]
+        # Mark a failure as seen even if every caller went away before it
+        if not done.cancelled():
+            done.exception()
+
+
+# Identical LLM requests made at the same time, e.g. app retries or double taps
+meal_plans = SingleFlight()
+daily_tips = SingleFlight()
@@ -0,0 +1,459 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Union
+
+from . import local_database
+from .local_database import SimpleCursor, BulkWriteError, InsertOne, _apply_update, _project, _run_bulk
+
+# SQLite storage backend with the same interface as local_database.
+# Documents are stored as JSON text; queried fields are exposed as generated
+# columns so filters, sorting and limits run inside SQLite using its indexes.
+# WAL mode lets several uvicorn workers share the file with concurrent readers.
+# Each process runs its SQLite calls on one thread of its own, so a write
+# waiting on another worker's lock never blocks the event loop.
+SQLITE_DB_FILE = os.getenv(
+    "SQLITE_DB_FILE", os.path.join(os.path.dirname(__file__), "../local_db.sqlite3")
+)
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _json_path(field: str) -> str:
+    """SQL string literal for the JSON path of a top-level field"""
+    path = '$."' + field.replace('"', '\\"') + '"'
+    return "'" + path.replace("'", "''") + "'"
+
+
+class SQLiteStore:
+    """Per-process connection to the shared SQLite database"""
+
+    def __init__(self, db_file: str, seed: Optional[local_database.LocalStore] = None):
+        self.db_file = db_file
+        # A new database file is seeded with the documents of this local store
+        self.seed = seed
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        # Generated columns per table: field name -> column name
+        self._columns: Dict[str, Dict[str, str]] = {}
+        self._index_specs: List[tuple] = []
+        self._executor = None
+        self._executor_pid = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on this process's SQLite thread"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self.lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+                    self._executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: fn(*args))
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Reconnect in forked worker processes instead of sharing the parent's handle
+        if self._conn is None or self._pid != os.getpid():
+            with self.lock:
+                if self._conn is None or self._pid != os.getpid():
+                    self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        self._conn = conn
+        self._pid = os.getpid()
+        self._columns = {}
+        for name, fields, sort_field in self._index_specs:
+            self._create_index(name, fields, sort_field)
+        if self.seed is not None:
+            self._seed_once(self.seed)
+
+    def _seed_once(self, source):
+        """
+        Seed an empty database from the local backend, exactly once across
+        workers: the first to take the write lock imports and leaves a marker,
+        the others wait for its commit and then find the marker.
+        """
+        with self.transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS _store_meta (key TEXT PRIMARY KEY, value TEXT)")
+            if self._conn.execute("SELECT 1 FROM _store_meta WHERE key = 'seeded'").fetchone():
+                return
+            # Databases created before the marker existed are never seeded again
+            if self._is_empty():
+                self._import_local(source)
+            self._conn.execute("INSERT INTO _store_meta (key, value) VALUES ('seeded', ?)", (source.db_file,))
+
+    def _is_empty(self) -> bool:
+        tables = [row[0] for row in self._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT IN ('_store_meta', 'sqlite_sequence')"
+        )]
+        return not any(self._conn.execute(f"SELECT 1 FROM {_quote(t)} LIMIT 1").fetchone() for t in tables)
+
+    def _import_local(self, source):
+        """Copy the local backend's documents (its snapshot plus pending log records); runs inside a transaction"""
+        _, data = source.dump()
+        for name, docs in data.items():
+            for doc in docs:
+                # Keep numeric ids as row sequence so new ids continue after them
+                doc_id = doc.get("_id")
+                self._insert(name, doc, int(doc_id) if str(doc_id).isdigit() else None)
+        print(f"Imported {sum(len(d) for d in data.values())} documents from {source.db_file}")
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def table(self, name: str) -> str:
+        """Create the table for a collection on first use and return its quoted name"""
+        if name not in self._columns:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(name)} ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT UNIQUE, "
+                "doc TEXT NOT NULL)"
+            )
+            columns = {}
+            for row in self.conn.execute(f"PRAGMA table_xinfo({_quote(name)})"):
+                if row[1].startswith("f_"):
+                    columns[row[1][2:]] = row[1]
+            self._columns[name] = columns
+        return _quote(name)
+
+    def column(self, name: str, field: str) -> str:
+        """Return the SQL expression for a document field, preferring a generated column"""
+        self.table(name)
+        if field == "_id":
+            return "id"
+        column = self._columns[name].get(field)
+        if column:
+            return _quote(column)
+        return f"json_extract(doc, {_json_path(field)})"
+
+    def _add_column(self, name: str, field: str):
+        table = self.table(name)
+        if field in self._columns[name]:
+            return
+        column = "f_" + field
+        try:
+            self.conn.execute(
+                f"ALTER TABLE {table} ADD COLUMN {_quote(column)} "
+                f"GENERATED ALWAYS AS (json_extract(doc, {_json_path(field)})) VIRTUAL"
+            )
+        except sqlite3.OperationalError as e:
+            # Another worker may have added it first
+            if "duplicate column" not in str(e):
+                raise
+        self._columns[name][field] = column
+
+    def create_index(self, name: str, fields: List[str], sort_field: Optional[str] = None):
+        with self.lock:
+            self._index_specs.append((name, fields, sort_field))
+            if self._conn is not None:
+                self._create_index(name, fields, sort_field)
+
+    def _create_index(self, name: str, fields: List[str], sort_field: Optional[str]):
+        keys = list(fields) + ([sort_field] if sort_field else [])
+        for field in keys:
+            self._add_column(name, field)
+        index_name = "ix_" + name + "_" + "_".join(keys)
+        columns = ", ".join(_quote(self._columns[name][f]) for f in keys)
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {_quote(index_name)} ON {self.table(name)} ({columns})"
+        )
+
+    def _insert(self, name: str, document: Dict[str, Any], seq: Optional[int] = None):
+        table = self.table(name)
+        body = {k: v for k, v in document.items() if k != "_id"}
+        cursor = self.conn.execute(
+            f"INSERT INTO {table} (seq, id, doc) VALUES (?, ?, ?)",
+            (seq, document.get("_id"), json.dumps(body)),
+        )
+        if "_id" not in document:
+            # Ids follow the row sequence, skipping ones given explicitly to other documents
+            doc_id = cursor.lastrowid
+            while self.conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (str(doc_id),)).fetchone():
+                doc_id += 1
+            document["_id"] = str(doc_id)
+            self.conn.execute(f"UPDATE {table} SET id = ? WHERE seq = ?", (document["_id"], cursor.lastrowid))
+
+    def _where(self, name: str, query: Dict[str, Any]):
+        """Translate a query into a WHERE clause, its parameters and the conditions left for Python"""
+        clauses, params, residual = [], [], {}
+        for key, value in query.items():
+            if value is None:
+                clauses.append(f"{self.column(name, key)} IS NULL")
+            elif isinstance(value, (str, int, float, bool)):
+                clauses.append(f"{self.column(name, key)} = ?")
+                params.append(value)
+            else:
+                # Nested values are compared in Python
+                residual[key] = value
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, params, residual
+
+    def select(self, name: str, query: Dict[str, Any], sort_field: Optional[str] = None,
+               direction: int = 1, skip: int = 0, limit: Optional[int] = None,
+               projection: Optional[Dict[str, Any]] = None):
+        """Stream the results of a query with the filter, sort, skip and limit pushed down into SQL"""
+        table = self.table(name)
+        where, params, residual = self._where(name, query)
+
+        body = "doc"
+        excluded = [k for k, v in (projection or {}).items() if k != "_id" and not v]
+        if excluded and not residual and len(excluded) == len(projection) - ("_id" in projection):
+            # Drop excluded fields inside SQLite so they are never transferred or parsed
+            body = "json_remove(doc, " + ", ".join(_json_path(k) for k in excluded) + ")"
+
+        sql = f"SELECT id, {body} FROM {table}{where}"
+        if sort_field:
+            order = "DESC" if direction == -1 else "ASC"
+            sql += f" ORDER BY {self.column(name, sort_field)} {order}, seq ASC"
+        else:
+            sql += " ORDER BY seq ASC"
+        if not residual and (limit is not None or skip):
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit if limit is not None else -1, skip])
+            skip = 0
+
+        # Rows are fetched and parsed as the caller consumes them
+        returned = 0
+        if limit == 0:
+            return
+        for row in self.conn.execute(sql, params):
+            doc = json.loads(row[1])
+            doc["_id"] = row[0]
+            if residual and any(doc.get(k) != v for k, v in residual.items()):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield _project(doc, projection) if projection else doc
+            returned += 1
+            if limit is not None and returned >= limit:
+                return
+
+
+    def _update(self, name: str, query: Dict[str, Any], update: Dict[str, Any], many: bool):
+        docs = list(self.select(name, query, limit=None if many else 1))
+        rows = []
+        for doc in docs:
+            changes = _apply_update(doc, update)
+            if changes:
+                doc.update(changes)
+                body = {k: v for k, v in doc.items() if k != "_id"}
+                rows.append((json.dumps(body), doc["_id"]))
+        self.conn.executemany(f"UPDATE {self.table(name)} SET doc = ? WHERE id = ?", rows)
+        return {"matched_count": len(docs), "modified_count": len(rows)}
+
+    def _delete_one(self, name: str, query: Dict[str, Any]) -> int:
+        docs = list(self.select(name, query, limit=1))
+        if docs:
+            self.conn.execute(f"DELETE FROM {self.table(name)} WHERE id = ?", (docs[0]["_id"],))
+        return len(docs)
+
+    def execute(self, name: str, op: str, args: tuple):
+        """Run one write inside the current transaction"""
+        if op == "insert":
+            self._insert(name, args[0])
+            return args[0]["_id"]
+        if op in ("update_one", "update_many"):
+            return self._update(name, args[0], args[1], op == "update_many")
+        if op == "delete_one":
+            return self._delete_one(name, args[0])
+        raise ValueError(f"Unknown write operation: {op}")
+
+    def count(self, name: str, query: Dict[str, Any]) -> int:
+        where, params, residual = self._where(name, query)
+        if residual:
+            return sum(1 for _ in self.select(name, query))
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table(name)}{where}", params).fetchone()[0]
+
+    def exists(self, name: str, query: Dict[str, Any]) -> bool:
+        where, params, residual = self._where(name, query)
+        if residual:
+            return next(self.select(name, query), None) is not None
+        sql = f"SELECT 1 FROM {self.table(name)}{where} LIMIT 1"
+        return self.conn.execute(sql, params).fetchone() is not None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, taking the database write lock up front"""
+
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+
+    def __enter__(self):
+        self.store.lock.acquire()
+        try:
+            self.store.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.store.lock.release()
+            raise
+        return self.store
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.store.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.store.lock.release()
+
+
+_store = SQLiteStore(SQLITE_DB_FILE, seed=local_database._store)
+
+
+class SQLiteCollection:
+    """Collection backed by a SQLite table, mimicking the MongoDB collection interface"""
+
+    def __init__(self, collection_name: str, store: SQLiteStore = _store):
+        self.collection_name = collection_name
+        self.store = store
+
+    def create_index(self, fields: Union[str, List[str]], sort_field: Optional[str] = None):
+        """Declare an index on one or more equality fields, optionally ordered by sort_field"""
+        if isinstance(fields, str):
+            fields = [fields]
+        self.store.create_index(self.collection_name, fields, sort_field)
+
+    def _stream(self, query: Dict[str, Any], sort_field: Optional[str] = None,
+                direction: int = 1, skip: int = 0, limit: Optional[int] = None,
+                projection: Optional[Dict[str, Any]] = None):
+        return self.store.select(self.collection_name, query, sort_field, direction, skip, limit, projection)
+
+    def _first(self, query, projection):
+        with self.store.lock:
+            return next(self._stream(query, limit=1, projection=projection), None)
+
+    async def find_one(self, query: Dict[str, Any],
+                       projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Find one document matching the query"""
+        return await self.store.run(self._first, query, projection)
+
+    async def find(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> 'SQLiteCursor':
+        """Find all documents matching the query"""
+        return SQLiteCursor(self, query, projection)
+
+    def _count(self, query):
+        with self.store.lock:
+            return self.store.count(self.collection_name, query)
+
+    def _exists(self, query):
+        with self.store.lock:
+            return self.store.exists(self.collection_name, query)
+
+    async def count_documents(self, query: Dict[str, Any]) -> int:
+        """Count the documents matching the query"""
+        return await self.store.run(self._count, query)
+
+    async def exists(self, query: Dict[str, Any]) -> bool:
+        """Check whether any document matches the query"""
+        return await self.store.run(self._exists, query)
+
+    def _write(self, fn):
+        with self.store.transaction():
+            return fn()
+
+    async def insert_one(self, document: Dict[str, Any]):
+        """Insert a document"""
+        await self.store.run(self._write, lambda: self.store._insert(self.collection_name, document))
+        return document
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True):
+        """Insert several documents in a single transaction"""
+        await self.bulk_write([InsertOne(doc) for doc in documents], ordered)
+        return documents
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any]):
+        """Update one document ($set, $inc, $push)"""
+        return await self.store.run(
+            self._write, lambda: self.store._update(self.collection_name, query, update, many=False))
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any]):
+        """Update every matching document ($set, $inc, $push) in a single transaction"""
+        return await self.store.run(
+            self._write, lambda: self.store._update(self.collection_name, query, update, many=True))
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True) -> Dict[str, Any]:
+        """Apply InsertOne/UpdateOne/UpdateMany/DeleteOne requests in a single transaction"""
+        ops = [request._op() for request in requests]
+        result = await self.store.run(self._write, lambda: _run_bulk(
+            lambda op, args: self.store.execute(self.collection_name, op, args), ops, ordered))
+        if result["errors"]:
+            raise BulkWriteError(result)
+        return result
+
+    async def delete_one(self, query: Dict[str, Any]):
+        """Delete one document"""
+        await self.store.run(self._write, lambda: self.store._delete_one(self.collection_name, query))
+
+
+class SQLiteCursor(SimpleCursor):
+    """SimpleCursor whose rows are fetched on the SQLite thread, a batch at a time"""
+
+    BATCH_SIZE = 100
+
+    def __init__(self, collection, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+        super().__init__(collection, query, projection)
+        self._buffer = deque()
+
+    def _fetch(self, count):
+        with self.collection.store.lock:
+            if self._results is None:
+                self._results = self._stream()
+            return list(itertools.islice(self._results, count))
+
+    async def to_list(self, length=None):
+        """Convert cursor to list with applied sort, skip and limit"""
+        def fetch_all():
+            with self.collection.store.lock:
+                return list(self._stream(length))
+        return await self.collection.store.run(fetch_all)
+
+    async def __anext__(self):
+        if not self._buffer:
+            self._buffer.extend(await self.collection.store.run(self._fetch, self.BATCH_SIZE))
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.popleft()
+
+
+# Create collections
+users_collection = SQLiteCollection("users")
+measurements_collection = SQLiteCollection("measurements")
+meal_plans_collection = SQLiteCollection("meal_plans")
+chat_history_collection = SQLiteCollection("chat_history")
+# Progress of background jobs, one document per job name
+jobs_collection = SQLiteCollection("jobs")
+# Ready-made meal plans waiting to be served, see services/plan_pool.py
+plan_pool_collection = SQLiteCollection("plan_pool")
+
+# Same indexes as the local backend
+users_collection.create_index("email")
+measurements_collection.create_index("user_email", sort_field="date")
+meal_plans_collection.create_index(["user_email", "active"], sort_field="created_at")
+chat_history_collection.create_index("user_email", sort_field="timestamp")
+jobs_collection.create_index("name")
+plan_pool_collection.create_index("segment", sort_field="created_at")
+# Whole collections in time order, for the archiver
+meal_plans_collection.create_index([], sort_field="created_at")
+chat_history_collection.create_index([], sort_field="timestamp")
+
+def get_database():
+    """Return a mock database object"""
+    return {
+        "users": users_collection,
+        "measurements": measurements_collection,
+        "meal_plans": meal_plans_collection,
+        "chat_history": chat_history_collection,
+        "jobs": jobs_collection,
+        "plan_pool": plan_pool_collection
+    }
@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out of the report
+    resource = None
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Documents written per user, in the proportions the app produces them
+PER_USER = {"measurements": 10, "meal_plans": 5, "chat_history": 40}
+BACKENDS = ["local-json", "local-binary", "sqlite"]
+MEALS = ["Rice + chicken curry", "String hoppers", "Thosai", "Pittu", "Kola kanda", "Rice + grilled fish",
+         "Stir-fried vegetables", "Red rice + dhal", "Omelette", "Fruit", "Yogurt", "Chickpeas"]
+
+
+def open_backend(backend, directory):
+    """Returns the four collections of a fresh database in the given directory"""
+    names = ["users", "measurements", "meal_plans", "chat_history"]
+    if backend == "sqlite":
+        from app.sqlite_database import SQLiteStore, SQLiteCollection
+        store = SQLiteStore(os.path.join(directory, "db.sqlite3"))
+        collections = {name: SQLiteCollection(name, store) for name in names}
+    else:
+        from app.local_database import LocalStore, LocalCollection
+        binary = backend == "local-binary"
+        store = LocalStore(
+            os.path.join(directory, "db.bin" if binary else "db.json"),
+            os.path.join(directory, "db.log"), os.path.join(directory, "db.lock"), binary=binary,
+        )
+        collections = {name: LocalCollection(name, store) for name in names}
+
+    # Same indexes as the application modules
+    collections["users"].create_index("email")
+    collections["measurements"].create_index("user_email", sort_field="date")
+    collections["meal_plans"].create_index(["user_email", "active"], sort_field="created_at")
+    collections["chat_history"].create_index("user_email", sort_field="timestamp")
+    collections["meal_plans"].create_index([], sort_field="created_at")
+    collections["chat_history"].create_index([], sort_field="timestamp")
+    return store, collections
+
+
+def _measurement(rng, email, date):
+    height = rng.uniform(150, 190)
+    weight = rng.uniform(45, 110)
+    return {
+        "user_email": email,
+        "date": date.isoformat(),
+        "gender": rng.choice(["male", "female"]),
+        "weight_kg": round(weight, 1),
+        "height_cm": round(height, 1),
+        "waist_cm": round(rng.uniform(60, 110), 1),
+        "hip_cm": round(rng.uniform(80, 120), 1),
+        "chest_cm": round(rng.uniform(75, 115), 1),
+        "shoulder_breadth_cm": round(rng.uniform(33, 50), 1),
+        "wrist_cm": round(rng.uniform(13, 19), 1),
+        "bmi": round(weight / (height / 100) ** 2, 1),
+        "body_type": "",
+        "somatotype": rng.choice(["Ectomorph", "Endomorph", "Mesomorph"]),
+    }
+
+
+def _meal_plan(rng, email, date, active, days=3):
+    def option():
+        return {"item": rng.choice(MEALS), "portion": f"Approx. ~{rng.randint(1, 4) * 50}g"}
+
+    return {
+        "user_email": email,
+        "created_at": date.isoformat(),
+        "plan_data": {
+            "meal_plan": {
+                f"day_{d}": {meal: {"main": option(), "alternative": option()}
+                             for meal in ("breakfast", "lunch", "dinner", "snacks")}
+                for d in range(1, days + 1)
+            },
+            "advice": ["Drink at least 2 liters of water a day.", "Prefer red rice over white rice."],
+        },
+        "goal": rng.choice(["Weight Loss", "Muscle Gain", "Healthy Living"]),
+        "active": active,
+    }
+
+
+def _chat_message(rng, email, date, is_user):
+    words = rng.randint(5, 80 if not is_user else 20)
+    return {
+        "user_email": email,
+        "text": " ".join(rng.choice(MEALS).lower() for _ in range(words)),
+        "is_user": is_user,
+        "timestamp": date.isoformat(),
+    }
+
+
+async def generate(collections, total_docs, seed=42, chunk=10000):
+    """Writes roughly total_docs synthetic documents and returns the user emails"""
+    rng = random.Random(seed)
+    num_users = max(1, total_docs // (sum(PER_USER.values()) + 1))
+    start = datetime(2025, 1, 1)
+    emails = [f"user{i}@example.com" for i in range(num_users)]
+    pending = {name: [] for name in ("measurements", "meal_plans", "chat_history", "users")}
+    current_plans = []
+
+    async def flush(force=False):
+        for name, docs in pending.items():
+            if name == "users":
+                # Plans are written first so each user can point at the current one
+                docs.extend({
+                    "email": email,
+                    "full_name": email.split("@")[0],
+                    "hashed_password": "$2b$12$" + "x" * 53,
+                    "current_meal_plan_id": plan["_id"],
+                } for email, plan in current_plans if "_id" in plan)
+                current_plans[:] = [(e, p) for e, p in current_plans if "_id" not in p]
+            if docs and (force or len(docs) >= chunk):
+                await collections[name].insert_many(docs)
+                docs.clear()
+
+    for email in emails:
+        for i in range(PER_USER["measurements"]):
+            pending["measurements"].append(_measurement(rng, email, start + timedelta(days=7 * i)))
+        for i in range(PER_USER["meal_plans"]):
+            active = i == PER_USER["meal_plans"] - 1
+            pending["meal_plans"].append(_meal_plan(rng, email, start + timedelta(days=14 * i), active))
+        current_plans.append((email, pending["meal_plans"][-1]))
+        for i in range(PER_USER["chat_history"]):
+            pending["chat_history"].append(
+                _chat_message(rng, email, start + timedelta(minutes=30 * i), i % 2 == 0)
+            )
+        await flush()
+    await flush(force=True)
+    return emails
+
+
+def _summary(pattern, latencies, ops, elapsed):
+    latencies.sort()
+    return {
+        "pattern": pattern,
+        "ops": ops,
+        "ops_per_sec": ops / elapsed if elapsed else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+async def replay(collections, emails, num_ops, burst, seed=7):
+    """Replays the application's read and write patterns and returns one summary per pattern"""
+    rng = random.Random(seed)
+    users, measurements = collections["users"], collections["measurements"]
+    meal_plans, chat_history = collections["meal_plans"], collections["chat_history"]
+
+    async def history(email):
+        # /measurements/history
+        cursor = await measurements.find({"user_email": email})
+        return await cursor.sort("date", -1).to_list(length=100)
+
+    async def current_plan(email):
+        # /meal-plan/current, through the user's current plan pointer
+        user = await users.find_one({"email": email}, {"current_meal_plan_id": 1})
+        return await meal_plans.find_one({"_id": user["current_meal_plan_id"]}, {"plan_data": 1})
+
+    async def active_plan(email):
+        # Fallback lookup for users without a pointer
+        cursor = await meal_plans.find({"user_email": email, "active": True}, {"plan_data": 1})
+        return await cursor.sort("created_at", -1).to_list(length=1)
+
+    async def chat_window(email):
+        # Chat context in chatbot.get_chat_response
+        cursor = await chat_history.find({"user_email": email})
+        return await cursor.sort("timestamp", -1).to_list(length=10)
+
+    results = []
+    for pattern, run in (("history", history), ("current_plan", current_plan),
+                         ("active_plan", active_plan), ("chat_window", chat_window)):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(num_ops):
+            t = time.perf_counter()
+            await run(rng.choice(emails))
+            latencies.append(time.perf_counter() - t)
+        results.append(_summary(pattern, latencies, num_ops, time.perf_counter() - started))
+
+    # Concurrent chat inserts, as several requests saving messages at once
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(max(1, num_ops // burst)):
+        email = rng.choice(emails)
+        t = time.perf_counter()
+        await asyncio.gather(*(
+            chat_history.insert_one(_chat_message(rng, email, datetime.now(), i % 2 == 0)) for i in range(burst)
+        ))
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    results.append(_summary("insert_burst", latencies, len(latencies) * burst, elapsed))
+    return results
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_config(backend, total_docs, num_ops, burst):
+    """Benchmarks one backend at one scale; runs in its own process so peak RSS is not shared"""
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            store, collections = open_backend(backend, directory)
+            started = time.perf_counter()
+            emails = await generate(collections, total_docs)
+            if hasattr(store, "compact"):
+                store.compact()
+            load_seconds = time.perf_counter() - started
+            written = sum([await c.count_documents({}) for c in collections.values()])
+
+            results = await replay(collections, emails, num_ops, burst)
+            if hasattr(store, "compact"):
+                store.compact()
+            file_size = sum(
+                os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+            )
+        return {
+            "backend": backend,
+            "docs": written,
+            "load_docs_per_sec": written / load_seconds,
+            "file_size_bytes": file_size,
+            "peak_rss_mb": peak_rss_mb(),
+            "patterns": results,
+        }
+    return asyncio.run(run())
+
+
+def print_report(result):
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+    print(f"\n{result['backend']}: {result['docs']} documents, loaded at {result['load_docs_per_sec']:.0f} docs/s, "
+          f"file {result['file_size_bytes'] / 1e6:.1f} MB, peak RSS {rss}")
+    print(f"  {'pattern':<14}{'ops/sec':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for p in result["patterns"]:
+        print(f"  {p['pattern']:<14}{p['ops_per_sec']:>12.0f}{p['p50_ms']:>10.3f}{p['p99_ms']:>10.3f}")
+
+
+def compare(results, baseline_file, tolerance):
+    """Prints the patterns that got slower than the baseline run and returns how many there were"""
+    with open(baseline_file, 'r') as f:
+        baseline = {(r["backend"], r["docs"], p["pattern"]): p for r in json.load(f) for p in r["patterns"]}
+    regressions = 0
+    for r in results:
+        for p in r["patterns"]:
+            old = baseline.get((r["backend"], r["docs"], p["pattern"]))
+            if old is None:
+                continue
+            if p["ops_per_sec"] < old["ops_per_sec"] * (1 - tolerance) or p["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+                regressions += 1
+                print(f"REGRESSION: {r['backend']} {r['docs']} docs {p['pattern']}: "
+                      f"{old['ops_per_sec']:.0f} -> {p['ops_per_sec']:.0f} ops/s, "
+                      f"p99 {old['p99_ms']:.3f} -> {p['p99_ms']:.3f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends on synthetic app data")
+    parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000],
+                        help="dataset sizes in documents (1000 to 1000000)")
+    parser.add_argument("--backend", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--ops", type=int, default=1000, help="operations per access pattern")
+    parser.add_argument("--burst", type=int, default=50, help="concurrent inserts per burst")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    results = []
+    for docs in args.docs:
+        for backend in args.backend:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(run_config, backend, docs, args.ops, args.burst).result()
+            print_report(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.local_database import DB_FILE, BINARY_DB_FILE, LOG_FILE, LOCK_FILE, LocalStore, _write_snapshot, _write_temp
+
+
+def migrate(to_binary=True):
+    """
+    Converts the local database snapshot between local_db.json and local_db.bin.
+    Pending log records are folded in, and the log itself stays valid for both formats.
+    """
+    source, target = (DB_FILE, BINARY_DB_FILE) if to_binary else (BINARY_DB_FILE, DB_FILE)
+    if not os.path.exists(source):
+        print(f"Error: {source} not found")
+        return
+
+    store = LocalStore(source, LOG_FILE, LOCK_FILE)
+    seq, collections = store.dump()
+    print(f"Loaded {sum(len(d) for d in collections.values())} documents from {source}")
+
+    tmp_file = _write_temp(target, lambda f: _write_snapshot(f, collections, {"seq": seq}, to_binary))
+    os.replace(tmp_file, target)
+    print(f"Wrote {target} ({os.path.getsize(source)} -> {os.path.getsize(target)} bytes)")
+
+    # Check that a document can be read back on its own
+    if to_binary:
+        from app.local_db_format import SnapshotReader
+        reader = SnapshotReader(target)
+        for name, docs in collections.items():
+            if docs and reader.get(name, docs[-1]["_id"]) != docs[-1]:
+                print(f"Error: {name} document {docs[-1]['_id']} did not round-trip")
+                return
+
+    print(f"Set LOCAL_DB_FORMAT={'binary' if to_binary else 'json'} to use it.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the local database snapshot format")
+    parser.add_argument("--to-json", action="store_true", help="convert local_db.bin back to local_db.json")
+    args = parser.parse_args()
+    migrate(to_binary=not args.to_json)
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services import model
+
+# Dataset.csv columns, in model.MEASUREMENT_KEYS order
+INPUT_COLUMNS = ["gender", "weight_kg", "height", "waist", "hip", "chest", "shoulder-breadth", "wrist"]
+
+
+def read_chunks(path, chunksize):
+    """Yields DataFrames of at most chunksize rows from a CSV or XLSX file"""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise SystemExit("Error: reading .xlsx files requires openpyxl (pip install openpyxl)")
+        # Read-only mode streams rows instead of loading the whole sheet
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(c) for c in next(rows)]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+        workbook.close()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def score_chunk(df):
+    """Adds BMI, BMI category, somatotype and class probabilities to a chunk"""
+    missing = [c for c in INPUT_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {missing}")
+
+    measurements = df[INPUT_COLUMNS].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    # Same checks as the batch endpoint; invalid rows are kept with empty predictions
+    valid = (
+        np.isin(measurements[:, 0], (0, 1))
+        & np.isfinite(measurements[:, 1:]).all(axis=1)
+        & (measurements[:, 1:] > 0).all(axis=1)
+    )
+
+    features = model.compute_features(measurements[valid])
+    probabilities = model.engine.predict_proba(features)
+    out = df.copy()
+    out["BMI"] = np.nan
+    out.loc[valid, "BMI"] = features[:, 1].round(2)
+    out["bmi_category"] = ""
+    out.loc[valid, "bmi_category"] = model.get_bmi_categories(features[:, 1])
+    out["somatotype"] = ""
+    out.loc[valid, "somatotype"] = model.engine.classes[probabilities.argmax(axis=1)]
+    for j, name in enumerate(model.engine.classes):
+        out[f"prob_{name}"] = np.nan
+        out.loc[valid, f"prob_{name}"] = probabilities[:, j].round(6)
+    return out
+
+
+def score_chunk_csv(df, header):
+    """Scores a chunk and formats it as CSV text, so workers also do the (slow) formatting"""
+    return score_chunk(df).to_csv(header=header, index=False)
+
+
+class OutputWriter:
+    """Appends scored chunks (DataFrames, or CSV text from score_chunk_csv) to a CSV or Parquet file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self._writer = None
+        self._first = True
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise SystemExit("Error: writing Parquet requires pyarrow (pip install pyarrow)")
+
+    def write(self, df):
+        if isinstance(df, str):
+            with open(self.path, "w" if self._first else "a", newline="") as f:
+                f.write(df)
+        elif self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            df.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def score_file(input_path, output_path, chunksize=100000, workers=1):
+    """
+    Scores a measurement file chunk by chunk. With several workers, at most
+    two chunks per worker are in flight, so memory stays bounded whatever
+    the file size. Output rows keep the input order.
+    """
+    if model.engine is None:
+        raise SystemExit("Error: model not loaded")
+
+    started = time.perf_counter()
+    rows = 0
+    writer = OutputWriter(output_path)
+    try:
+        if workers <= 1:
+            for chunk in read_chunks(input_path, chunksize):
+                scored = score_chunk(chunk)
+                writer.write(scored)
+                rows += len(scored)
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                pending = deque()
+                for chunk in read_chunks(input_path, chunksize):
+                    if writer.parquet:
+                        pending.append((len(chunk), pool.submit(score_chunk, chunk)))
+                    else:
+                        pending.append((len(chunk), pool.submit(score_chunk_csv, chunk, rows == 0 and not pending)))
+                    if len(pending) >= 2 * workers:
+                        count, future = pending.popleft()
+                        writer.write(future.result())
+                        rows += count
+                while pending:
+                    count, future = pending.popleft()
+                    writer.write(future.result())
+                    rows += count
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s) -> {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a measurement file in Dataset.csv format")
+    parser.add_argument("input", help="CSV or XLSX file with columns " + ", ".join(INPUT_COLUMNS))
+    parser.add_argument("output", help="output file (.csv or .parquet)")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="processes used for scoring")
+    args = parser.parse_args()
+    score_file(args.input, args.output, args.chunksize, args.workers)
@@ -1,25 +1,57 @@
 import pandas as pd
 import numpy as np
+import argparse
 import os
-import joblib
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import sklearn
+from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 
-def train():
-    # Paths
-    BASE_DIR = os.path.dirname(__file__)
-    DATASET_PATH = os.path.join(BASE_DIR, "../app/data/Dataset.csv")
-    MODEL_PATH = os.path.join(BASE_DIR, "../app/data/mlr_somatotype_model.pkl")
-
-    print(f"Loading dataset from {DATASET_PATH}...")
-    try:
-        df = pd.read_csv(DATASET_PATH)
-    except FileNotFoundError:
-        print(f"Error: Dataset not found at {DATASET_PATH}")
-        return
-
-    # Feature Engineering
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; the run reports its largest traced peak instead
+    resource = None
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services import model_registry
+
+BASE_DIR = os.path.dirname(__file__)
+DATASET_PATH = os.path.join(BASE_DIR, "../app/data/Dataset.csv")
+
+features = [
+    "gender",
+    "BMI",
+    "WaistHipRatio",
+    "ShoulderWaistRatio",
+    "ChestWaistRatio",
+    "HeightWaistRatio",
+    "FrameIndex"
+]
+RATIOS = features[1:]
+SOMATOTYPES = ["Ectomorph", "Mesomorph", "Endomorph"]
+
+
+@contextmanager
+def stage(name, report):
+    """Records wall-clock time and peak traced memory of a training stage"""
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    report.append((name, elapsed, peak_mb))
+    print(f"[{name}] {elapsed:.2f}s, peak {peak_mb:.1f} MB")
+
+
+def add_features(df):
+    """Feature engineering, as in app/services/model.py"""
     # Convert height to meters
     df["height_m"] = df["height"] / 100
 
@@ -32,64 +64,38 @@ def train():
     df["ChestWaistRatio"] = df["chest"] / df["waist"]
     df["HeightWaistRatio"] = df["height"] / df["waist"]
     df["FrameIndex"] = df["height"] / df["wrist"]
+    return df
+
 
+def label(df, mean, std):
+    """Somatotype labels from the normalized ratios, given the dataset mean and std of each ratio"""
     # Normalization
-    def normalize(col):
-        return (col - col.mean()) / col.std()
-
-    for col in [
-        "BMI",
-        "WaistHipRatio",
-        "ShoulderWaistRatio",
-        "ChestWaistRatio",
-        "HeightWaistRatio",
-        "FrameIndex"
-    ]:
-        df[col + "_n"] = normalize(df[col])
-
-    # Calculate Scores
-    df["EndomorphScore"] = (
-        0.5 * df["BMI_n"] +
-        0.3 * df["WaistHipRatio_n"] -
-        0.2 * df["HeightWaistRatio_n"]
-    )
+    n = {col: (df[col] - mean[col]) / std[col] for col in RATIOS}
 
-    df["MesomorphScore"] = (
-        0.4 * df["ShoulderWaistRatio_n"] +
-        0.4 * df["ChestWaistRatio_n"] +
-        0.2 * df["FrameIndex_n"]
-    )
+    # Calculate Scores, one column per entry of SOMATOTYPES
+    scores = np.column_stack([
+        0.6 * n["HeightWaistRatio"] + 0.4 * n["FrameIndex"] - 0.3 * n["BMI"],
+        0.4 * n["ShoulderWaistRatio"] + 0.4 * n["ChestWaistRatio"] + 0.2 * n["FrameIndex"],
+        0.5 * n["BMI"] + 0.3 * n["WaistHipRatio"] - 0.2 * n["HeightWaistRatio"],
+    ])
+
+    # Classify: the highest score wins, ties going to the first type
+    return np.array(SOMATOTYPES)[scores.argmax(axis=1)]
 
-    df["EctomorphScore"] = (
-        0.6 * df["HeightWaistRatio_n"] +
-        0.4 * df["FrameIndex_n"] -
-        0.3 * df["BMI_n"]
-    )
 
-    # Classify
-    def classify(row):
-        scores = {
-            "Ectomorph": row["EctomorphScore"],
-            "Mesomorph": row["MesomorphScore"],
-            "Endomorph": row["EndomorphScore"]
-        }
-        return max(scores, key=scores.get)
+def train_in_memory(dataset_path, sweep, jobs, report):
+    """Loads the whole dataset and fits a LogisticRegression, optionally with a CV sweep over C"""
+    with stage("load", report):
+        print(f"Loading dataset from {dataset_path}...")
+        df = pd.read_csv(dataset_path)
 
-    df["Somatotype"] = df.apply(classify, axis=1)
+    with stage("features", report):
+        df = add_features(df)
+        df["Somatotype"] = label(df, df[RATIOS].mean(), df[RATIOS].std())
     print("Somatotype distribution:")
     print(df["Somatotype"].value_counts())
 
     # Prepare Data for Training
-    features = [
-        "gender",
-        "BMI",
-        "WaistHipRatio",
-        "ShoulderWaistRatio",
-        "ChestWaistRatio",
-        "HeightWaistRatio",
-        "FrameIndex"
-    ]
-
     X = df[features]
     y = df["Somatotype"]
 
@@ -99,23 +105,132 @@ def train():
     )
 
     # Train
-    print("Training model...")
-    mlr_model = LogisticRegression(
-        solver="lbfgs",
-        max_iter=1000
-    )
-    mlr_model.fit(X_train, y_train)
+    with stage("fit", report):
+        print("Training model...")
+        mlr_model = LogisticRegression(
+            solver="lbfgs",
+            max_iter=1000
+        )
+        params = {}
+        if sweep:
+            # Cross-validated sweep, one fold/candidate per core
+            search = GridSearchCV(mlr_model, {"C": [0.01, 0.1, 1.0, 10.0, 100.0]}, cv=5, n_jobs=jobs)
+            search.fit(X_train, y_train)
+            mlr_model = search.best_estimator_
+            params = {"C": search.best_params_["C"], "cv_accuracy": round(search.best_score_, 4)}
+            print(f"Best C={params['C']} (CV accuracy {params['cv_accuracy'] * 100:.2f}%)")
+        else:
+            mlr_model.fit(X_train, y_train)
 
     # Evaluate
-    y_pred = mlr_model.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
+    with stage("evaluate", report):
+        y_pred = mlr_model.predict(X_test)
+        acc = accuracy_score(y_test, y_pred)
     print(f"Test Accuracy: {acc*100:.2f}%")
     print("\nClassification Report:")
     print(classification_report(y_test, y_pred))
 
-    # Save
-    joblib.dump(mlr_model, MODEL_PATH)
-    print(f"Model saved to {MODEL_PATH}")
+    return mlr_model, {"accuracy": round(acc, 4), "train_samples": len(X_train), "test_samples": len(X_test), **params}
+
+
+def train_out_of_core(dataset_path, chunksize, epochs, report):
+    """
+    Streams the CSV in chunks: one pass for the normalization statistics,
+    then epochs of SGDClassifier.partial_fit. Every fifth row is held out
+    for testing. Memory is bounded by the chunk size.
+    """
+    def chunks():
+        offset = 0
+        for chunk in pd.read_csv(dataset_path, chunksize=chunksize):
+            chunk.index = range(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield add_features(chunk)
+
+    with stage("statistics", report):
+        count, total, total_sq = 0, 0.0, 0.0
+        for chunk in chunks():
+            values = chunk[features].to_numpy(dtype=np.float64)
+            count += len(values)
+            total = total + values.sum(axis=0)
+            total_sq = total_sq + (values ** 2).sum(axis=0)
+        mean = total / count
+        # Sample standard deviation, as pandas .std()
+        std = np.sqrt(np.maximum(total_sq - count * mean ** 2, 0) / (count - 1))
+        mean_s, std_s = pd.Series(mean, index=features), pd.Series(std, index=features)
+        # gender is not scaled for the classifier
+        scale = np.where(std > 0, std, 1.0)
+        scale[0], center = 1.0, mean.copy()
+        center[0] = 0.0
+    print(f"{count} rows")
+
+    sgd = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+    with stage("fit", report):
+        print(f"Training model out of core ({epochs} epochs, {chunksize} rows per chunk)...")
+        for _ in range(epochs):
+            for chunk in chunks():
+                train = chunk[chunk.index % 5 != 0]
+                X = (train[features].to_numpy(dtype=np.float64) - center) / scale
+                sgd.partial_fit(X, label(train, mean_s, std_s), classes=sorted(SOMATOTYPES))
+
+    # Fold the scaling into the weights so the model takes raw features like the in-memory one
+    sgd.coef_ = sgd.coef_ / scale
+    sgd.intercept_ = sgd.intercept_ - sgd.coef_ @ center
+    sgd.feature_names_in_ = np.array(features, dtype=object)
+
+    with stage("evaluate", report):
+        correct = tested = 0
+        for chunk in chunks():
+            test = chunk[chunk.index % 5 == 0]
+            predictions = sgd.predict(test[features])
+            correct += int((predictions == label(test, mean_s, std_s)).sum())
+            tested += len(test)
+        acc = correct / tested
+    print(f"Test Accuracy: {acc*100:.2f}%")
+
+    return sgd, {"accuracy": round(acc, 4), "train_samples": count - tested, "test_samples": tested, "epochs": epochs}
+
+
+def train(dataset_path=DATASET_PATH, chunked=False, chunksize=100000, epochs=5, sweep=False, jobs=-1):
+    if not os.path.exists(dataset_path):
+        print(f"Error: Dataset not found at {dataset_path}")
+        return
+
+    tracemalloc.start()
+    report = []
+    if chunked:
+        mlr_model, metadata = train_out_of_core(dataset_path, chunksize, epochs, report)
+    else:
+        mlr_model, metadata = train_in_memory(dataset_path, sweep, jobs, report)
+    tracemalloc.stop()
+
+    # Save as a new registry version; running workers swap to it through their registry watcher
+    version = model_registry.register(mlr_model, {
+        **metadata,
+        "estimator": type(mlr_model).__name__,
+        "dataset": os.path.basename(dataset_path),
+        "sklearn_version": sklearn.__version__,
+    })
+    model_registry.activate(version)
+    print(f"Model registered and activated as {version} in {model_registry.REGISTRY_DIR}")
+
+    print("\nStage timings:")
+    for name, elapsed, peak_mb in report:
+        print(f"  {name:<12}{elapsed:>8.2f}s{peak_mb:>10.1f} MB")
+    if resource is None:
+        print(f"  peak traced {max(peak_mb for _, _, peak_mb in report):.1f} MB")
+        return
+    # Kilobytes on Linux, bytes on macOS; sweep workers run in their own processes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    print(f"  peak RSS {rss:.0f} MB")
+
 
 if __name__ == "__main__":
-    train()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Train the somatotype model and register it")
+    parser.add_argument("--dataset", default=DATASET_PATH, help="CSV in Dataset.csv format")
+    parser.add_argument("--chunked", action="store_true", help="stream the CSV and train with SGDClassifier.partial_fit")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per chunk in --chunked mode")
+    parser.add_argument("--epochs", type=int, default=5, help="passes over the data in --chunked mode")
+    parser.add_argument("--sweep", action="store_true", help="cross-validated search over C")
+    parser.add_argument("--jobs", type=int, default=-1, help="processes for --sweep (-1 uses every core)")
+    args = parser.parse_args()
+    train(args.dataset, args.chunked, args.chunksize, args.epochs, args.sweep, args.jobs)
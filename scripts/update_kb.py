@@ -1,6 +1,12 @@
 import json
 import re
 import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.kb_index import compile_kb
 
 # Define portion mapping (heuristic based on Sri Lankan cuisine)
 PORTION_MAP = {
@@ -159,6 +165,10 @@ def process_kb(file_path):
         
     print(f"Updated {updated_count} entries in {file_path}")
 
+    # Compile it as the server will at startup, so a malformed entry shows up here
+    index = compile_kb(file_path)
+    print(f"Compiled entries per table: {index.stats()}")
+
 if __name__ == "__main__":
     kb_path = os.path.join(os.path.dirname(__file__), "../app/data/kb.json")
     process_kb(kb_path)
@@ -1,6 +1,7 @@
 import sys
 import os
 import json
+import asyncio
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -42,8 +43,8 @@ def test_rag():
     print(f"Retrieved {len(context['guidance'])} guidance items.")
     
     # Test Generation (will fail if no API key, but logic runs)
-    print("\nTesting Gemini Generation (Check for API Key)...")
-    plan = rag.generate_meal_plan(profile, plan_days=1)
+    print("\nTesting OpenAI Generation (Check for API Key)...")
+    plan = asyncio.run(rag.generate_meal_plan(profile, plan_days=1))
     print("Generated Plan:", json.dumps(plan, indent=2))
 
 if __name__ == "__main__":
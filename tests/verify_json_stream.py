@@ -0,0 +1,164 @@
+import asyncio
+import json
+import random
+import sys
+import os
+import types
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import rag
+from app.services.json_stream import PlanStreamParser
+
+MEALS = ("breakfast", "lunch", "dinner", "snacks")
+
+PLAN = {
+    "meal_plan": {
+        # Different dishes each day, so none is replaced as a repeat
+        f"day_{day}": {
+            "breakfast": {"main": {"item": f'Pittu with "kiri hodi" {day}', "portion": "1 cup"},
+                          "alternative": {"item": f"String hoppers {{{day}}} [plain]", "portion": "10 pieces"}},
+            "lunch": {"main": {"item": f"Rice \\ dhal, {day}0% brown", "portion": "1 plate"},
+                      "alternative": {"item": f"Kola kanda {day}: {{leaves}}, \"gotu kola\"", "portion": "1 bowl"}},
+            "dinner": {"main": {"item": f"Thosai {day} }} ] , :", "portion": "2"},
+                       "alternative": {"item": f"Roti {day}\nand sambol ක", "portion": "2"}},
+            "snacks": {"main": {"item": f"Fruit {day}", "portion": "1"},
+                       "alternative": {"item": f"Yogurt {day}", "portion": "1"}},
+        }
+        for day in (1, 2)
+    },
+    "advice": ["Drink water {often}", "Walk \"daily\""],
+}
+
+
+def expected_events(plan):
+    events = []
+    for day, meals in plan["meal_plan"].items():
+        events.extend((day, meal, value) for meal, value in meals.items())
+        events.append((day, None, None))
+    return events
+
+
+def feed_in_pieces(text, sizes):
+    parser, events, i = PlanStreamParser(), [], 0
+    while i < len(text):
+        size = next(sizes)
+        events.extend(parser.feed(text[i:i + size]))
+        i += size
+    return events
+
+
+def verify_chunking():
+    print("Verifying events do not depend on where the stream is cut...")
+    texts = {
+        "compact": json.dumps(PLAN, separators=(',', ':')),
+        "indented": json.dumps(PLAN, indent=2),
+        # Models often wrap the JSON in a code fence
+        "fenced": "```json\n" + json.dumps(PLAN, indent=2) + "\n```",
+        "escaped": json.dumps(PLAN, ensure_ascii=True),
+    }
+    expected = expected_events(PLAN)
+    rng = random.Random(5)
+    failures = []
+    for name, text in texts.items():
+        # One character at a time splits every token and escape sequence
+        cuts = {"single": iter(lambda: 1, None), "random": iter(lambda: rng.randint(1, 12), None),
+                "whole": iter(lambda: len(text), None)}
+        for cut, sizes in cuts.items():
+            if feed_in_pieces(text, sizes) != expected:
+                failures.append(f"{name}/{cut}")
+    if failures:
+        print(f"FAILURE: Events differ for {failures}.")
+    else:
+        print(f"SUCCESS: {len(texts) * 3} ways of streaming the plan give the same {len(expected)} events.")
+
+
+class Stream:
+    """Streamed completion chunks, cut off with an error after `stop` characters"""
+
+    def __init__(self, text, stop):
+        self.text, self.stop = text, stop
+
+    async def __aiter__(self):
+        for i in range(0, len(self.text), 7):
+            if i >= self.stop:
+                raise ConnectionError("connection reset")
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=self.text[i:i + 7]))])
+
+
+class Completions:
+    def __init__(self, text, stop):
+        self.text, self.stop = text, stop
+
+    async def create(self, **kwargs):
+        return Stream(self.text, self.stop)
+
+
+async def verify_truncated():
+    print("Verifying a stream cut off mid-plan is completed from the KB...")
+    text = "```json\n" + json.dumps(PLAN, indent=2) + "\n```"
+    # Cut inside day_2's lunch, after day_1 and day_2's breakfast are complete
+    stop = text.index('"lunch"', text.index('"day_2"')) + 20
+    original = rag.client, rag.MEAL_PLAN_DAYS_PER_REQUEST
+    rag.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=Completions(text, stop)))
+    rag.MEAL_PLAN_DAYS_PER_REQUEST = 2
+    profile = {"gender_str": "male", "bmi_category": "normal", "somatotype": "Mesomorph"}
+    try:
+        events = [event async for event in rag.stream_meal_plan(profile, 2)]
+    finally:
+        rag.client, rag.MEAL_PLAN_DAYS_PER_REQUEST = original
+
+    plan = events[-1]["plan"]
+    days = plan["meal_plan"]
+    streamed = {(e["day"], e["meal"]) for e in events if e["event"] == "meal"}
+    complete = all(set(days[day]) == set(MEALS) for day in ("day_1", "day_2"))
+    formatted = all(
+        isinstance(choice, dict) and set(choice) == {"item", "portion"}
+        for meals in days.values() for choices in meals.values() for choice in choices.values()
+    )
+    if (plan.get("source") == "partial_fallback" and complete and formatted
+            and days["day_1"] == PLAN["meal_plan"]["day_1"]
+            and days["day_2"]["breakfast"] == PLAN["meal_plan"]["day_2"]["breakfast"]
+            and streamed == {(day, meal) for day in ("day_1", "day_2") for meal in MEALS}):
+        print("SUCCESS: The generated meals were kept and the rest filled in, marked partial_fallback.")
+    else:
+        print(f"FAILURE: source={plan.get('source')}, complete={complete}, formatted={formatted}.")
+
+
+async def verify_invalid_escape():
+    print("Verifying a string with an invalid escape is treated as malformed output...")
+    text = json.dumps(PLAN, indent=2)
+    # "\q" is not a JSON escape; it starts the item of day_2's lunch
+    bad = text.index('"item": "', text.index('"lunch"', text.index('"day_2"'))) + len('"item": "')
+    text = text[:bad] + "\\q" + text[bad:]
+    parser, events, raised = PlanStreamParser(), [], None
+    try:
+        for i in range(0, len(text), 5):
+            events.extend(parser.feed(text[i:i + 5]))
+    except ValueError as e:
+        raised = e
+    parsed = [event for event in expected_events(PLAN) if event in events]
+
+    original = rag.client, rag.MEAL_PLAN_DAYS_PER_REQUEST
+    rag.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=Completions(text, len(text))))
+    rag.MEAL_PLAN_DAYS_PER_REQUEST = 2
+    profile = {"gender_str": "male", "bmi_category": "normal", "somatotype": "Mesomorph"}
+    try:
+        plan = [event async for event in rag.stream_meal_plan(profile, 2)][-1]["plan"]
+    finally:
+        rag.client, rag.MEAL_PLAN_DAYS_PER_REQUEST = original
+
+    days = plan["meal_plan"]
+    if raised is None and parser.failed and events == parsed and len(events) == 6 \
+            and plan.get("source") == "partial_fallback" and days["day_1"] == PLAN["meal_plan"]["day_1"] \
+            and all(set(days[day]) == set(MEALS) for day in ("day_1", "day_2")):
+        print("SUCCESS: The parser stopped at the invalid escape and the rest of the plan was filled in.")
+    else:
+        print(f"FAILURE: raised={raised!r}, failed={parser.failed}, events={len(events)}, source={plan.get('source')}.")
+
+
+if __name__ == "__main__":
+    verify_chunking()
+    asyncio.run(verify_truncated())
+    asyncio.run(verify_invalid_escape())
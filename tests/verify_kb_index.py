@@ -0,0 +1,130 @@
+import json
+import random
+import sys
+import os
+from itertools import product
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import rag
+from app.services.kb_index import KBIndex
+
+KB_PATH = os.path.join(os.path.dirname(__file__), "../app/data/kb.json")
+TABLE_FILTERS = {"gender", "bmi_category", "meal_time", "somatotype"}
+
+
+def scan_retrieve_context(entries, gender, bmi_category, somatotype, **filters):
+    """
+    The original retrieve_context: a scan of every entry. Entries with other
+    filters apply only to lookups with the same value, and the options of
+    several entries for the same meal are merged.
+    """
+    context = {"meal_options": {}, "guidance": [], "snacks": []}
+    for entry in entries:
+        entry_filters = entry.get("filters", {})
+        if any(filters.get(k) != v for k, v in entry_filters.items() if k not in TABLE_FILTERS and v is not None):
+            continue
+        entry_type = entry.get("type")
+        if entry_type == "meal_options":
+            if entry_filters.get("gender") == gender and entry_filters.get("bmi_category") == bmi_category:
+                meal_time = entry_filters.get("meal_time")
+                if meal_time:
+                    context["meal_options"].setdefault(meal_time, []).extend(entry.get("options", []))
+        elif entry_type == "bodytype_guidance":
+            if entry_filters.get("somatotype") == somatotype:
+                context["guidance"].extend(entry.get("options", []))
+        elif entry_type == "snack_options":
+            if entry_filters.get("bmi_category") == bmi_category:
+                context["snacks"].extend(entry.get("options", []))
+
+    # The index lists each option once, in KB order
+    unique = lambda options: list(dict.fromkeys(options))
+    return {
+        "meal_options": {meal: unique(options) for meal, options in context["meal_options"].items()},
+        "guidance": unique(context["guidance"]),
+        "snacks": unique(context["snacks"]),
+    }
+
+
+def as_lists(context):
+    return {
+        "meal_options": {meal: list(options) for meal, options in context["meal_options"].items()},
+        "guidance": list(context["guidance"]),
+        "snacks": list(context["snacks"]),
+    }
+
+
+def synthetic_kb(rng):
+    """kb.json-like entries, some narrowed by goal, age_band or activity_level (a filter no code knows about)"""
+    optional = {"goal": ["weight loss", "muscle gain"], "age_band": ["18-29", "60+"], "activity_level": ["low", "high"]}
+    entries = []
+    for i in range(300):
+        entry_type = rng.choice(["meal_options", "bodytype_guidance", "snack_options"])
+        filters = {
+            "meal_options": lambda: {"gender": rng.choice(["male", "female"]), "bmi_category": rng.choice(["normal", "overweight"]),
+                                     "meal_time": rng.choice(["breakfast", "lunch", "dinner"])},
+            "bodytype_guidance": lambda: {"somatotype": rng.choice(["Ectomorph", "Mesomorph"])},
+            "snack_options": lambda: {"bmi_category": rng.choice(["normal", "overweight"])},
+        }[entry_type]()
+        for dim, values in optional.items():
+            if rng.random() < 0.3:
+                filters[dim] = rng.choice(values)
+        entries.append({"id": i, "type": entry_type, "filters": filters,
+                        "options": [f"option {rng.randint(0, 40)}" for _ in range(rng.randint(1, 4))]})
+    return entries, optional
+
+
+def check(entries, lookups, label):
+    rag.KB_INDEX = KBIndex(entries)
+    mismatches = 0
+    for profile in lookups:
+        filters = rag.kb_filters(profile)
+        expected = scan_retrieve_context(entries, profile["gender_str"], profile["bmi_category"], profile["somatotype"], **filters)
+        context = rag.prepare(profile)
+        # Twice, the second time from the lookup cache
+        if as_lists(context) != expected or as_lists(rag.prepare(profile)) != expected:
+            mismatches += 1
+        elif json.loads(rag.KB_INDEX.lookup_json("bodytype_guidance", (profile["somatotype"],), filters)) != expected["guidance"]:
+            mismatches += 1
+    if mismatches:
+        print(f"FAILURE: {mismatches} of {len(lookups)} {label} lookups differ from the scan.")
+    else:
+        print(f"SUCCESS: {len(lookups)} {label} lookups match the scan.")
+
+
+def verify_kb():
+    print("Verifying KB lookups against a scan of kb.json...")
+    with open(KB_PATH, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    lookups = [
+        {"gender_str": gender, "bmi_category": bmi_category, "somatotype": somatotype, "goal": goal}
+        for gender, bmi_category, somatotype, goal in product(
+            ["male", "female", "other"], ["underweight", "normal", "overweight", "obese"],
+            ["Ectomorph", "Mesomorph", "Endomorph"], [None, "weight loss"])
+    ]
+    check(entries, lookups, "kb.json")
+
+
+def verify_filters():
+    print("Verifying optional filters, including one added to the KB without code changes...")
+    rng = random.Random(3)
+    entries, optional = synthetic_kb(rng)
+    lookups = []
+    for _ in range(500):
+        profile = {"gender_str": rng.choice(["male", "female"]), "bmi_category": rng.choice(["normal", "overweight"]),
+                   "somatotype": rng.choice(["Ectomorph", "Mesomorph"])}
+        for dim, values in optional.items():
+            # Unset, a value entries use, or one no entry uses
+            profile[dim] = rng.choice([None, "unknown"] + values)
+        lookups.append(profile)
+    check(entries, lookups, "synthetic")
+
+
+if __name__ == "__main__":
+    original = rag.KB_INDEX
+    try:
+        verify_kb()
+        verify_filters()
+    finally:
+        rag.KB_INDEX = original
@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import multiprocessing
+import random
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.local_database import LocalStore, LocalCollection, _FileLock
+
+
+def make_store(directory):
+    return LocalStore(os.path.join(directory, "db.json"), os.path.join(directory, "db.log"))
+
+
+def naive_query(docs, query, sort_field=None, direction=1, limit=None):
+    """Reference implementation: the original scan + stable sort + slice"""
+    results = [d for d in docs if all(d.get(k) == v for k, v in query.items())]
+    if sort_field:
+        results.sort(key=lambda x: x.get(sort_field, ''), reverse=(direction == -1))
+    return results[:limit] if limit is not None else results
+
+
+async def verify_indexes(directory):
+    print("Verifying indexed queries against a full scan...")
+    store = make_store(directory)
+    plans = LocalCollection("meal_plans", store)
+    plans.create_index(["user_email", "active"], sort_field="created_at")
+    plans.create_index("user_email")
+
+    rng = random.Random(42)
+    emails = [f"user{i}@example.com" for i in range(5)]
+    for i in range(300):
+        await plans.insert_one({
+            "user_email": rng.choice(emails),
+            # Few distinct dates so ties are exercised
+            "created_at": f"2025-01-{rng.randint(1, 9):02d}",
+            "active": rng.random() < 0.7,
+        })
+    for _ in range(50):
+        await plans.update_one({"user_email": rng.choice(emails), "active": True}, {"$set": {"active": False}})
+        await plans.delete_one({"user_email": rng.choice(emails)})
+
+    all_docs = await (await plans.find({})).to_list()
+    failures = 0
+    for email in emails:
+        for query in ({"user_email": email}, {"user_email": email, "active": True}):
+            for sort_field, direction, limit in (
+                (None, 1, None), ("created_at", -1, 1), ("created_at", 1, 5), ("created_at", -1, None),
+            ):
+                cursor = await plans.find(query)
+                if sort_field:
+                    cursor.sort(sort_field, direction)
+                got = await cursor.to_list(length=limit)
+                expected = naive_query(all_docs, query, sort_field, direction, limit)
+                if [d["_id"] for d in got] != [d["_id"] for d in expected]:
+                    failures += 1
+                    print(f"FAILURE: {query} sort={sort_field}/{direction} limit={limit}")
+
+    if not failures:
+        print("SUCCESS: Indexed results match the full scan.")
+    return all_docs
+
+
+async def verify_replay(directory, expected_docs):
+    print("Verifying state is rebuilt from the snapshot and log...")
+    store = make_store(directory)
+    plans = LocalCollection("meal_plans", store)
+    docs = await (await plans.find({})).to_list()
+    if docs == expected_docs:
+        print("SUCCESS: Reloaded store matches.")
+    else:
+        print("FAILURE: Reloaded store differs.")
+
+    store.compact()
+    docs = await (await LocalCollection("meal_plans", make_store(directory)).find({})).to_list()
+    if docs == expected_docs:
+        print("SUCCESS: Compacted store matches.")
+    else:
+        print("FAILURE: Compacted store differs.")
+
+
+def _worker(directory, worker_id):
+    async def run():
+        messages = LocalCollection("chat_history", make_store(directory))
+        for i in range(50):
+            await messages.insert_one({"user_email": f"worker{worker_id}@example.com", "text": str(i)})
+            # Reads must see what the other workers committed
+            await messages.find_one({"user_email": f"worker{(worker_id + 1) % 4}@example.com"})
+    asyncio.run(run())
+
+
+async def verify_multiprocess(directory):
+    print("Verifying concurrent writers in separate processes...")
+    workers = [multiprocessing.Process(target=_worker, args=(directory, i)) for i in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    docs = await (await LocalCollection("chat_history", make_store(directory)).find({})).to_list()
+    if len(docs) == 200 and len({d["_id"] for d in docs}) == 200:
+        print("SUCCESS: No writes were lost across processes.")
+    else:
+        print(f"FAILURE: Expected 200 unique messages, found {len(docs)}.")
+
+
+async def verify_bad_document(directory):
+    print("Verifying a document that cannot be stored fails only its own write...")
+    users = LocalCollection("users", make_store(directory))
+    writes = [users.insert_one({"email": f"user{i}@example.com"}) for i in range(5)]
+    writes.append(users.insert_one({"email": "late@example.com", "created_at": datetime.datetime.now()}))
+    outcomes = await asyncio.gather(*writes, return_exceptions=True)
+    failed = [i for i, outcome in enumerate(outcomes) if isinstance(outcome, Exception)]
+
+    # The batch's other writes are committed, in memory and on disk
+    stored = await (await users.find({})).to_list()
+    reloaded = await (await LocalCollection("users", make_store(directory)).find({})).to_list()
+    if failed == [5] and len(stored) == 5 and reloaded == stored:
+        print("SUCCESS: Only the write with the datetime failed; the other 5 were stored.")
+    else:
+        print(f"FAILURE: failed writes={failed}, stored={len(stored)}, reloaded={len(reloaded)}.")
+
+
+def timed(call):
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+
+async def verify_reads_during_commit(directory):
+    print("Verifying reads do not wait for commits being synced...")
+    writer, reader = make_store(directory), make_store(directory)
+    await LocalCollection("users", writer).insert_one({"email": "first@example.com"})
+    reader.refresh()
+
+    # A slow fsync in this process: the log grows before the commit is acknowledged
+    fsync = os.fsync
+    os.fsync = lambda fd: (time.sleep(0.3), fsync(fd))
+    try:
+        pending = writer.submit("insert", "users", {"email": "second@example.com"})
+        time.sleep(0.1)
+        own_wait = timed(writer.refresh)
+        pending.result()
+    finally:
+        os.fsync = fsync
+
+    # Another process holding the file lock while it commits
+    other = _FileLock(writer._file_lock.path)
+    with other.hold(exclusive=True):
+        other_wait = timed(reader.refresh)
+    reader.refresh()
+    emails = {d["email"] for d in reader.query("users", {})}
+
+    if own_wait < 0.05 and other_wait < 0.05 and emails == {"first@example.com", "second@example.com"}:
+        print("SUCCESS: Reads were served from memory during the commits and caught up afterwards.")
+    else:
+        print(f"FAILURE: waited {own_wait:.3f}s and {other_wait:.3f}s, reader has {sorted(emails)}.")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        docs = await verify_indexes(directory)
+        await verify_replay(directory, docs)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_multiprocess(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_bad_document(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_reads_during_commit(directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import sys
+import os
+import tempfile
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import local_db_format
+from app.local_database import LocalStore, LocalCollection
+
+COLLECTIONS = {
+    "users": [{"_id": "1", "email": "a@example.com", "name": "Nimal", "tags": ["a", "b"]}],
+    "meal_plans": [
+        {"_id": "2", "user_email": "a@example.com", "active": True, "score": 1.5, "notes": None,
+         "plan_data": {"day_1": {"breakfast": {"item": "Pittu", "portion": "1 cup"}}}},
+        {"_id": "3", "user_email": "b@example.com", "active": False, "text": "Kola kanda සිංහල"},
+    ],
+}
+
+
+def write(path, codec):
+    with open(path, 'wb') as f:
+        local_db_format.write_snapshot(f, COLLECTIONS, {"seq": 7}, codec=codec)
+
+
+def check_round_trip(path, label):
+    reader = local_db_format.SnapshotReader(path)
+    if reader.read_all() == COLLECTIONS and reader.meta == {"seq": 7} \
+            and reader.get("meal_plans", "3") == COLLECTIONS["meal_plans"][1] and reader.get("users", "9") is None:
+        print(f"SUCCESS: {label} snapshot round-trips.")
+    else:
+        print(f"FAILURE: {label} snapshot read back differently.")
+
+
+def verify_codecs(directory):
+    print("Verifying the binary snapshot codecs...")
+    path = os.path.join(directory, "db.bin")
+    write(path, b"j")
+    check_round_trip(path, "JSON codec")
+
+    if local_db_format.msgpack is not None:
+        write(path, b"m")
+        check_round_trip(path, "msgpack codec")
+    else:
+        print("Skipping the msgpack codec: msgpack is not installed.")
+
+    # Without msgpack, new snapshots fall back to JSON and msgpack ones fail with a clear error
+    installed = local_db_format.msgpack
+    local_db_format.msgpack = None
+    try:
+        write(path, None)
+        check_round_trip(path, "Fallback")
+        with open(path, 'r+b') as f:
+            f.seek(len(local_db_format.MAGIC))
+            f.write(b"m")
+        try:
+            local_db_format.SnapshotReader(path)
+            print("FAILURE: Reading a msgpack snapshot without msgpack did not fail.")
+        except RuntimeError as e:
+            if "msgpack" in str(e):
+                print("SUCCESS: Reading a msgpack snapshot without msgpack names the missing package.")
+            else:
+                print(f"FAILURE: Unclear error: {e}")
+        try:
+            local_db_format.write_snapshot(io.BytesIO(), COLLECTIONS, codec=b"m")
+            print("FAILURE: Writing a msgpack snapshot without msgpack did not fail.")
+        except RuntimeError as e:
+            print("SUCCESS: Writing a msgpack snapshot without msgpack fails." if "msgpack" in str(e)
+                  else f"FAILURE: Unclear error: {e}")
+    finally:
+        local_db_format.msgpack = installed
+
+
+async def verify_store(directory):
+    print("Verifying a binary LocalStore reloads its compacted snapshot...")
+    paths = (os.path.join(directory, "db.bin"), os.path.join(directory, "db.log"), os.path.join(directory, "db.lock"))
+    users = LocalCollection("users", LocalStore(*paths, binary=True))
+    for i in range(20):
+        await users.insert_one({"email": f"user{i}@example.com", "age": i})
+    await users.update_one({"email": "user3@example.com"}, {"$set": {"age": 99}})
+    users.store.compact()
+    expected = await (await users.find({})).to_list()
+
+    reloaded = LocalCollection("users", LocalStore(*paths, binary=True))
+    if local_db_format.is_binary_snapshot(paths[0]) and await (await reloaded.find({})).to_list() == expected:
+        print("SUCCESS: Binary snapshot reloads the same documents.")
+    else:
+        print("FAILURE: Binary snapshot reloaded different documents.")
+
+
+async def load_error(store):
+    try:
+        await LocalCollection("users", store).find_one({})
+    except RuntimeError as e:
+        return str(e)
+    return None
+
+
+async def verify_missing_snapshot(directory):
+    print("Verifying a store refuses to load without the snapshot its log continues from...")
+    json_paths = (os.path.join(directory, "db.json"), os.path.join(directory, "db.log"), os.path.join(directory, "db.lock"))
+    users = LocalCollection("users", LocalStore(*json_paths))
+    for i in range(5):
+        await users.insert_one({"email": f"user{i}@example.com"})
+    users.store.compact()
+    await users.insert_one({"email": "late@example.com"})
+
+    # LOCAL_DB_FORMAT=binary before running the migration
+    error = await load_error(LocalStore(os.path.join(directory, "db.bin"), *json_paths[1:]))
+    if error and "migrate_local_db.py" in error:
+        print("SUCCESS: A binary store without db.bin asks for the migration.")
+    else:
+        print(f"FAILURE: Binary store without db.bin loaded (error={error}).")
+
+    # Without a snapshot of either format, the log's snapshot marker shows what is missing
+    os.remove(json_paths[0])
+    error = await load_error(LocalStore(*json_paths))
+    if error and "refusing" in error and not os.path.exists(json_paths[0]):
+        print("SUCCESS: A log that continues from a missing snapshot is refused.")
+    else:
+        print(f"FAILURE: Store loaded a partial database (error={error}).")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        verify_codecs(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_store(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_missing_snapshot(directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import random
+import sys
+import os
+import types
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import rag
+from app.services.kb_index import KBIndex
+
+PROFILE = {"gender_str": "male", "bmi_category": "normal", "somatotype": "Mesomorph"}
+
+
+def context_with(counts):
+    """A retrieved context with counts[meal] options for each meal"""
+    options = {meal: tuple(f"{meal} dish {i} (Approx. {i + 1} cup)" for i in range(count)) for meal, count in counts.items()}
+    return {"meal_options": {meal: options[meal] for meal in ("breakfast", "lunch", "dinner")},
+            "snacks": options["snacks"], "guidance": ()}
+
+
+def check_windows(chunks, options):
+    """Each window holds the next OPTIONS_PER_REQUEST options of one shuffled order, wrapping around"""
+    n, size = len(options), rag.OPTIONS_PER_REQUEST
+    windows = [chunk[2] for chunk in chunks]
+    if not n:
+        return all(window == [] for window in windows)
+    shown = [option for window in windows for option in window]
+    if len(shown) < n:
+        # Fewer slots than options: consecutive windows, none repeated
+        return len(set(shown)) == len(shown) and set(shown) <= set(options) \
+            and all(len(window) == size for window in windows)
+    # The shuffled order, read off the first windows
+    order = shown[:n]
+    if sorted(order) != sorted(options):
+        return False
+    for index, window in enumerate(windows):
+        start = (index * size) % n
+        if window != (order[start:] + order[:start])[:size]:
+            return False
+    return True
+
+
+def verify_split():
+    print("Verifying plans are split into chunks with wrapping option windows...")
+    random.seed(4)
+    counts = {"breakfast": 20, "lunch": 5, "dinner": 8, "snacks": 0}
+    context = context_with(counts)
+    original = rag.MEAL_PLAN_DAYS_PER_REQUEST, rag.MEAL_PLAN_CONCURRENCY
+    failures = []
+    try:
+        for per_request, concurrency, plan_days, expected in (
+            (1, 8, 7, [(day, 1) for day in range(1, 8)]),
+            # Longer plans get more days per request instead of more requests
+            (1, 2, 7, [(1, 4), (5, 3)]),
+            (3, 8, 7, [(1, 3), (4, 3), (7, 1)]),
+        ):
+            rag.MEAL_PLAN_DAYS_PER_REQUEST, rag.MEAL_PLAN_CONCURRENCY = per_request, concurrency
+            chunks = rag.split_days(context, plan_days)
+            if [(first_day, days) for first_day, days, _ in chunks] != expected:
+                failures.append(f"days of {per_request}/{concurrency}")
+            for meal in rag.MEALS:
+                if not check_windows([(d, n, options[meal]) for d, n, options in chunks], rag.meal_options(context, meal)):
+                    failures.append(f"{meal} windows of {per_request}/{concurrency}")
+    finally:
+        rag.MEAL_PLAN_DAYS_PER_REQUEST, rag.MEAL_PLAN_CONCURRENCY = original
+
+    if failures:
+        print(f"FAILURE: {failures}")
+    else:
+        print("SUCCESS: Every day is in one chunk and the option windows wrap around, also with few or no options.")
+
+
+class Completions:
+    """Every request writes the same breakfast and lunch for its day_1, then is cut off"""
+
+    def __init__(self, text):
+        self.text = text
+
+    async def create(self, **kwargs):
+        async def stream():
+            for i in range(0, len(self.text), 9):
+                yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=self.text[i:i + 9]))])
+            raise ConnectionError("connection reset")
+        return stream()
+
+
+def kb_entries(per_meal):
+    entries = [{"type": "meal_options", "filters": {"gender": "male", "bmi_category": "normal", "meal_time": meal},
+                "options": [f"{meal} dish {i} (Approx. 1 cup)" for i in range(per_meal)]}
+               for meal in ("breakfast", "lunch", "dinner")]
+    entries.append({"type": "snack_options", "filters": {"bmi_category": "normal"},
+                    "options": [f"snacks dish {i} (Approx. 1 cup)" for i in range(per_meal)]})
+    entries.append({"type": "bodytype_guidance", "filters": {"somatotype": "Mesomorph"}, "options": ["Eat well"]})
+    return entries
+
+
+async def verify_dedup():
+    print("Verifying repeated dishes are replaced, in generated and gap-filled meals...")
+    plan_days = 3
+    generated = {"meal_plan": {"day_1": {
+        meal: {"main": {"item": f"{meal} dish 0", "portion": "1 cup"}, "alternative": {"item": f"{meal} dish 1", "portion": "1 cup"}}
+        for meal in ("breakfast", "lunch")}}}
+    # Cut off once lunch is complete, so dinner and snacks of every day are filled in from the KB
+    text = json.dumps(generated)[:-2] + ', "dinner": {"main'
+
+    original = rag.client, rag.KB_INDEX, rag.MEAL_PLAN_DAYS_PER_REQUEST
+    rag.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=Completions(text)))
+    # Exactly enough options for every slot of the plan to get its own dish
+    rag.KB_INDEX = KBIndex(kb_entries(plan_days * 2))
+    rag.MEAL_PLAN_DAYS_PER_REQUEST = 1
+    try:
+        events = [event async for event in rag.stream_meal_plan(PROFILE, plan_days)]
+    finally:
+        rag.client, rag.KB_INDEX, rag.MEAL_PLAN_DAYS_PER_REQUEST = original
+
+    plan = events[-1]["plan"]
+    failures = []
+    for meal in rag.MEALS:
+        choices = [choice for day in plan["meal_plan"].values() for choice in day[meal].values()]
+        names = [rag.dish_name(choice) for choice in choices]
+        if len(set(names)) != len(names):
+            failures.append(f"{meal} repeats {names}")
+        if not all(isinstance(c, dict) and set(c) == {"item", "portion"} and c["portion"] == "1 cup" for c in choices):
+            failures.append(f"{meal} is not in item/portion form")
+    # Streamed meals are the final ones
+    streamed = {(e["day"], e["meal"]): e["data"] for e in events if e["event"] == "meal"}
+    if streamed != {(day, meal): plan["meal_plan"][day][meal] for day in plan["meal_plan"] for meal in rag.MEALS}:
+        failures.append("streamed meals differ from the plan")
+
+    if plan.get("source") == "partial_fallback" and not failures:
+        print(f"SUCCESS: All {plan_days * 2} dishes of each meal are different, including the gap-filled ones.")
+    else:
+        print(f"FAILURE: source={plan.get('source')}, {failures}")
+
+
+if __name__ == "__main__":
+    verify_split()
+    asyncio.run(verify_dedup())
@@ -0,0 +1,211 @@
+import asyncio
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import model, model_registry
+
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "../app/data/Dataset.csv")
+
+
+def dataset_requests():
+    """Rows of Dataset.csv as /body-type/predict inputs"""
+    df = pd.read_csv(DATASET_PATH)
+    return [
+        {
+            "gender": int(row["gender"]),
+            "weight_kg": row["weight_kg"],
+            "height_cm": row["height"],
+            "waist_cm": row["waist"],
+            "hip_cm": row["hip"],
+            "chest_cm": row["chest"],
+            "shoulder_breadth_cm": row["shoulder-breadth"],
+            "wrist_cm": row["wrist"],
+        }
+        for _, row in df.iterrows()
+    ]
+
+
+def sklearn_prediction(data):
+    """The original path: a one-row DataFrame through LogisticRegression.predict"""
+    row = [data["gender"], model.calculate_bmi(data["weight_kg"], data["height_cm"])] + [
+        data["waist_cm"] / data["hip_cm"],
+        data["shoulder_breadth_cm"] / data["waist_cm"],
+        data["chest_cm"] / data["waist_cm"],
+        data["height_cm"] / data["waist_cm"],
+        data["height_cm"] / data["wrist_cm"],
+    ]
+    return model.model.predict(pd.DataFrame([row], columns=model.FEATURES))[0]
+
+
+def verify_parity():
+    print("Verifying NumPy predictions against scikit-learn...")
+    requests = dataset_requests()
+    mismatches = [
+        data for data in requests
+        if model.predict_somatotype(data)["somatotype"] != sklearn_prediction(data)
+    ]
+
+    # Random inputs, including ones far from the training data
+    rng = np.random.default_rng(0)
+    X = np.column_stack([
+        rng.integers(0, 2, 5000),
+        rng.uniform(10, 60, (5000, 6)),
+    ])
+    X_df = pd.DataFrame(X, columns=model.FEATURES)
+    scores_match = np.allclose(model.engine.decision_function(X), model.model.decision_function(X_df))
+    labels_match = (model.engine.predict(X) == model.model.predict(X_df)).all()
+    scores_match = scores_match and np.allclose(model.engine.predict_proba(X), model.model.predict_proba(X_df))
+
+    if not mismatches and scores_match and labels_match:
+        print(f"SUCCESS: {len(requests)} dataset rows and 5000 random rows predict identically.")
+    else:
+        print(f"FAILURE: {len(mismatches)} dataset mismatches, scores match={scores_match}, labels match={labels_match}")
+
+
+def verify_batch():
+    print("Verifying batch predictions against single predictions...")
+    requests = dataset_requests()
+    invalid = [{**requests[0], "hip_cm": 0}, {**requests[0], "gender": "male"}, {}]
+    results = model.predict_somatotype_batch(requests + invalid)
+
+    matches = all(r == model.predict_somatotype(d) for r, d in zip(results, requests))
+    errors = all("error" in r for r in results[len(requests):])
+    if matches and errors:
+        print(f"SUCCESS: {len(requests)} batch rows match and {len(invalid)} invalid rows report errors.")
+    else:
+        print(f"FAILURE: batch rows match={matches}, invalid rows report errors={errors}")
+
+
+def verify_one_vs_rest():
+    print("Verifying one-vs-rest probabilities of an SGDClassifier...")
+    from sklearn.linear_model import SGDClassifier
+
+    rng = np.random.default_rng(1)
+    X = pd.DataFrame(rng.normal(size=(600, len(model.FEATURES))), columns=model.FEATURES)
+    y = np.array(["Ectomorph", "Endomorph", "Mesomorph"])[(X.to_numpy() @ rng.normal(size=(len(model.FEATURES), 3))).argmax(axis=1)]
+    sgd = SGDClassifier(loss="log_loss", random_state=0).fit(X, y)
+
+    # As served: multi_class comes from the registry metadata
+    metadata = {"version": "test", "multi_class": model_registry.multi_class(sgd)}
+    engine = model.ServingModel(sgd, metadata).engine
+    if metadata["multi_class"] == "ovr" and np.allclose(engine.predict_proba(X.to_numpy()), sgd.predict_proba(X)):
+        print("SUCCESS: Served probabilities match SGDClassifier.predict_proba.")
+    else:
+        print(f"FAILURE: multi_class={metadata['multi_class']}, probabilities differ from SGDClassifier.predict_proba.")
+
+
+def verify_prediction_cache():
+    print("Verifying cached predictions by instrument precision...")
+    cache = model.prediction_cache
+    data = {"gender": 1, "weight_kg": 70.0, "height_cm": 175.0, "waist_cm": 85.0, "hip_cm": 100.0,
+            "chest_cm": 95.0, "shoulder_breadth_cm": 40.0, "wrist_cm": 16.0}
+    cache.clear()
+    first = model.predict_somatotype(data)
+    first["probabilities"].clear()  # Callers may change what they get
+
+    def lookups(rows):
+        hits = cache.hits
+        results = [model.predict_somatotype(row) for row in rows]
+        return cache.hits - hits, results
+
+    # Within half a step of the stored values: the same key
+    same, results = lookups([dict(data), {**data, "weight_kg": 70.01}, {**data, "height_cm": 175.04},
+                             {**data, "wrist_cm": 15.96}])
+    served = all(r == model.predict_somatotype_batch([data])[0] for r in results)
+    # One instrument step or more away, or another gender: a new key
+    different, _ = lookups([{**data, "weight_kg": 70.05}, {**data, "height_cm": 175.1},
+                            {**data, "waist_cm": 84.9}, {**data, "gender": 0}])
+
+    size = cache.stats()["size"]
+    model.swap_model(model.serving.version)
+    invalidated, _ = lookups([data])
+    if same == 4 and served and different == 0 and size == 5 and invalidated == 0:
+        print("SUCCESS: Rounded repeats were hits, changes of one step were misses, and a swap emptied the cache.")
+    else:
+        print(f"FAILURE: hits={same}/4, correct={served}, hits past precision={different}, size={size}, "
+              f"hits after swap={invalidated}")
+
+
+def verify_registry():
+    print("Verifying model registration, activation and hash checks...")
+    original = model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE
+    with tempfile.TemporaryDirectory() as directory:
+        model_registry.REGISTRY_DIR = directory
+        model_registry.CURRENT_FILE = os.path.join(directory, "current.json")
+        try:
+            legacy = model_registry.current_version()
+            version = model_registry.register(model.model, {"accuracy": 0.9})
+            listed = [v["version"] for v in model_registry.list_versions()]
+            metadata = model_registry.load(version)[1]
+            registered = listed == [version] and metadata["accuracy"] == 0.9 \
+                and metadata["classes"] == [str(c) for c in model.model.classes_]
+            model_registry.activate(version)
+            activated = legacy == model_registry.LEGACY_VERSION and model_registry.current_version() == version
+
+            # An artifact that changed after registration is refused, and the serving model stays
+            with open(os.path.join(directory, f"{version}.pkl"), 'ab') as f:
+                f.write(b"tampered")
+            serving = model.serving
+            try:
+                model.swap_model(version)
+                rejected = False
+            except ValueError:
+                rejected = model.serving is serving
+        finally:
+            model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE = original
+
+    if registered and activated and rejected:
+        print("SUCCESS: A registered version is listed and activated; a tampered artifact is refused.")
+    else:
+        print(f"FAILURE: registered={registered}, activated={activated}, tampered artifact refused={rejected}")
+
+
+async def verify_hot_swap():
+    print("Verifying workers swap in a newly activated version...")
+    original = model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE, model.serving, model.model, model.engine
+    swaps = []
+    with tempfile.TemporaryDirectory() as directory:
+        model_registry.REGISTRY_DIR = directory
+        model_registry.CURRENT_FILE = os.path.join(directory, "current.json")
+        watcher = asyncio.create_task(model.watch_registry(0.01, on_swap=lambda: swaps.append(model.serving.version)))
+        try:
+            version = model_registry.register(model.model)
+            model_registry.activate(version)
+            for _ in range(200):
+                if swaps:
+                    break
+                await asyncio.sleep(0.01)
+            swapped = model.serving.version == version
+
+            # A version that fails to load is reported once, and the last good one keeps serving
+            with open(os.path.join(directory, "broken.pkl"), 'wb') as f:
+                f.write(b"not a model")
+            with open(os.path.join(directory, "broken.json"), 'w') as f:
+                f.write('{"version": "broken", "sha256": "0"}')
+            model_registry.activate("broken")
+            await asyncio.sleep(0.1)
+            kept = model.serving.version == version
+        finally:
+            watcher.cancel()
+            model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE, model.serving, model.model, model.engine = original
+
+    if swapped and kept and swaps == [version]:
+        print("SUCCESS: The activated version was swapped in once; a broken one left it serving.")
+    else:
+        print(f"FAILURE: swapped={swapped}, kept={kept}, swaps={swaps}")
+
+
+if __name__ == "__main__":
+    verify_parity()
+    verify_batch()
+    verify_one_vs_rest()
+    verify_prediction_cache()
+    verify_registry()
+    asyncio.run(verify_hot_swap())
@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+import sys
+import os
+import tempfile
+import types
+from datetime import datetime
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.local_database import LocalStore, LocalCollection
+from app.services import plan_pool, rag
+
+
+class Generator:
+    """Stands in for rag.generate_meal_plan: numbered complete plans, after a delay"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.calls = 0
+        self.numbers = itertools.count(1)
+
+    async def __call__(self, profile, plan_days=1):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        meal = {"main": {"item": "Pittu", "portion": "1 cup"}}
+        return {"number": next(self.numbers),
+                "meal_plan": {f"day_{day}": {name: meal for name in ("breakfast", "lunch", "dinner")}
+                              for day in range(1, plan_days + 1)}}
+
+
+def use_store(directory):
+    store = LocalStore(os.path.join(directory, "db.json"), os.path.join(directory, "db.log"))
+    plan_pool.plan_pool_collection = LocalCollection("plan_pool", store)
+    plan_pool.plan_pool_collection.create_index("segment", sort_field="created_at")
+    plan_pool.jobs_collection = LocalCollection("jobs", store)
+    plan_pool.jobs_collection.create_index("name")
+
+
+def bounded_profile():
+    gender, bmi_category, somatotype = plan_pool.kb_segments()[0]
+    return {"gender_str": gender, "bmi_category": bmi_category, "somatotype": somatotype,
+            "goal": plan_pool.PLAN_POOL_GOALS[0]}
+
+
+async def refills_done():
+    while plan_pool._refills:
+        await asyncio.gather(*plan_pool._refills.values())
+
+
+async def pooled(segment):
+    return await plan_pool.plan_pool_collection.count_documents({"segment": segment})
+
+
+async def verify_take(generator):
+    print("Verifying each pooled plan is served once and the segment is refilled...")
+    profile = bounded_profile()
+    segment = plan_pool.segment_key(profile, 1)
+    await plan_pool.refill(segment, plan_pool.segment_profile(profile), 1)
+    filled = await pooled(segment)
+
+    # More concurrent requests than pooled plans
+    plans = await asyncio.gather(*[plan_pool.take(profile, 1) for _ in range(5)])
+    served = [plan["number"] for plan in plans if plan is not None]
+    await refills_done()
+    refilled = await pooled(segment)
+
+    if filled == plan_pool.PLAN_POOL_SIZE and sorted(served) == list(range(1, filled + 1)) \
+            and refilled == plan_pool.PLAN_POOL_SIZE:
+        print(f"SUCCESS: {len(served)} of 5 requests got distinct plans; the segment was refilled to {refilled}.")
+    else:
+        print(f"FAILURE: filled={filled}, served={served}, refilled={refilled}.")
+
+
+async def verify_unpooled(generator):
+    print("Verifying plan lengths and segments outside the fixed set are not refilled right away...")
+    calls = generator.calls
+    long_plan = await plan_pool.take(bounded_profile(), max(plan_pool.PLAN_POOL_DAYS) + 1)
+    scheduled_long = bool(plan_pool._refills)
+
+    # A free-form goal is refilled once it has been asked for PLAN_POOL_MIN_REQUESTS times
+    profile = {**bounded_profile(), "goal": "climb everest"}
+    scheduled = []
+    for _ in range(plan_pool.PLAN_POOL_MIN_REQUESTS):
+        await plan_pool.take(profile, 1)
+        scheduled.append(bool(plan_pool._refills))
+    await refills_done()
+
+    expected = [False] * (plan_pool.PLAN_POOL_MIN_REQUESTS - 1) + [True]
+    if long_plan is None and not scheduled_long and scheduled == expected \
+            and generator.calls - calls == plan_pool.PLAN_POOL_SIZE:
+        print("SUCCESS: Other plan lengths were never pooled; the free-form goal was filled on its last request.")
+    else:
+        print(f"FAILURE: long plan scheduled={scheduled_long}, free-form scheduled={scheduled}.")
+
+
+async def verify_overfill(generator):
+    print("Verifying concurrent refills of one segment do not overfill it...")
+    profile = {**bounded_profile(), "goal": plan_pool.PLAN_POOL_GOALS[-1]}
+    segment = plan_pool.segment_key(profile, 1)
+    # As if several workers refilled the same segment: all of them pass the count checks
+    await asyncio.gather(*[plan_pool.refill(segment, plan_pool.segment_profile(profile), 1) for _ in range(4)])
+    count = await pooled(segment)
+    if count == plan_pool.PLAN_POOL_SIZE and generator.calls > plan_pool.PLAN_POOL_SIZE:
+        print(f"SUCCESS: {generator.calls} plans were generated, the extra ones removed themselves ({count} pooled).")
+    else:
+        print(f"FAILURE: {count} plans pooled after {generator.calls} were generated.")
+
+
+async def verify_prewarm(generator):
+    print("Verifying only one worker prewarms while its lease is fresh...")
+    claims = await asyncio.gather(*[plan_pool._claim_prewarm() for _ in range(4)])
+    await plan_pool.prewarm()
+    scheduled_while_held = len(plan_pool._refills)
+
+    # An expired lease is claimed again, by one worker
+    expired = (datetime.now() - plan_pool.PREWARM_LEASE * 2).isoformat()
+    await plan_pool.jobs_collection.update_one({"name": plan_pool.PREWARM_JOB}, {"$set": {"updated_at": expired}})
+    reclaims = await asyncio.gather(*[plan_pool._claim_prewarm() for _ in range(4)])
+
+    await plan_pool.jobs_collection.update_one({"name": plan_pool.PREWARM_JOB}, {"$set": {"updated_at": expired}})
+    await plan_pool.prewarm()
+    expected = len(plan_pool.kb_segments()) * len(plan_pool.PLAN_POOL_GOALS) * len(plan_pool.PLAN_POOL_DAYS)
+    scheduled = len(plan_pool._refills)
+    await refills_done()
+
+    if claims.count(True) == 1 and reclaims.count(True) == 1 and scheduled_while_held == 0 and scheduled == expected:
+        print(f"SUCCESS: One claim per lease; prewarm scheduled all {expected} segments once the lease expired.")
+    else:
+        print(f"FAILURE: claims={claims}, reclaims={reclaims}, scheduled={scheduled_while_held}/{scheduled} of {expected}.")
+
+
+async def main():
+    original = rag.client, rag.generate_meal_plan, plan_pool.plan_pool_collection, plan_pool.jobs_collection
+    rag.client = types.SimpleNamespace()
+    try:
+        for verify in (verify_take, verify_unpooled, verify_overfill, verify_prewarm):
+            with tempfile.TemporaryDirectory() as directory:
+                use_store(directory)
+                rag.generate_meal_plan = generator = Generator()
+                plan_pool._demand.clear()
+                await verify(generator)
+    finally:
+        rag.client, rag.generate_meal_plan, plan_pool.plan_pool_collection, plan_pool.jobs_collection = original
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
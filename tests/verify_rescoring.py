@@ -0,0 +1,150 @@
+import asyncio
+import sys
+import os
+import socket
+import subprocess
+import tempfile
+from datetime import datetime
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.local_database import LocalStore, LocalCollection
+from app.services import model, model_registry, rescoring
+
+MEASUREMENTS = 50
+
+
+def use_store(directory):
+    store = LocalStore(os.path.join(directory, "db.json"), os.path.join(directory, "db.log"))
+    rescoring.measurements_collection = LocalCollection("measurements", store)
+    rescoring.jobs_collection = LocalCollection("jobs", store)
+    rescoring.jobs_collection.create_index("name")
+
+
+async def seed():
+    """Measurements scored by a model version that is no longer served"""
+    for i in range(MEASUREMENTS):
+        await rescoring.measurements_collection.insert_one({
+            "user_email": f"user{i % 5}@example.com", "gender": "male" if i % 2 else "female",
+            "weight_kg": 60 + i * 0.5, "height_cm": 170.0, "waist_cm": 80.0, "hip_cm": 95.0,
+            "chest_cm": 92.0, "shoulder_breadth_cm": 42.0, "wrist_cm": 16.5, "model_version": "old",
+        })
+
+
+async def versions():
+    docs = await (await rescoring.measurements_collection.find({}, {"model_version": 1})).to_list()
+    return {doc["model_version"] for doc in docs}
+
+
+def as_worker(owner):
+    """Makes this process act as another worker, with its own owner id"""
+    rescoring._owner = (os.getpid(), owner)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+async def verify_concurrent_claims():
+    print("Verifying only one of several workers claims the job...")
+    first = await asyncio.gather(*[rescoring._claim(None) for _ in range(4)])
+    job = await rescoring.get_status()
+    again = await asyncio.gather(*[rescoring._claim(job) for _ in range(4)])
+
+    # Runs started at the same time: one claims the job, the others step back
+    await rescoring.jobs_collection.delete_one({"name": rescoring.JOB_NAME})
+    await asyncio.gather(*[rescoring.run_rescore() for _ in range(3)])
+    status = await rescoring.get_status()
+
+    if first.count(True) == 1 and again.count(True) == 1 and status["status"] == "done" \
+            and status["position"] == status["updated"] == MEASUREMENTS \
+            and await versions() == {model.serving.version}:
+        print(f"SUCCESS: One claim succeeded each time; one run re-scored all {MEASUREMENTS} measurements once.")
+    else:
+        print(f"FAILURE: claims={first}/{again}, status={status}")
+
+
+async def interrupted_job(position, **owner):
+    """A running job as left behind by a worker that stopped after position measurements"""
+    docs = await (await rescoring.measurements_collection.find({}, {"_id": 1})).limit(position).to_list()
+    for doc in docs:
+        await rescoring.measurements_collection.update_one({"_id": doc["_id"]}, {"$set": {"model_version": model.serving.version}})
+    await rescoring.jobs_collection.insert_one({
+        "_id": rescoring.JOB_NAME, "name": rescoring.JOB_NAME, "status": "running",
+        "model_version": model.serving.version, "position": position, "updated": position, "failed": 0,
+        "total": MEASUREMENTS, "updated_at": datetime.now().isoformat(), **owner,
+    })
+
+
+async def verify_resume():
+    print("Verifying a job left by a stopped worker is resumed where it stopped...")
+    # The owner is alive and its lease is fresh: nobody else runs the job
+    await interrupted_job(20, owner="alive", owner_host=socket.gethostname(), owner_pid=os.getppid())
+    as_worker("worker-b")
+    skipped = not await rescoring.run_rescore() and (await rescoring.get_status())["owner"] == "alive"
+
+    # The owner's process is gone: taken over at once, from position 20
+    await rescoring.jobs_collection.update_one({"name": rescoring.JOB_NAME}, {"$set": {"owner": "dead", "owner_pid": dead_pid()}})
+    await rescoring.run_rescore()
+    status = await rescoring.get_status()
+    if skipped and status["owner"] != "dead" and status["status"] == "done" \
+            and status["position"] == MEASUREMENTS and status["updated"] == MEASUREMENTS \
+            and await versions() == {model.serving.version}:
+        print("SUCCESS: A live owner kept the job; a dead owner's job was resumed from position 20.")
+    else:
+        print(f"FAILURE: skipped={skipped}, status={status}")
+
+
+async def verify_swap(new_version):
+    print("Verifying a model swapped in mid-run restarts the job with the new version...")
+    as_worker("worker-a")
+    first_version = model.serving.version
+    rescoring.RESCORE_BATCH_DELAY_MS = 20
+    task = asyncio.create_task(rescoring._run())
+    while ((await rescoring.get_status()) or {}).get("position", 0) < 10:
+        await asyncio.sleep(0.005)
+    model.swap_model(new_version)
+    await task
+    status = await rescoring.get_status()
+
+    if first_version != new_version and status["model_version"] == new_version and status["status"] == "done" \
+            and status["position"] == MEASUREMENTS and await versions() == {new_version}:
+        print(f"SUCCESS: The run for {first_version} was superseded and every measurement re-scored with {new_version}.")
+    else:
+        print(f"FAILURE: status={status}, versions={await versions()}")
+
+
+async def main():
+    original = (rescoring.measurements_collection, rescoring.jobs_collection, rescoring.RESCORE_BATCH_SIZE,
+                rescoring.RESCORE_BATCH_DELAY_MS, rescoring._owner, model.serving, model.model, model.engine,
+                model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE)
+    rescoring.RESCORE_BATCH_SIZE = 10
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # A second registered version to swap to
+            model_registry.REGISTRY_DIR = os.path.join(directory, "models")
+            model_registry.CURRENT_FILE = os.path.join(model_registry.REGISTRY_DIR, "current.json")
+            new_version = model_registry.register(model.model)
+            model.swap_model(model_registry.LEGACY_VERSION)
+
+            for verify in (verify_concurrent_claims, verify_resume):
+                with tempfile.TemporaryDirectory() as store_directory:
+                    use_store(store_directory)
+                    rescoring.RESCORE_BATCH_DELAY_MS = 0
+                    await seed()
+                    await verify()
+            with tempfile.TemporaryDirectory() as store_directory:
+                use_store(store_directory)
+                await seed()
+                await verify_swap(new_version)
+    finally:
+        (rescoring.measurements_collection, rescoring.jobs_collection, rescoring.RESCORE_BATCH_SIZE,
+         rescoring.RESCORE_BATCH_DELAY_MS, rescoring._owner, model.serving, model.model, model.engine,
+         model_registry.REGISTRY_DIR, model_registry.CURRENT_FILE) = original
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
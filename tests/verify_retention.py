@@ -0,0 +1,160 @@
+import asyncio
+import glob
+import random
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.local_database import LocalStore, LocalCollection
+from app.services import retention
+
+KEEP_LAST = 3
+
+
+def use_store(directory):
+    """Points the archiver at empty collections and an archive directory under directory"""
+    store = LocalStore(os.path.join(directory, "db.json"), os.path.join(directory, "db.log"))
+    retention.users_collection = LocalCollection("users", store)
+    retention.users_collection.create_index("email")
+    retention.meal_plans_collection = LocalCollection("meal_plans", store)
+    retention.meal_plans_collection.create_index(["user_email", "active"], sort_field="created_at")
+    retention.meal_plans_collection.create_index([], sort_field="created_at")
+    retention.chat_history_collection = LocalCollection("chat_history", store)
+    retention.chat_history_collection.create_index("user_email", sort_field="timestamp")
+    retention.chat_history_collection.create_index([], sort_field="timestamp")
+    retention.ARCHIVE_DIR = os.path.join(directory, "archive")
+    # Small batches, so kept and cold documents straddle batch boundaries
+    retention.ARCHIVE_BATCH_SIZE = 7
+    retention.RETENTION_POLICIES["chat_history"]["keep_last"] = KEEP_LAST
+
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+async def seed_chat(rng):
+    """Chat turns of three users around the 30-day cutoff; returns the _ids expected to be archived"""
+    turns = []
+    # Only old turns: their newest KEEP_LAST stay although they are cold
+    turns += [{"user_email": "old@example.com", "timestamp": days_ago(40 + i)} for i in range(20)]
+    # Fresh turns cover keep_last, so every old one goes
+    turns += [{"user_email": "mixed@example.com", "timestamp": days_ago(31 + i)} for i in range(12)]
+    turns += [{"user_email": "mixed@example.com", "timestamp": days_ago(i)} for i in range(5)]
+    # Either side of the cutoff
+    turns += [{"user_email": "edge@example.com", "timestamp": days_ago(days)} for days in (29.9, 30.1)]
+    turns += [{"user_email": "edge@example.com", "timestamp": days_ago(days)} for days in (1, 2, 3)]
+    rng.shuffle(turns)
+    for turn in turns:
+        turn["text"] = f"question {rng.randint(0, 1000)}"
+        await retention.chat_history_collection.insert_one(turn)
+
+    cutoff = days_ago(30)
+    expected = set()
+    for email in {turn["user_email"] for turn in turns}:
+        own = sorted((t for t in turns if t["user_email"] == email), key=lambda t: t["timestamp"], reverse=True)
+        expected |= {t["_id"] for t in own[KEEP_LAST:] if t["timestamp"] < cutoff}
+    return expected
+
+
+async def seed_plans():
+    """Plans of users with and without a current plan pointer; returns (expected archived _ids, kept current ids)"""
+    plans = retention.meal_plans_collection
+    await retention.users_collection.insert_one({"email": "pointer@example.com"})
+    await retention.users_collection.insert_one({"email": "legacy@example.com"})
+    ids = {}
+    for label, email, days, active in (
+        # The pointer holds back an old plan, while newer ones are superseded
+        ("pointed", "pointer@example.com", 20, False),
+        ("pointer_old", "pointer@example.com", 30, False),
+        ("pointer_newer", "pointer@example.com", 10, True),
+        ("pointer_fresh", "pointer@example.com", 2, True),
+        # No pointer yet: the newest active plan is current and gets the pointer
+        ("legacy_old", "legacy@example.com", 40, False),
+        ("legacy_current", "legacy@example.com", 15, True),
+        ("legacy_older_active", "legacy@example.com", 25, True),
+        # No user document: the newest plan stays
+        ("orphan_old", "orphan@example.com", 30, False),
+        ("orphan_newest", "orphan@example.com", 20, False),
+    ):
+        doc = await plans.insert_one({"user_email": email, "created_at": days_ago(days), "active": active,
+                                      "plan_data": {"label": label}})
+        ids[label] = doc["_id"]
+    await retention.set_current_plan("pointer@example.com", ids["pointed"])
+
+    archived = {ids[label] for label in ("pointer_old", "pointer_newer", "legacy_old", "legacy_older_active", "orphan_old")}
+    return archived, {"pointer@example.com": ids["pointed"], "legacy@example.com": ids["legacy_current"]}
+
+
+async def remaining_ids(collection):
+    return {doc["_id"] for doc in await (await collection.find({}, {"_id": 1})).to_list()}
+
+
+async def verify_archive():
+    print("Verifying the archiver moves exactly the cold documents...")
+    rng = random.Random(11)
+    chat_expected = await seed_chat(rng)
+    plans_expected, current = await seed_plans()
+    chat_before = await (await retention.chat_history_collection.find({})).to_list()
+    plans_before = await (await retention.meal_plans_collection.find({})).to_list()
+
+    archived = await retention.archive_once()
+    chat_left = await remaining_ids(retention.chat_history_collection)
+    plans_left = await remaining_ids(retention.meal_plans_collection)
+    chat_ok = archived["chat_history"] == len(chat_expected) \
+        and chat_left == {d["_id"] for d in chat_before} - chat_expected
+    plans_ok = archived["meal_plans"] == len(plans_expected) \
+        and plans_left == {d["_id"] for d in plans_before} - plans_expected
+    if chat_ok and plans_ok:
+        print(f"SUCCESS: Archived {archived['chat_history']} chat turns and {archived['meal_plans']} meal plans, "
+              f"keeping each user's newest {KEEP_LAST} turns and current plan.")
+    else:
+        print(f"FAILURE: archived={archived}, expected {len(chat_expected)} turns and {len(plans_expected)} plans.")
+
+    # Users without a pointer get one for the plan that was kept
+    pointers = {email: (await retention.users_collection.find_one({"email": email}))["current_meal_plan_id"]
+                for email in current}
+    if pointers == current:
+        print("SUCCESS: The current plan pointer was kept and backfilled.")
+    else:
+        print(f"FAILURE: pointers={pointers}, expected {current}.")
+
+    # The segments hold the archived documents unchanged
+    chat_archive = list(retention.read_archive("chat_history"))
+    plans_archive = list(retention.read_archive("meal_plans"))
+    own = list(retention.read_archive("chat_history", "old@example.com"))
+    by_id = lambda docs: sorted(docs, key=lambda d: d["_id"])
+    if by_id(chat_archive) == by_id(d for d in chat_before if d["_id"] in chat_expected) \
+            and by_id(plans_archive) == by_id(d for d in plans_before if d["_id"] in plans_expected) \
+            and len(own) == 20 - KEEP_LAST and all(d["user_email"] == "old@example.com" for d in own):
+        print("SUCCESS: read_archive returns the archived documents, also per user.")
+    else:
+        print(f"FAILURE: read_archive returned {len(chat_archive)} turns and {len(plans_archive)} plans.")
+
+    # Nothing is left to archive, and no empty segment is written
+    segments = glob.glob(os.path.join(retention.ARCHIVE_DIR, "*", "*.jsonl.gz"))
+    again = await retention.archive_once()
+    if again == {"chat_history": 0, "meal_plans": 0} \
+            and glob.glob(os.path.join(retention.ARCHIVE_DIR, "*", "*.jsonl.gz")) == segments:
+        print("SUCCESS: A second run archived nothing.")
+    else:
+        print(f"FAILURE: A second run archived {again}.")
+
+
+async def main():
+    original = (retention.users_collection, retention.meal_plans_collection, retention.chat_history_collection,
+                retention.ARCHIVE_DIR, retention.ARCHIVE_BATCH_SIZE, retention.RETENTION_POLICIES["chat_history"]["keep_last"])
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            use_store(directory)
+            await verify_archive()
+    finally:
+        (retention.users_collection, retention.meal_plans_collection, retention.chat_history_collection,
+         retention.ARCHIVE_DIR, retention.ARCHIVE_BATCH_SIZE, retention.RETENTION_POLICIES["chat_history"]["keep_last"]) = original
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import asyncio
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.single_flight import SingleFlight
+
+
+class Call:
+    """A slow call that counts how often it ran"""
+
+    def __init__(self, result=None, error=None, delay=0.05):
+        self.result, self.error, self.delay = result, error, delay
+        self.runs = 0
+        self.finished = False
+
+    async def __call__(self):
+        self.runs += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.finished = True
+        return self.result
+
+
+async def verify_coalescing():
+    print("Verifying concurrent identical calls share one run...")
+    flight = SingleFlight()
+    call = Call({"meal_plan": {"day_1": ["Pittu"]}})
+    other = Call({"meal_plan": {}})
+    results = await asyncio.gather(*[flight.do("plan", call) for _ in range(10)], flight.do("other", other))
+
+    # Each caller may change its result without the others seeing it
+    results[0]["meal_plan"]["day_1"].append("changed")
+    independent = all(r == {"meal_plan": {"day_1": ["Pittu"]}} for r in results[1:10])
+    copies = len({id(r) for r in results[:10]}) == 10
+    if call.runs == 1 and other.runs == 1 and independent and copies and not flight._calls:
+        print("SUCCESS: 10 callers got independent copies of a single run; other keys ran on their own.")
+    else:
+        print(f"FAILURE: runs={call.runs}, independent={independent}, copies={copies}, left={list(flight._calls)}")
+
+
+async def verify_cancellation():
+    print("Verifying a cancelled caller does not cancel the shared call...")
+    flight = SingleFlight()
+    call = Call("plan", delay=0.1)
+    leaving = asyncio.create_task(flight.do("plan", call))
+    staying = asyncio.create_task(flight.do("plan", call))
+    await asyncio.sleep(0.02)
+    leaving.cancel()
+    result = await staying
+
+    # Even when every caller leaves, the call runs to the end
+    alone = Call("plan", delay=0.05)
+    task = asyncio.create_task(flight.do("alone", alone))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.1)
+    if leaving.cancelled() and result == "plan" and call.runs == 1 and alone.finished and not flight._calls:
+        print("SUCCESS: The remaining caller got the result and the call finished.")
+    else:
+        print(f"FAILURE: result={result}, runs={call.runs}, finished alone={alone.finished}")
+
+
+async def verify_errors():
+    print("Verifying an error reaches every caller and is not remembered...")
+    flight = SingleFlight()
+    failing = Call(error=RuntimeError("rate limited"))
+    outcomes = await asyncio.gather(*[flight.do("plan", failing) for _ in range(3)], return_exceptions=True)
+    shared = failing.runs == 1 and all(isinstance(o, RuntimeError) for o in outcomes)
+
+    # The next call after the failure runs again
+    retry = Call("plan")
+    result = await flight.do("plan", retry)
+    if shared and retry.runs == 1 and result == "plan" and not flight._calls:
+        print("SUCCESS: The failure was shared once, then the key was forgotten.")
+    else:
+        print(f"FAILURE: shared={shared}, retried={retry.runs}, result={result}")
+
+
+async def main():
+    await verify_coalescing()
+    await verify_cancellation()
+    await verify_errors()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
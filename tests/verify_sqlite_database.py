@@ -0,0 +1,172 @@
+import asyncio
+import multiprocessing
+import random
+import sys
+import os
+import tempfile
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.local_database import LocalStore, LocalCollection, InsertOne, UpdateOne, UpdateMany, DeleteOne, BulkWriteError
+from app.sqlite_database import SQLiteStore, SQLiteCollection
+
+
+def make_local(directory):
+    return LocalStore(os.path.join(directory, "db.json"), os.path.join(directory, "db.log"))
+
+
+def make_sqlite(directory, seed=None):
+    return SQLiteStore(os.path.join(directory, "db.sqlite3"), seed=seed)
+
+
+async def run_ops(plans):
+    """The same writes against either backend; returns the results they reported"""
+    plans.create_index(["user_email", "active"], sort_field="created_at")
+    rng = random.Random(7)
+    emails = [f"user{i}@example.com" for i in range(4)]
+    results = []
+    for i in range(120):
+        await plans.insert_one({
+            "user_email": rng.choice(emails),
+            "created_at": f"2025-01-{rng.randint(1, 9):02d}",
+            "active": rng.random() < 0.6,
+            "views": 0,
+            "tags": [],
+            "plan_data": {"day_1": {"breakfast": f"meal {i}"}},
+        })
+    for _ in range(40):
+        email = rng.choice(emails)
+        results.append(await plans.update_one({"user_email": email}, {"$inc": {"views": 2}, "$push": {"tags": "seen"}}))
+        results.append(await plans.update_many({"user_email": email, "active": True}, {"$set": {"active": False}}))
+        await plans.delete_one({"user_email": rng.choice(emails), "active": False})
+    results.append(await plans.bulk_write([
+        InsertOne({"user_email": emails[0], "created_at": "2025-02-01", "active": True, "views": 0, "tags": []}),
+        UpdateOne({"user_email": emails[1]}, {"$inc": {"views": 5}}),
+        UpdateMany({"user_email": emails[2]}, {"$push": {"tags": "bulk"}}),
+        DeleteOne({"user_email": emails[3]}),
+    ]))
+    try:
+        # The duplicate _id fails; unordered writes carry on past it
+        await plans.bulk_write([InsertOne({"_id": "1"}), UpdateOne({"user_email": emails[0]}, {"$inc": {"views": 1}})],
+                               ordered=False)
+    except BulkWriteError as e:
+        results.append((e.details["matched_count"], len(e.details["errors"])))
+
+    for email in emails:
+        for query in ({"user_email": email}, {"user_email": email, "active": True}, {"_id": "5"}):
+            cursor = (await plans.find(query, {"plan_data": 0})).sort("created_at", -1).skip(1)
+            results.append(await cursor.to_list(length=5))
+            results.append(await plans.find_one(query, {"views": 1, "tags": 1}))
+            results.append(await plans.count_documents(query))
+            results.append(await plans.exists(query))
+    results.append([doc async for doc in await plans.find({}, {"_id": 0, "user_email": 1})])
+    return results
+
+
+async def verify_parity(directory):
+    print("Verifying the SQLite backend against LocalCollection...")
+    local = await run_ops(LocalCollection("meal_plans", make_local(directory)))
+    sqlite = await run_ops(SQLiteCollection("meal_plans", make_sqlite(directory)))
+    mismatches = [i for i, (a, b) in enumerate(zip(local, sqlite)) if a != b]
+    if len(local) == len(sqlite) and not mismatches:
+        print(f"SUCCESS: {len(local)} reads and write results match.")
+    else:
+        print(f"FAILURE: {len(mismatches)} results differ, first at {mismatches[:1]}.")
+
+
+def _seed_worker(directory, queue):
+    async def run():
+        store = make_sqlite(directory, seed=make_local(os.path.join(directory, "seed")))
+        users = SQLiteCollection("users", store)
+        queue.put(await users.count_documents({}))
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        queue.put(repr(e))
+
+
+def _write_worker(directory, worker_id):
+    async def run():
+        store = make_sqlite(directory)
+        messages = SQLiteCollection("chat_history", store)
+        counters = SQLiteCollection("counters", store)
+        for i in range(50):
+            await messages.insert_one({"user_email": f"worker{worker_id}@example.com", "text": str(i)})
+            await counters.update_one({"name": "total"}, {"$inc": {"value": 1}})
+            # Reads must see what the other workers committed
+            await messages.find_one({"user_email": f"worker{(worker_id + 1) % 4}@example.com"})
+    asyncio.run(run())
+
+
+async def verify_multiprocess(directory):
+    print("Verifying seeding and concurrent writers in separate processes...")
+    seed_dir = os.path.join(directory, "seed")
+    os.makedirs(seed_dir)
+    users = LocalCollection("users", make_local(seed_dir))
+    for i in range(25):
+        await users.insert_one({"email": f"user{i}@example.com"})
+
+    # Every worker opens the new database at once; exactly one seeds it
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_seed_worker, args=(directory, queue)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    counts = [queue.get() for _ in workers]
+    for w in workers:
+        w.join()
+    if counts == [25] * 4:
+        print("SUCCESS: The database was seeded once and every worker saw it.")
+    else:
+        print(f"FAILURE: Workers saw {counts}.")
+
+    await SQLiteCollection("counters", make_sqlite(directory)).insert_one({"name": "total", "value": 0})
+    workers = [multiprocessing.Process(target=_write_worker, args=(directory, i)) for i in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    store = make_sqlite(directory)
+    docs = await (await SQLiteCollection("chat_history", store).find({})).to_list()
+    total = await SQLiteCollection("counters", store).find_one({"name": "total"})
+    if len(docs) == 200 and len({d["_id"] for d in docs}) == 200 and total["value"] == 200:
+        print("SUCCESS: No writes were lost across processes.")
+    else:
+        print(f"FAILURE: Expected 200 unique messages and a count of 200, found {len(docs)} and {total['value']}.")
+
+
+async def verify_generated_ids(directory):
+    print("Verifying generated ids skip ids given explicitly...")
+    local = LocalCollection("users", make_local(directory))
+    await local.insert_many([{"email": "a@example.com"}, {"email": "b@example.com"}])
+    users = SQLiteCollection("users", make_sqlite(directory, seed=local.store))
+    seeded = await users.count_documents({})
+
+    # Ids the row sequence reaches later, seeded or inserted, e.g. by a migration
+    ids = {}
+    for backend, collection in (("local", local), ("sqlite", users)):
+        await collection.insert_one({"_id": "4", "email": "c@example.com"})
+        try:
+            for i in range(3):
+                await collection.insert_one({"email": f"new{i}@example.com"})
+        except Exception as e:
+            print(f"FAILURE: {backend} insert failed: {e}")
+            return
+        ids[backend] = [doc["_id"] for doc in await (await collection.find({})).to_list()]
+    if seeded == 2 and ids["sqlite"] == ids["local"] and len(set(ids["sqlite"])) == 6:
+        print(f"SUCCESS: Both backends gave out the ids {ids['sqlite']}.")
+    else:
+        print(f"FAILURE: local ids {ids['local']}, SQLite ids {ids['sqlite']}.")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_parity(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_multiprocess(directory)
+    with tempfile.TemporaryDirectory() as directory:
+        await verify_generated_ids(directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())